@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import sys
+import time
+import heapq
+import random
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+from hanads.traceutils import TraceTokenizer, FileSeq, mergeTrace, \
+    mergeTraceLoserTree, orderTraceFiles
+from hanads.tracemanifest import loadTraceListPerService
+
+
+class __Conf:
+    def __init__(self):
+        parser = argparse.ArgumentParser(description="Compare the merge engines of tracezipper on the same fsid")
+
+        parser.add_argument('fsidpath', nargs='*', help='Path to full system info dump directory or tar/tar.gz/zip archive of it. The trace files of a tar.gz/.bz2/.xz are unpacked into a temporary directory in one pass')
+        parser.add_argument('-r','--repeat', type=int, default=3, help='Runs per engine, the fastest one is reported (default: 3)')
+        parser.add_argument('--synthetic', action='store_true', help='Merge generated in-memory streams from 2 to 512 services instead of an fsid')
+        parser.add_argument('--entries', type=int, default=200000, help='Number of generated trace entries for --synthetic (default: 200000)')
+
+        args = parser.parse_args()
+
+        if not args.synthetic and not args.fsidpath:
+            parser.error('fsidpath is required without --synthetic')
+
+        self.fsidpath = args.fsidpath
+        self.repeat = args.repeat
+        self.synthetic = args.synthetic
+        self.entries = args.entries
+
+
+class HashSink:
+    """
+    Binary output that only keeps a digest to compare the engines
+    """
+    def __init__(self):
+        self.digest = hashlib.md5()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+
+
+class ListTokenizer:
+    """
+    TraceTokenizer over generated (timestamp, entry) pairs in memory,
+    so only the merge itself is measured
+    """
+    def __init__(self, entries):
+        self.__entries = entries
+        self.__idx = 0
+
+    def __iter__(self):
+        return self
+
+    def nextTimestamp(self):
+        if self.__idx < len(self.__entries):
+            return self.__entries[self.__idx][0]
+
+        return None
+
+    def __next__(self):
+        if self.__idx >= len(self.__entries):
+            raise StopIteration
+
+        self.__idx += 1
+
+        return self.__entries[self.__idx - 1]
+
+
+def generateStreams(streamCount, entryCount):
+    """
+    Returns entryCount trace entries spread over streamCount services
+    """
+    rand = random.Random(streamCount)
+    timestamp = datetime(2018, 2, 24, 19, 0, 0)
+    streams = [[] for _ in range(streamCount)]
+
+    for _ in range(entryCount):
+        timestamp += timedelta(microseconds=rand.randint(0, 2000))
+        ts = timestamp.strftime('%Y-%m-%d %H:%M:%S.%f ')
+        line = "[1000]{-1}[-1/-1] " + ts + "i Basis            |\n"
+
+        # services write in bursts, so keep the last one half of the time
+        if not streams[0] or rand.random() < 0.5:
+            current = rand.randrange(streamCount)
+
+        streams[current].append((ts, [line]))
+
+    return [(("host{0:03}".format(idx), "indexserver:30003"), entries)
+            for idx, entries in enumerate(streams) if entries]
+
+
+def tokenizeServices(services):
+    queue = []
+
+    for key, files in services:
+        tracetokenizer = TraceTokenizer(FileSeq(files))
+
+        if tracetokenizer.nextTimestamp() is not None:
+            heapq.heappush(
+                queue, (tracetokenizer.nextTimestamp(), key, tracetokenizer))
+
+    return queue
+
+
+def heapify(queue):
+    heapq.heapify(queue)
+
+    return queue
+
+
+def runHeap(queue, sink):
+    for entry in mergeTrace(queue):
+        sink.write(entry.encode())
+
+
+def runLoserTree(queue, sink):
+    for entry in mergeTraceLoserTree(queue):
+        sink.write(entry.encode())
+
+
+def runBulk(services, sink):
+    from hanads.bulkmerge import bulkMerge
+
+    bulkMerge(services, sink)
+
+
+def measure(name, engine, prepare, repeat):
+    best = None
+
+    for _ in range(repeat):
+        sink = HashSink()
+        engineInput = prepare()
+        start = time.perf_counter()
+        engine(engineInput, sink)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    print("{0:<10} {1:>10.3f} {2:>14} {3}".format(name, best, sink.size, sink.digest.hexdigest()))
+    sys.stdout.flush()
+
+
+def main():
+    conf = __Conf()
+
+    if conf.synthetic:
+        streamCount = 2
+
+        while streamCount <= 512:
+            streams = generateStreams(streamCount, conf.entries)
+
+            def prepare():
+                return [(entries[0][0], key, ListTokenizer(entries))
+                        for key, entries in streams]
+
+            print("{0} streams, {1} entries".format(streamCount, conf.entries))
+            print("{0:<10} {1:>10} {2:>14} {3}".format('engine', 'seconds', 'output bytes', 'md5'))
+            measure('heap', runHeap, lambda: heapify(prepare()), conf.repeat)
+            measure('losertree', runLoserTree, prepare, conf.repeat)
+            print()
+
+            streamCount *= 2
+
+        return
+
+    tracedictionary = loadTraceListPerService(conf.fsidpath)
+    services = [(key, orderTraceFiles(tracedictionary[key]))
+                for key in sorted(tracedictionary.keys())]
+
+    print("{0:<10} {1:>10} {2:>14} {3}".format('engine', 'seconds', 'output bytes', 'md5'))
+    measure('heap', runHeap, lambda: tokenizeServices(services), conf.repeat)
+    measure('losertree', runLoserTree, lambda: tokenizeServices(services), conf.repeat)
+    measure('bulk', runBulk, lambda: services, conf.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import gc
+import sys
+import time
+import tracemalloc
+import random
+import argparse
+from hanads.stackshortutils import StackShortBuilder, StackShortThreadInfo, \
+    StackShortFrame, threadRegexComp, frameRegexComp, findSameThread
+
+
+class __Conf:
+    def __init__(self):
+        parser = argparse.ArgumentParser(description="Measure the [STACK_SHORT] parser and stack objects on an RTE dump and check them against the regex-per-state parser with the legacy objects")
+
+        parser.add_argument('rte', nargs='*', help='RTE dump files. If not given a dump is generated.')
+        parser.add_argument('-r','--repeat', type=int, default=3, help='Runs per parser, the fastest one is reported (default: 3)')
+        parser.add_argument('--threads', type=int, default=10000, help='Number of threads of the generated dump (default: 10000)')
+        parser.add_argument('--dumps', type=int, default=10, help='Number of dumps findSameThread is measured with, all the same section (default: 10)')
+
+        args = parser.parse_args()
+
+        self.rte = args.rte
+        self.repeat = args.repeat
+        self.threads = args.threads
+        self.dumps = args.dumps
+
+
+class LegacyThreadInfo():
+    def __init__(self, threadString):
+        m = threadRegexComp.match(threadString)
+
+        self.context = m.group(1)
+        self.tid = m.group(2)
+        self.name = m.group(3)
+        self.active = m.group(4)
+
+    __str__ = StackShortThreadInfo.__str__
+    __eq__ = StackShortThreadInfo.__eq__
+
+    def __hash__(self):
+        return hash(self.context + self.tid + self.name + self.active)
+
+
+class LegacyFrame():
+    def __init__(self, frameString):
+        m = frameRegexComp.match(frameString)
+
+        self.frame = m.group(1)
+        self.address = m.group(2)
+        self.function = m.group(3)
+        self.offset = m.group(4)
+        self.source = m.group(6)
+        self.line = m.group(7)
+        self.lib = m.group(8)
+
+    __str__ = StackShortFrame.__str__
+
+
+class LegacyStack(list):
+    def __str__(self):
+        str = ""
+        for i in self:
+            str = str + i.__str__() + "\n"
+
+        return str
+
+    def __eq__(self, other):
+        return self.__dict__ == other.__dict__
+
+    def __hash__(self):
+        return hash(self.__str__())
+
+    def dedupKey(self):
+        return tuple([frame.function for frame in self])
+
+
+class RegexStackShortBuilder():
+    """
+    StackShortBuilder and its objects as they were before the single match
+    rewrite and the compact model: the state is compared as string on every
+    line, a matched line is parsed again by the constructors and every
+    frame is an object with its own strings
+    """
+    def __init__(self):
+        self.state = "INIT"
+
+        self.threadDictionary = {}
+        self.dedupDictionary = {}
+
+        self.workingThreadInfo = None
+        self.workingCallStack = None
+
+    def __buildResult(self):
+        self.threadDictionary[self.workingThreadInfo] = self.workingCallStack
+
+        dedupKey = self.workingCallStack.dedupKey()
+
+        if dedupKey not in self.dedupDictionary:
+            self.dedupDictionary[dedupKey] = []
+
+        self.dedupDictionary[dedupKey].append(self.workingThreadInfo)
+
+    def input(self, inputString):
+        if self.state == "INIT":
+            threadMatch = threadRegexComp.match(inputString)
+
+            if threadMatch is not None:
+                self.workingThreadInfo = LegacyThreadInfo(inputString)
+                self.workingCallStack = LegacyStack()
+                self.state = "THREAD"
+
+            elif inputString[0:4] == '[OK]':
+                self.__buildResult()
+                self.state = "DONE"
+
+            else:
+                self.state = "SKIP"
+
+        elif self.state == "THREAD" or self.state == "FRAME":
+            frameMatch = frameRegexComp.match(inputString)
+
+            if frameMatch is not None:
+                self.workingCallStack.append(LegacyFrame(inputString))
+                self.state = "FRAME"
+
+            elif inputString[0:2] == '--':
+                self.__buildResult()
+                self.state = "INIT"
+
+            else:
+                self.state = "SKIP"
+
+        elif self.state == "SKIP":
+            if inputString[0:2] == '--':
+                self.state = "INIT"
+            elif inputString[0:4] == '[OK]':
+                self.state = "DONE"
+
+    def feed(self, inputStream):
+        for line in inputStream:
+            self.input(line)
+
+            if self.state == 'DONE':
+                break
+
+
+def frameLine(rand, frame, function, libs):
+    address = "0x{0:016x}".format(rand.getrandbits(47))
+    offset = "0x{0:x}".format(rand.randint(1, 0x800))
+
+    if rand.random() < 0.5:
+        return "{0:>2}: {1} in {2}+{3} at File{4}.cpp:{5} ({6})\n".format(
+            frame, address, function, offset, frame % 17,
+            rand.randint(1, 3000), rand.choice(libs))
+
+    return "{0:>2}: {1} in {2}+{3} ({4})\n".format(
+        frame, address, function, offset, rand.choice(libs))
+
+
+def generateRTE(threadCount):
+    """
+    Returns the lines of an RTE dump with a [STACK_SHORT] section of
+    threadCount threads. Most threads wait in a few common stacks, which
+    have the same frame lines in every thread like in a real dump.
+    """
+    rand = random.Random(threadCount)
+    functions = ["Namespace{0}::Class{1}::method{2}(int, char const*)"
+                 .format(n % 7, n % 13, n) for n in range(300)]
+    libs = ['libc.so.6', 'libhdbbasis.so', 'libhdbcs.so', 'libhdbrskernel.so']
+    names = ['JobWrk{0}', 'SqlExecutor', 'Request', 'WorkerThread (StatisticsServer)']
+
+    common = [[frameLine(rand, frame, rand.choice(functions), libs)
+               for frame in range(1, rand.randint(5, 40) + 1)]
+              for _ in range(50)]
+
+    lines = ["[BUILD]  Build information: (2018-02-24 19:23:53 138 Local)\n",
+             "\n",
+             "[STACK_SHORT]  Short call stacks and pending exceptions of all threads: (2018-02-24 19:23:53 139 Local)\n",
+             "\n"]
+
+    for tid in range(threadCount):
+        name = rand.choice(names).format(tid)
+
+        if rand.random() < 0.2:
+            lines.append("{0}[thr={1}]: {2} is inactive\n"
+                         .format(rand.randint(1, 10**9), 10000 + tid, name))
+            lines.append("--\n")
+            continue
+
+        lines.append("{0}[thr={1}]: {2} at\n"
+                     .format(rand.randint(1, 10**9), 10000 + tid, name))
+
+        if rand.random() < 0.8:
+            stack = rand.choice(common)
+        else:
+            stack = [frameLine(rand, frame, rand.choice(functions), libs)
+                     for frame in range(1, rand.randint(5, 120) + 1)]
+
+        for line in stack:
+            lines.append(line)
+
+            # lines the parser doesn't know skip the rest of the stack
+            if rand.random() < 0.0005:
+                lines.append("  exception  1: no.1000001  (ptime/ThreadAPI.cpp:123)\n")
+
+        lines.append("--\n")
+
+    lines.append("[OK]\n")
+    lines.append("[THREADS]  Running threads: (2018-02-24 19:23:53 140 Local)\n")
+
+    return lines
+
+
+def parseSection(builder, lines):
+    lines = iter(lines)
+
+    for line in lines:
+        if line[0:13] == '[STACK_SHORT]':
+            break
+
+    builder.feed(lines)
+
+    return builder
+
+
+def summary(builder):
+    """
+    Comparable result of a builder, the legacy stack compares equal to any
+    other stack so the text of the stacks is compared
+    """
+    threads = sorted((str(thread), str(stack))
+                     for thread, stack in builder.threadDictionary.items())
+    dedup = sorted((key, [str(thread) for thread in value])
+                   for key, value in builder.dedupDictionary.items())
+
+    return threads, dedup
+
+
+def retained(builderClass, lines):
+    """
+    Bytes allocated by parsing the section which are still held by the builder
+    """
+    gc.collect()
+    tracemalloc.start()
+
+    builder = parseSection(builderClass(), lines)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+
+    tracemalloc.stop()
+
+    return size
+
+
+def measure(name, builderClass, lines, repeat, dumps):
+    best = None
+
+    for _ in range(repeat):
+        # objects of the previous run would slow down the collector
+        builder = None
+        gc.collect()
+
+        builder = builderClass()
+        start = time.perf_counter()
+        parseSection(builder, lines)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    # the same section as if it was in many dumps
+    start = time.perf_counter()
+    findSameThread([builder.threadDictionary] * dumps)
+    findSameThread([builder.threadDictionary] * dumps, simpleMatch=True)
+    match = time.perf_counter() - start
+
+    result = summary(builder)
+    builder = None
+
+    print("{0:<10} {1:>10.3f} {2:>10.3f} {3:>10.1f} {4:>10} {5:>10}".format(name, best, match, retained(builderClass, lines) / 2**20, len(result[0]), len(result[1])))
+    sys.stdout.flush()
+
+    return result
+
+
+def main():
+    conf = __Conf()
+
+    if conf.rte:
+        dumps = []
+
+        for filename in conf.rte:
+            with open(filename) as rte:
+                dumps.append((filename, rte.readlines()))
+    else:
+        dumps = [("generated {0} threads".format(conf.threads),
+                  generateRTE(conf.threads))]
+
+    for name, lines in dumps:
+        print("{0}, {1} lines".format(name, len(lines)))
+        print("{0:<10} {1:>10} {2:>10} {3:>10} {4:>10} {5:>10}".format('parser', 'seconds', 'match', 'MB', 'threads', 'stacks'))
+
+        legacy = measure('legacy', RegexStackShortBuilder, lines, conf.repeat, conf.dumps)
+        current = measure('current', StackShortBuilder, lines, conf.repeat, conf.dumps)
+
+        if legacy != current:
+            print("results differ")
+            sys.exit(1)
+
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import numpy as np
+from hanads.traceutils import servicePrefix, isPlainFile, \
+    mapTraceFile, ReadAhead
+
+# Entry header '[pid]{conn}[txn/upd]' must end within this many bytes
+HEADER_WINDOW = 96
+
+# Number of header candidates checked in one vectorized pass
+CANDIDATE_CHUNK = 1 << 20
+
+# Number of merged entries joined before one write call
+WRITE_CHUNK = 1 << 14
+
+# Layout of the timestamp following the header
+# 2018-02-24 19:23:53.952603
+TIMESTAMP_TEMPLATE = b'0000-00-00 00:00:00.000000'
+TIMESTAMP_LENGTH = len(TIMESTAMP_TEMPLATE)
+
+templateBytes = np.frombuffer(TIMESTAMP_TEMPLATE, dtype=np.uint8)
+templateDigits = templateBytes == ord('0')
+
+
+def gather(data, positions, width):
+    """
+    Returns a (len(positions), width) matrix of the bytes at the positions
+    """
+    index = positions[:, None] + np.arange(width)
+    np.minimum(index, len(data) - 1, out=index)
+
+    return data[index]
+
+
+def timestampsToMicros(ts):
+    """
+    ts = (n, 26) matrix of timestamp bytes
+    Returns int64 epoch microseconds
+    """
+    d = ts.astype(np.int64) - ord('0')
+
+    year = d[:, 0]*1000 + d[:, 1]*100 + d[:, 2]*10 + d[:, 3]
+    month = d[:, 5]*10 + d[:, 6]
+    day = d[:, 8]*10 + d[:, 9]
+    hour = d[:, 11]*10 + d[:, 12]
+    minute = d[:, 14]*10 + d[:, 15]
+    second = d[:, 17]*10 + d[:, 18]
+    micro = d[:, 20]*100000 + d[:, 21]*10000 + d[:, 22]*1000 \
+        + d[:, 23]*100 + d[:, 24]*10 + d[:, 25]
+
+    days = ((year - 1970).astype('datetime64[Y]').astype('datetime64[M]')
+            + (month - 1)).astype('datetime64[D]') + (day - 1)
+
+    return ((days.astype(np.int64)*24 + hour)*60 + minute)*60*1000000 \
+        + second*1000000 + micro
+
+
+def timestampToMicros(timestamp):
+    """
+    Converts a normalized timestamp string into int64 epoch microseconds
+    """
+    ts = np.frombuffer(timestamp[0:TIMESTAMP_LENGTH].encode(), dtype=np.uint8)
+
+    return int(timestampsToMicros(ts[None, :])[0])
+
+
+def scanHeaders(data):
+    """
+    data = uint8 array of a whole trace file
+    Returns offsets and epoch microseconds of all entry headers
+    """
+    candidates = np.flatnonzero((data[:-1] == ord('\n'))
+                                & (data[1:] == ord('['))) + 1
+
+    if len(data) > 0 and data[0] == ord('['):
+        candidates = np.concatenate(([0], candidates))
+
+    offsets = []
+    micros = []
+
+    for begin in range(0, len(candidates), CANDIDATE_CHUNK):
+        chunk = candidates[begin:begin + CANDIDATE_CHUNK]
+        header = gather(data, chunk, HEADER_WINDOW)
+        column = np.arange(HEADER_WINDOW)
+
+        # '[pid]{conn}[txn/upd] ' - the first space closes the header
+        isSpace = header == ord(' ')
+        space = isSpace.argmax(axis=1)
+        rows = np.arange(len(chunk))
+        beforeSpace = column < space[:, None]
+
+        valid = isSpace[rows, space] \
+            & (header[rows, np.maximum(space - 1, 0)] == ord(']')) \
+            & (header[:, 1] >= ord('0')) & (header[:, 1] <= ord('9')) \
+            & ((header == ord('{')) & beforeSpace).any(axis=1) \
+            & ((header == ord('/')) & beforeSpace).any(axis=1)
+
+        ts = gather(data, chunk + space + 1, TIMESTAMP_LENGTH)
+
+        valid &= ((ts == templateBytes) | (templateDigits
+                  & (ts >= ord('0')) & (ts <= ord('9')))).all(axis=1)
+
+        offsets.append(chunk[valid])
+        micros.append(timestampsToMicros(ts[valid]))
+
+    if not offsets:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    return np.concatenate(offsets), np.concatenate(micros)
+
+
+class ServiceEntries():
+    """
+    All trace entries of one service as arrays:
+    fileIdx, start, end = where the entry is, micros = its timestamp
+    Lines at the beginning of a file before the first header belong to the
+    last entry of the previous file and are kept in continuations.
+    """
+    def __init__(self, files):
+        self.views = []
+        self.continuations = {}
+
+        fileIdx = []
+        starts = []
+        ends = []
+        micros = []
+        lineCounts = []
+        count = 0
+
+        readAhead = ReadAhead(files)
+
+        for idx, fileName in enumerate(files):
+            if not isPlainFile(fileName):
+                fileMap = readAhead.get(idx)
+            else:
+                readAhead.prefetch(idx + 1)
+                fileMap = mapTraceFile(fileName)
+
+            if not fileMap:
+                continue
+
+            self.views.append(memoryview(fileMap))
+
+            data = np.frombuffer(fileMap, dtype=np.uint8)
+            offsets, fileMicros = scanHeaders(data)
+            fileEnds = np.append(offsets[1:], len(data))
+
+            firstHeader = offsets[0] if len(offsets) > 0 else len(data)
+
+            if count > 0 and firstHeader > 0:
+                self.continuations.setdefault(count - 1, []).append(
+                    (len(self.views) - 1, 0, int(firstHeader)))
+
+            newlines = np.flatnonzero(data == ord('\n'))
+            lineCounts.append(np.searchsorted(newlines, fileEnds)
+                              - np.searchsorted(newlines, offsets))
+
+            fileIdx.append(np.full(len(offsets), len(self.views) - 1))
+            starts.append(offsets)
+            ends.append(fileEnds)
+            micros.append(fileMicros)
+            count += len(offsets)
+
+        if count == 0:
+            fileIdx = starts = ends = micros = lineCounts = \
+                [np.zeros(0, dtype=np.int64)]
+
+        self.micros = np.concatenate(micros)
+
+        # Out of order timestamps within a service keep their position
+        # like in mergeTrace, so sort by the highest timestamp so far
+        self.sortKey = np.maximum.accumulate(self.micros) \
+            if count > 0 else self.micros
+
+        # Entries written with a single slice copy: one line, not continued
+        # in the next file and not the last one of the service
+        simple = np.concatenate(lineCounts) <= 1
+
+        if count > 0:
+            simple[-1] = False
+
+        for idx in self.continuations:
+            simple[idx] = False
+
+        self.fileIdx = np.concatenate(fileIdx)
+        self.start = np.concatenate(starts)
+        self.end = np.concatenate(ends)
+        self.simple = simple
+
+    def __len__(self):
+        return len(self.micros)
+
+    def entryTail(self, idx, prefix):
+        """
+        Returns the entry after its first prefix with the prefix in front
+        of every following line
+        """
+        raw = bytes(self.views[self.fileIdx[idx]][int(self.start[idx]):
+                                                  int(self.end[idx])])
+
+        for fileIdx, start, end in self.continuations.get(idx, ()):
+            raw += bytes(self.views[fileIdx][start:end])
+
+        if raw[-1:] == b'\n':
+            raw = raw[:-1].replace(b'\n', b'\n' + prefix) + b'\n'
+        else:
+            raw = raw.replace(b'\n', b'\n' + prefix)
+
+        if idx == len(self) - 1:
+            # The very last line of the trace doesn't have the line break.
+            # Same as mergeTrace, a line break is added.
+            raw += os.linesep.encode()
+
+        return raw
+
+
+def mergeTraceTies(order, serviceIdx, sortKey):
+    """
+    order = entries sorted by (timestamp, service, position)
+    Reorders entries of different services with equal timestamps like
+    mergeTrace, which keeps writing the service it is at while its
+    timestamps don't get newer: the service of the entry written before
+    comes first, the other services follow in service order.
+    """
+    svc = serviceIdx[order]
+    key = sortKey[order]
+    sameKey = key[1:] == key[:-1]
+
+    # where the service changes between entries with equal timestamps
+    mixed = np.flatnonzero(sameKey & (svc[1:] != svc[:-1])) + 1
+
+    if len(mixed) == 0:
+        return order
+
+    groupStarts = np.flatnonzero(np.concatenate(([True], ~sameKey)))
+    groupEnds = np.append(groupStarts[1:], len(order))
+    groups = np.unique(np.searchsorted(groupStarts, mixed, 'right') - 1)
+
+    # in order, the entry before a group can be in the group before
+    for group in groups.tolist():
+        start = int(groupStarts[group])
+        end = int(groupEnds[group])
+
+        if start == 0:
+            continue
+
+        current = np.flatnonzero(svc[start:end] == svc[start - 1])
+
+        if len(current) == 0 or current[0] == 0:
+            continue
+
+        first = start + int(current[0])
+        last = start + int(current[-1]) + 1
+
+        for column in (order, svc):
+            column[start:end] = np.concatenate((column[first:last],
+                                                column[start:first],
+                                                column[last:end]))
+
+    return order
+
+
+def bulkMerge(services, output, since=None, until=None):
+    """
+    services = list of (key, files) in the order used for equal timestamps
+    output = binary file the merged trace is written to
+    since, until = normalized timestamps of the window [since, until)
+    Returns number of written trace entries
+    """
+    entries = [ServiceEntries(files) for key, files in services]
+    prefixes = [servicePrefix(key).encode() for key, files in services]
+
+    sinceMicros = timestampToMicros(since) if since is not None else None
+    untilMicros = timestampToMicros(until) if until is not None else None
+
+    views = []
+    serviceIdx = []
+    entryIdx = []
+    sortKeys = []
+    viewIdx = []
+    starts = []
+    ends = []
+    simple = []
+
+    for count, service in enumerate(entries):
+        viewBase = len(views)
+        views.extend(service.views)
+
+        first = 0
+        last = len(service)
+
+        if sinceMicros is not None:
+            first = np.searchsorted(service.sortKey, sinceMicros, 'left')
+
+        if untilMicros is not None:
+            last = np.searchsorted(service.sortKey, untilMicros, 'left')
+
+        if first >= last:
+            continue
+
+        serviceIdx.append(np.full(last - first, count))
+        entryIdx.append(np.arange(first, last))
+        sortKeys.append(service.sortKey[first:last])
+        viewIdx.append(service.fileIdx[first:last] + viewBase)
+        starts.append(service.start[first:last])
+        ends.append(service.end[first:last])
+        simple.append(service.simple[first:last])
+
+    if not sortKeys:
+        return 0
+
+    # entries of one service are already in order, so sorting by
+    # (timestamp, service, position) is the k-way merge of all services
+    serviceIdx = np.concatenate(serviceIdx)
+    entryIdx = np.concatenate(entryIdx)
+    sortKeys = np.concatenate(sortKeys)
+    order = mergeTraceTies(np.lexsort((entryIdx, serviceIdx, sortKeys)),
+                           serviceIdx, sortKeys)
+
+    columns = [serviceIdx, entryIdx, np.concatenate(viewIdx),
+               np.concatenate(starts), np.concatenate(ends),
+               np.concatenate(simple)]
+
+    for begin in range(0, len(order), WRITE_CHUNK):
+        chunkOrder = order[begin:begin + WRITE_CHUNK]
+        chunk = []
+
+        # python lists are much faster to iterate than numpy arrays
+        for count, idx, view, start, end, isSimple in \
+                zip(*[column[chunkOrder].tolist() for column in columns]):
+            chunk.append(prefixes[count])
+
+            if isSimple:
+                chunk.append(views[view][start:end])
+            else:
+                chunk.append(entries[count].entryTail(idx, prefixes[count]))
+
+        output.write(b''.join(chunk))
+
+    return len(order)
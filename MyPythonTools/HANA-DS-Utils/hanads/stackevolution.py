@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import multiprocessing as mp
+from hanads.stackshortutils import dedupStackShort
+
+# Kinds of events of StackEvolution
+STUCK = 'stuck'
+CHANGED = 'changed'
+
+
+class StackRun():
+    """
+    Stack of a thread in consecutive dumps: the stack, the number of the
+    first dump with it and the number of dumps
+    """
+    __slots__ = ('stack', 'first', 'count')
+
+    def __init__(self, stack, first):
+        self.stack = stack
+        self.first = first
+        self.count = 1
+
+    def last(self):
+        return self.first + self.count - 1
+
+
+class StackEvolution():
+    """
+    Follows the stacks of the threads over dumps given one after another.
+    Only the current StackRun of every thread of the last dump is kept.
+    add() and finish() yield the events:
+    (STUCK, thread, run) when a run of span dumps or more ends,
+    (CHANGED, thread, run) when the stack of a thread differs from the one
+    of the previous dump, run is the run which ended
+    """
+    def __init__(self, span=2, simpleMatch=False, showInactive=False):
+        self.span = span
+        self.simpleMatch = simpleMatch
+        self.showInactive = showInactive
+
+        self.__runs = {}
+        self.__dumps = 0
+
+    def __ended(self, thread, run):
+        if run.count >= self.span \
+                and (len(run.stack) > 0 or self.showInactive):
+            yield STUCK, thread, run
+
+    def add(self, threads):
+        """
+        threads = threadDictionary of the next dump
+        """
+        count = self.__dumps
+        self.__dumps += 1
+
+        runs = {}
+
+        for thread, stack in threads.items():
+            key = stack.dedupKey() if self.simpleMatch else stack
+            run = self.__runs.pop(thread, None)
+
+            if run is not None:
+                if run.stack == key:
+                    run.count += 1
+                    runs[thread] = run
+                    continue
+
+                yield from self.__ended(thread, run)
+                yield CHANGED, thread, run
+
+            runs[thread] = StackRun(key, count)
+
+        # the threads which are gone
+        for thread, run in self.__runs.items():
+            yield from self.__ended(thread, run)
+
+        self.__runs = runs
+
+    def finish(self):
+        for thread, run in self.__runs.items():
+            yield from self.__ended(thread, run)
+
+        self.__runs = {}
+
+    def threads(self):
+        """
+        Number of threads of the last dump
+        """
+        return len(self.__runs)
+
+
+def readThreads(filename):
+    """
+    Worker: threadDictionary of the RTE dump file
+    """
+    with open(filename) as rte:
+        threads, dedup = dedupStackShort(rte)
+
+    return threads
+
+
+def followStacks(filenames, span=2, simpleMatch=False, showInactive=False,
+                 processes=None):
+    """
+    Yields (count of the dump, event) of StackEvolution of the RTE dump
+    files in the given order, the files are parsed ahead in worker
+    processes. Events at the end have the count of the number of files.
+    """
+    evolution = StackEvolution(span, simpleMatch, showInactive)
+
+    if processes is None:
+        processes = min(len(filenames), os.cpu_count() or 1)
+
+    if processes <= 1:
+        results = map(readThreads, filenames)
+        pool = None
+    else:
+        pool = mp.Pool(processes)
+        results = pool.imap(readThreads, filenames, chunksize=1)
+
+    try:
+        for count, threads in enumerate(results):
+            for event in evolution.add(threads):
+                yield count, event
+
+        for event in evolution.finish():
+            yield len(filenames), event
+    finally:
+        if pool is not None:
+            pool.terminate()
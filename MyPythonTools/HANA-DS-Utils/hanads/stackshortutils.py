@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
 # vim: tabstop=4 shiftwidth=4
+import os
 import re
+import sys
+import multiprocessing as mp
+from hashlib import blake2b
+from sys import intern
 
 # 202656343[thr=108664]: JobWrk5176 at
 # OR
@@ -9,6 +14,12 @@ threadRegex = r"([0-9]+)\[thr.([0-9]+)\]: (.+) (is inactive|at)"
 threadRegexComp = re.compile(threadRegex)
 
 class StackShortThreadInfo:
+    """
+    Thread of a [STACK_SHORT] section, compared by all fields.
+    The hash is computed once, the thread is a key of every dictionary.
+    """
+    __slots__ = ('context', 'tid', 'name', 'active', '__hash')
+
     def __init__(self, threadString):
         threadRegexMatch = threadRegexComp.match(threadString)
 
@@ -16,10 +27,36 @@ class StackShortThreadInfo:
             print("Input string is incorrect")
             sys.exit(1)
 
-        self.context = threadRegexMatch.group(1)
-        self.tid = threadRegexMatch.group(2)
-        self.name = threadRegexMatch.group(3)
-        self.active = threadRegexMatch.group(4)
+        self.__set(*threadRegexMatch.group(1, 2, 3, 4))
+
+    @classmethod
+    def fromMatch(cls, threadRegexMatch):
+        """
+        Same as StackShortThreadInfo(line) from the match of threadRegexComp
+        """
+        threadInfo = cls.__new__(cls)
+        threadInfo.__set(*threadRegexMatch.group(1, 2, 3, 4))
+
+        return threadInfo
+
+    @classmethod
+    def fromFields(cls, context, tid, name, active):
+        threadInfo = cls.__new__(cls)
+        threadInfo.__set(context, tid, name, active)
+
+        return threadInfo
+
+    def __reduce__(self):
+        # the hash is computed again where it is unpickled, the hash of
+        # strings differs between processes
+        return (self.fromFields, (self.context, self.tid, self.name, self.active))
+
+    def __set(self, context, tid, name, active):
+        self.context = context
+        self.tid = tid
+        self.name = intern(name)
+        self.active = intern(active)
+        self.__hash = hash(self.context + self.tid + self.name + self.active)
 
     def __str__(self):
         return "{0}[thr={1}]: {2} {3}".format(self.context, self.tid, self.name, self.active)
@@ -28,7 +65,7 @@ class StackShortThreadInfo:
         return (self.context == other.context) and (self.tid == other.tid) and (self.name == other.name) and (self.active == other.active)
 
     def __hash__(self):
-        return hash(self.context + self.tid + self.name + self.active)
+        return self.__hash
 
 
 #  1: 0x00007fd226e07659 in syscall+0x15 (libc.so.6)
@@ -38,16 +75,42 @@ frameRegex = r" *([0-9]+): (0x[0-9a-f]+) in (.*)\+(0x[0-9a-f]+)( at (.*):([0-9]+
 frameRegexComp = re.compile(frameRegex)
 
 class StackShortFrame:
+    """
+    One frame of a stack. Function, source and library names are interned,
+    the same names repeat in the stacks of thousands of threads.
+    """
+    __slots__ = ('frame', 'address', 'function', 'offset', 'source', 'line', 'lib')
+
     def __init__(self, frameString):
-        frameMatch = frameRegexComp.match(frameString)
-        
-        self.frame = frameMatch.group(1)
-        self.address = frameMatch.group(2)
-        self.function = frameMatch.group(3)
-        self.offset = frameMatch.group(4)
-        self.source = frameMatch.group(6)
-        self.line = frameMatch.group(7)
-        self.lib = frameMatch.group(8)
+        self.__set(*frameRegexComp.match(frameString).group(1, 2, 3, 4, 6, 7, 8))
+
+    @classmethod
+    def fromMatch(cls, frameMatch):
+        """
+        Same as StackShortFrame(line) from the match of frameRegexComp
+        """
+        frame = cls.__new__(cls)
+        frame.__set(*frameMatch.group(1, 2, 3, 4, 6, 7, 8))
+
+        return frame
+
+    def __set(self, frame, address, function, offset, source, line, lib):
+        self.frame = intern(frame)
+        self.address = address
+        self.function = intern(function)
+        self.offset = offset
+        self.source = None if source is None else intern(source)
+        self.line = line
+        self.lib = intern(lib)
+
+    def __fields(self):
+        return (self.frame, self.address, self.function, self.offset, self.source, self.line, self.lib)
+
+    def __eq__(self, other):
+        return self is other or self.__fields() == other.__fields()
+
+    def __hash__(self):
+        return hash(self.__fields())
 
     def __str__(self):
         if self.source is None:
@@ -58,107 +121,199 @@ class StackShortFrame:
         return str
 
 
-class StackShortStack(list):
+class StackShortStack:
+    """
+    Immutable sequence of StackShortFrame.
+    The hash and the dedup key are computed once when the stack is built.
+    """
+    __slots__ = ('__frames', '__hash', '__dedupKey')
+
+    def __init__(self, frames=()):
+        self.__frames = tuple(frames)
+        self.__hash = hash(self.__frames)
+        self.__dedupKey = tuple(frame.function for frame in self.__frames)
+
+    def __reduce__(self):
+        return (self.__class__, (self.__frames,))
+
+    def __len__(self):
+        return len(self.__frames)
+
+    def __iter__(self):
+        return iter(self.__frames)
+
+    def __getitem__(self, index):
+        return self.__frames[index]
+
     def __str__(self):
-        str = ""
-        for i in self:
-            str = str + i.__str__() + "\n"
-    
-        return str
+        return "".join([frame.__str__() + "\n" for frame in self.__frames])
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, StackShortStack):
+            return NotImplemented
+
+        return self is other or (self.__hash == other.__hash and self.__frames == other.__frames)
 
     def __hash__(self):
-        return hash(self.__str__())
+        return self.__hash
 
     def dedupKey(self):
-        tmpList = []
+        return self.__dedupKey
+        
 
-        for frame in self:
-            tmpList.append(frame.function)
+# [STACK_SHORT]  Short call stacks and pending exceptions of all threads: (2018-02-24 19:23:53 139 Local)
+sectionRegexComp = re.compile(r".*\((\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) (\d{3})")
+
+def sectionTimestamp(sectionLine):
+    """
+    Timestamp of the [STACK_SHORT] header line in the trace timestamp format
+    e.g.) 2018-02-24 19:23:53.139000, None if it has none
+    """
+    m = sectionRegexComp.match(sectionLine)
+
+    if m is None:
+        return None
+
+    return "{0}.{1}000".format(m.group(1), m.group(2))
+
+
+def stackShortTimestamp(filename):
+    """
+    sectionTimestamp of the RTE dump file, None if it has no [STACK_SHORT]
+    """
+    with open(filename, errors='replace') as rte:
+        for line in rte:
+            if line[0:13] == '[STACK_SHORT]':
+                return sectionTimestamp(line)
+
+    return None
+
+
+# First characters a thread line or a frame line can start with
+THREAD_FIRST = frozenset('0123456789')
+FRAME_FIRST = frozenset(' 0123456789')
 
-        return tuple(tmpList)
-        
 
 class StackShortBuilder():
     """
     A finite state machine that take [STACK_SHORT] section as input and generates two dictionaries
     1. threadDictionary : ThreadInfo --> StackShortStack
     1. dedupDictionary : StackShortStack.dedupKey() -> [ThreadsInfo*]
+    Every state is a method handling the next line. A line is classified by
+    its first character and matched at most once, the thread info and the
+    frames are built from that match.
+    Equal frame lines and equal stacks of different threads share one
+    object.
+    state is the name of the current state (INIT, THREAD, FRAME, SKIP, DONE)
     """
     def __init__(self):
         self.state = "INIT"
+        self.done = False
 
         self.threadDictionary = {}
         self.dedupDictionary = {}
 
         self.workingThreadInfo = None
+        # frames of the current thread, the stack is built at its end
         self.workingCallStack = None
 
+        # line -> StackShortFrame, StackShortStack -> itself
+        self.__frames = {}
+        self.__stacks = {}
+
+        self.__step = self.__onInit
+
     def __buildResult(self):
-        self.threadDictionary[self.workingThreadInfo] = self.workingCallStack
+        stack = StackShortStack(self.workingCallStack)
+        stack = self.__stacks.setdefault(stack, stack)
+
+        self.threadDictionary[self.workingThreadInfo] = stack
         
-        dedupKey = self.workingCallStack.dedupKey()
+        dedupKey = stack.dedupKey()
 
         if dedupKey not in self.dedupDictionary:
             self.dedupDictionary[dedupKey] = []
 
         self.dedupDictionary[dedupKey].append(self.workingThreadInfo)
-        
-    # Finite State Machine 
-    def input(self, inputString):
-        # INIT State
-        if self.state == "INIT":
+
+    def __toInit(self):
+        self.state = "INIT"
+        self.__step = self.__onInit
+
+    def __toSkip(self):
+        self.state = "SKIP"
+        self.__step = self.__onSkip
+
+    def __toDone(self):
+        self.state = "DONE"
+        self.done = True
+        self.__step = self.__onDone
+
+        self.__frames.clear()
+        self.__stacks.clear()
+
+    def __onInit(self, inputString):
+        if inputString[0:1] in THREAD_FIRST:
             threadMatch = threadRegexComp.match(inputString)
 
             if threadMatch is not None:
-                self.workingThreadInfo = StackShortThreadInfo(inputString)
-                self.workingCallStack = StackShortStack();
+                self.workingThreadInfo = \
+                    StackShortThreadInfo.fromMatch(threadMatch)
+                self.workingCallStack = []
                 self.state = "THREAD"
+                self.__step = self.__onStack
+                return
 
-            elif inputString[0:4] == '[OK]':
-                self.__buildResult()
-                self.state = "DONE"
+        if inputString[0:4] == '[OK]':
+            self.__buildResult()
+            self.__toDone()
+        else:
+            self.__toSkip()
 
-            else:
-                self.state = "SKIP"
-                
-        # THREAD State
-        elif self.state == "THREAD":
+    # THREAD and FRAME state
+    def __onStack(self, inputString):
+        frame = self.__frames.get(inputString)
+
+        if frame is None and inputString[0:1] in FRAME_FIRST:
             frameMatch = frameRegexComp.match(inputString)
 
             if frameMatch is not None:
-                self.workingCallStack.append(StackShortFrame(inputString))
-                self.state = "FRAME"
+                frame = self.__frames[inputString] = \
+                    StackShortFrame.fromMatch(frameMatch)
 
-            elif inputString[0:2] == '--':
-                self.__buildResult()
-                self.state = "INIT"
+        if frame is not None:
+            self.workingCallStack.append(frame)
+            self.state = "FRAME"
+            return
 
-            else:
-                self.state = "SKIP"
-        
-        # FRAME State
-        elif self.state == "FRAME":
-            frameMatch = frameRegexComp.match(inputString)
+        if inputString[0:2] == '--':
+            self.__buildResult()
+            self.__toInit()
+        else:
+            self.__toSkip()
 
-            if frameMatch is not None:
-                self.workingCallStack.append(StackShortFrame(inputString))
+    def __onSkip(self, inputString):
+        if inputString[0:2] == '--':
+            self.__toInit()
+        elif inputString[0:4] == '[OK]':
+            self.__toDone()
 
-            elif inputString[0:2] == '--':
-                self.__buildResult()
-                self.state = "INIT"
+    def __onDone(self, inputString):
+        pass
 
-            else:
-                self.state = "SKIP"
+    # Finite State Machine 
+    def input(self, inputString):
+        self.__step(inputString)
 
-        # SKIP State
-        elif self.state == "SKIP":
-            if inputString[0:2] == '--':
-                self.state = "INIT"
-            elif inputString[0:4] == '[OK]':
-                self.state = "DONE"
+    def feed(self, inputStream):
+        """
+        Inputs the lines of inputStream until the end of the section
+        """
+        for line in inputStream:
+            self.__step(line)
+
+            if self.done:
+                break
 
 def findSameThread(lstlstThreads, simpleMatch = False):
     """
@@ -176,10 +331,7 @@ def findSameThread(lstlstThreads, simpleMatch = False):
             else:
                 threadStack = (thread, stack)
 
-            if threadStack not in dictThreadToFiles:
-                dictThreadToFiles[threadStack] = []
-
-            dictThreadToFiles[threadStack].append(count)
+            dictThreadToFiles.setdefault(threadStack, []).append(count)
 
     return dictThreadToFiles
 
@@ -192,10 +344,130 @@ def dedupStackShort(inputStream, RTEStream=True):
             if line[0:13] == '[STACK_SHORT]':
                 break
 
-    for line in inputStream:
-        stackShortBuilder.input(line)
-
-        if stackShortBuilder.state == 'DONE':
-            break
+    stackShortBuilder.feed(inputStream)
 
     return stackShortBuilder.threadDictionary, stackShortBuilder.dedupDictionary
+
+
+def stackDigest(key):
+    """
+    Digest of a StackShortStack or of its dedupKey, the same in every
+    process unlike hash()
+    """
+    if isinstance(key, tuple):
+        text = "\n".join(key)
+    else:
+        text = str(key)
+
+    return blake2b(text.encode(), digest_size=16).digest()
+
+
+def digestStackShort(filename, simpleMatch=False):
+    """
+    Worker: parses the RTE dump file and returns a list of
+    (thread, stackDigest of the stack or with simpleMatch of its dedupKey)
+    """
+    with open(filename) as rte:
+        threads, dedup = dedupStackShort(rte)
+
+    digests = {}
+    result = []
+
+    for thread, stack in threads.items():
+        key = stack.dedupKey() if simpleMatch else stack
+        digest = digests.get(key)
+
+        if digest is None:
+            digest = digests[key] = stackDigest(key)
+
+        result.append((thread, digest))
+
+    return result
+
+
+def stacksOfDigests(filename, digests, simpleMatch=False):
+    """
+    Worker: parses the RTE dump file again and returns
+    {digest: stack or dedupKey} of the digests asked for
+    """
+    with open(filename) as rte:
+        threads, dedup = dedupStackShort(rte)
+
+    stacks = {}
+
+    for stack in set(threads.values()):
+        key = stack.dedupKey() if simpleMatch else stack
+        digest = stackDigest(key)
+
+        if digest in digests:
+            stacks[digest] = key
+
+    return stacks
+
+
+def digestStackShortWorker(args):
+    return digestStackShort(*args)
+
+
+def stacksOfDigestsWorker(args):
+    return stacksOfDigests(*args)
+
+
+def findSameThreadInFiles(filenames, simpleMatch=False, span=1, processes=None):
+    """
+    Same as findSameThread of the dumps of the files, with only the threads
+    that are in span files or more.
+    The files are parsed in worker processes which return a digest per
+    thread, the stacks are read again only from the files they are needed
+    from, so only the distinct (thread, digest) are held at once.
+    """
+    tasks = [(filename, simpleMatch) for filename in filenames]
+
+    if processes is None:
+        processes = min(len(tasks), os.cpu_count() or 1)
+
+    pool = mp.Pool(processes) if processes > 1 else None
+
+    try:
+        if pool is None:
+            results = map(digestStackShortWorker, tasks)
+        else:
+            results = pool.imap(digestStackShortWorker, tasks, chunksize=1)
+
+        dictThreadToFiles = {}
+
+        for count, digests in enumerate(results):
+            for threadDigest in digests:
+                dictThreadToFiles.setdefault(threadDigest, []).append(count)
+
+        # the first file of every digest which is shown
+        wanted = {}
+
+        for (thread, digest), inputNums in dictThreadToFiles.items():
+            if len(inputNums) >= span:
+                wanted.setdefault(digest, inputNums[0])
+
+        tasks = {}
+
+        for digest, count in wanted.items():
+            tasks.setdefault(count, set()).add(digest)
+
+        tasks = [(filenames[count], digests, simpleMatch)
+                 for count, digests in sorted(tasks.items())]
+
+        if pool is None:
+            results = map(stacksOfDigestsWorker, tasks)
+        else:
+            results = pool.imap_unordered(stacksOfDigestsWorker, tasks, chunksize=1)
+
+        stacks = {}
+
+        for found in results:
+            stacks.update(found)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    return dict(((thread, stacks[digest]), inputNums)
+                for (thread, digest), inputNums in dictThreadToFiles.items()
+                if len(inputNums) >= span)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import sqlite3
+import multiprocessing as mp
+from hanads.stackshortutils import dedupStackShort, stackDigest, \
+    frameRegexComp, sectionTimestamp
+
+# A stack is stored once by the stackDigest of its dedupKey (the function
+# names, without addresses and offsets). dumpstack has the number of
+# threads of a stack per dump, thread every thread.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dump (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    system TEXT,
+    taken TEXT,
+    threads INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dump_taken ON dump (taken);
+
+CREATE TABLE IF NOT EXISTS function (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS stack (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL UNIQUE,
+    depth INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS frame (
+    stack INTEGER NOT NULL REFERENCES stack (id),
+    position INTEGER NOT NULL,
+    function INTEGER NOT NULL REFERENCES function (id),
+    PRIMARY KEY (stack, position)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS dumpstack (
+    stack INTEGER NOT NULL REFERENCES stack (id),
+    dump INTEGER NOT NULL REFERENCES dump (id),
+    threads INTEGER NOT NULL,
+    PRIMARY KEY (stack, dump)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS dumpstack_dump ON dumpstack (dump);
+
+CREATE TABLE IF NOT EXISTS thread (
+    stack INTEGER NOT NULL REFERENCES stack (id),
+    dump INTEGER NOT NULL REFERENCES dump (id),
+    tid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    context TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS thread_stack ON thread (stack, dump);
+CREATE INDEX IF NOT EXISTS thread_dump ON thread (dump);
+"""
+
+def fingerprintOf(dedupKey):
+    return stackDigest(dedupKey).hex()
+
+
+def framesFromText(lines):
+    """
+    dedupKey of the frame lines of a stack copied from an RTE dump
+    """
+    return tuple(m.group(3) for m in map(frameRegexComp.match, lines)
+                 if m is not None)
+
+
+def readStackShort(path):
+    """
+    Worker: returns (timestamp of the [STACK_SHORT] section, number of
+    threads, [(thread, dedupKey)]) of the RTE dump file.
+    Threads without a stack (inactive) are only counted.
+    """
+    taken = None
+
+    with open(path, errors='replace') as rte:
+        for line in rte:
+            if line[0:13] == '[STACK_SHORT]':
+                taken = sectionTimestamp(line)
+                break
+
+        threads, dedup = dedupStackShort(rte, RTEStream=False)
+
+    return taken, len(threads), [(thread, stack.dedupKey())
+                                 for thread, stack in threads.items()
+                                 if len(stack) > 0]
+
+
+class StackStore():
+    """
+    SQLite store of the stacks of RTE dumps, to find in which dumps a stack
+    was seen without parsing the dumps again
+    """
+    def __init__(self, path):
+        self.__db = sqlite3.connect(path)
+        self.__db.executescript(SCHEMA)
+
+        # fingerprint -> stack id and function name -> id of this session
+        self.__stacks = {}
+        self.__functions = {}
+
+    def close(self):
+        self.__db.close()
+
+    def hasDump(self, path):
+        return self.__db.execute("SELECT 1 FROM dump WHERE path = ?",
+                                 (path,)).fetchone() is not None
+
+    def __functionId(self, name):
+        functionId = self.__functions.get(name)
+
+        if functionId is None:
+            row = self.__db.execute("SELECT id FROM function WHERE name = ?",
+                                    (name,)).fetchone()
+
+            if row is None:
+                functionId = self.__db.execute(
+                    "INSERT INTO function (name) VALUES (?)",
+                    (name,)).lastrowid
+            else:
+                functionId = row[0]
+
+            self.__functions[name] = functionId
+
+        return functionId
+
+    def __stackId(self, dedupKey):
+        fingerprint = fingerprintOf(dedupKey)
+        stackId = self.__stacks.get(fingerprint)
+
+        if stackId is None:
+            row = self.__db.execute(
+                "SELECT id FROM stack WHERE fingerprint = ?",
+                (fingerprint,)).fetchone()
+
+            if row is None:
+                stackId = self.__db.execute(
+                    "INSERT INTO stack (fingerprint, depth) VALUES (?, ?)",
+                    (fingerprint, len(dedupKey))).lastrowid
+                self.__db.executemany(
+                    "INSERT INTO frame (stack, position, function) "
+                    "VALUES (?, ?, ?)",
+                    [(stackId, position, self.__functionId(name))
+                     for position, name in enumerate(dedupKey, start=1)])
+            else:
+                stackId = row[0]
+
+            self.__stacks[fingerprint] = stackId
+
+        return stackId
+
+    def addDump(self, path, taken, threadCount, threads, system=None):
+        """
+        Adds the dump with threads = [(thread, dedupKey)] in one transaction
+        """
+        with self.__db:
+            dumpId = self.__db.execute(
+                "INSERT INTO dump (path, system, taken, threads) "
+                "VALUES (?, ?, ?, ?)",
+                (path, system, taken, threadCount)).lastrowid
+
+            stackThreads = {}
+            rows = []
+
+            for thread, dedupKey in threads:
+                stackId = self.__stackId(dedupKey)
+                stackThreads[stackId] = stackThreads.get(stackId, 0) + 1
+                rows.append((stackId, dumpId, thread.tid, thread.name,
+                             thread.context))
+
+            self.__db.executemany(
+                "INSERT INTO dumpstack (stack, dump, threads) VALUES (?, ?, ?)",
+                [(stackId, dumpId, count)
+                 for stackId, count in stackThreads.items()])
+            self.__db.executemany(
+                "INSERT INTO thread (stack, dump, tid, name, context) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+
+        return dumpId
+
+    def fingerprints(self, prefix):
+        """
+        Fingerprints starting with the hex prefix
+        """
+        prefix = prefix.lower()
+
+        return [row[0] for row in self.__db.execute(
+            "SELECT fingerprint FROM stack "
+            "WHERE fingerprint >= ? AND fingerprint < ? ORDER BY fingerprint",
+            (prefix, prefix + 'g'))]
+
+    def frames(self, fingerprint):
+        return [row[0] for row in self.__db.execute(
+            "SELECT function.name FROM stack "
+            "JOIN frame ON frame.stack = stack.id "
+            "JOIN function ON function.id = frame.function "
+            "WHERE stack.fingerprint = ? ORDER BY frame.position",
+            (fingerprint,))]
+
+    def __range(self, since, until):
+        sql = ""
+        args = []
+
+        if since is not None:
+            sql += " AND dump.taken >= ?"
+            args.append(since)
+
+        if until is not None:
+            sql += " AND dump.taken < ?"
+            args.append(until)
+
+        return sql, args
+
+    def dumpsWithStack(self, fingerprint, since=None, until=None):
+        """
+        [(dump id, path, system, taken, threads)] of the dumps with the stack
+        ordered by taken
+        """
+        sql, args = self.__range(since, until)
+
+        return self.__db.execute(
+            "SELECT dump.id, dump.path, dump.system, dump.taken, "
+            "dumpstack.threads FROM stack "
+            "JOIN dumpstack ON dumpstack.stack = stack.id "
+            "JOIN dump ON dump.id = dumpstack.dump "
+            "WHERE stack.fingerprint = ?" + sql +
+            " ORDER BY dump.taken, dump.path",
+            [fingerprint] + args).fetchall()
+
+    def threadsWithStack(self, fingerprint, dumpId):
+        """
+        [(context, tid, name)] of the threads of the dump with the stack
+        """
+        return self.__db.execute(
+            "SELECT thread.context, thread.tid, thread.name FROM stack "
+            "JOIN thread ON thread.stack = stack.id "
+            "WHERE stack.fingerprint = ? AND thread.dump = ?",
+            (fingerprint, dumpId)).fetchall()
+
+    def topStacks(self, count, since=None, until=None, system=None):
+        """
+        [(fingerprint, dumps, threads)] of the stacks in most dumps
+        """
+        sql, args = self.__range(since, until)
+
+        if system is not None:
+            sql += " AND dump.system = ?"
+            args.append(system)
+
+        return self.__db.execute(
+            "SELECT stack.fingerprint, COUNT(*), SUM(dumpstack.threads) "
+            "FROM dump JOIN dumpstack ON dumpstack.dump = dump.id "
+            "JOIN stack ON stack.id = dumpstack.stack "
+            "WHERE 1" + sql +
+            " GROUP BY stack.id ORDER BY COUNT(*) DESC, "
+            "SUM(dumpstack.threads) DESC LIMIT ?",
+            args + [count]).fetchall()
+
+
+def addDumps(store, paths, system=None, processes=None):
+    """
+    Parses the RTE dump files not in the store yet in worker processes and
+    adds them. Yields (path, threads added) of every file.
+    """
+    paths = [path for path in dict.fromkeys(map(os.path.abspath, paths))
+             if not store.hasDump(path)]
+
+    if not paths:
+        return
+
+    if processes is None:
+        processes = min(len(paths), os.cpu_count() or 1)
+
+    if processes <= 1:
+        results = map(readStackShort, paths)
+        pool = None
+    else:
+        pool = mp.Pool(processes)
+        results = pool.imap(readStackShort, paths, chunksize=1)
+
+    try:
+        for path, (taken, threadCount, threads) in zip(paths, results):
+            store.addDump(path, taken, threadCount, threads, system)
+
+            yield path, len(threads)
+    finally:
+        if pool is not None:
+            pool.terminate()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import atexit
+import shutil
+import tarfile
+import zipfile
+import tempfile
+from contextlib import contextmanager
+from pathlib import PurePosixPath
+
+# Magic bytes of the compressed tar archives, gzip, bz2 and xz
+TAR_MAGICS = [b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00']
+
+# Size of the blocks copied from a compressed tar into the spool
+SPOOL_BLOCK = 1024 * 1024
+
+
+def isArchive(path):
+    """
+    True if path is a tar(.gz/.bz2/.xz) or zip archive file
+    """
+    if not os.path.isfile(path):
+        return False
+
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+
+
+def isCompressedTar(path):
+    """
+    True if path is a tar.gz/.bz2/.xz. Its members can only be read one
+    after another from the start of the archive.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+
+    return any(magic.startswith(prefix) for prefix in TAR_MAGICS)
+
+
+class ArchiveMember():
+    """
+    A trace file within an archive. It is used in place of a trace file name.
+    The member is read straight from the archive without extracting it.
+    """
+    def __init__(self, archive, info):
+        self.archive = str(archive)
+        self.info = info
+
+        if isinstance(info, zipfile.ZipInfo):
+            self.name = info.filename
+        else:
+            self.name = info.name
+
+    def __str__(self):
+        return "{0}/{1}".format(self.archive, self.name)
+
+    def __repr__(self):
+        return "ArchiveMember({0!r})".format(self.__str__())
+
+    @contextmanager
+    def open(self):
+        """
+        Opens the member for reading in binary mode.
+        Every call uses its own handle, so members can be read from
+        several threads at the same time.
+        """
+        if isinstance(self.info, zipfile.ZipInfo):
+            with zipfile.ZipFile(self.archive) as archive:
+                with archive.open(self.info) as member:
+                    yield member
+        else:
+            # Member position is already known from the listing, so only
+            # the first header is read instead of scanning the archive.
+            with open(self.archive, 'rb') as f:
+                archive = tarfile.TarFile(fileobj=f)
+
+                with archive.extractfile(self.info) as member:
+                    yield member
+
+
+def spoolArchiveTraceFiles(path, reTraceFile):
+    """
+    Reads a compressed tar once from start to end and copies the trace
+    files into a temporary directory, which is removed at exit.
+    Decompressing up to every member on its own would read the archive
+    once per member.
+    Yields (path within the archive, spooled file name) of the trace files.
+    """
+    spoolDir = tempfile.mkdtemp(prefix='tracezipper.')
+    atexit.register(shutil.rmtree, spoolDir, ignore_errors=True)
+
+    with tarfile.open(path, 'r|*') as archive:
+        for count, info in enumerate(archive):
+            memberPath = PurePosixPath(info.name)
+
+            if not info.isfile() \
+                    or reTraceFile.search(memberPath.name) is None:
+                continue
+
+            # same file name in another directory of the archive
+            spoolPath = os.path.join(spoolDir, memberPath.name)
+
+            if os.path.exists(spoolPath):
+                os.mkdir(os.path.join(spoolDir, str(count)))
+                spoolPath = os.path.join(spoolDir, str(count),
+                                         memberPath.name)
+
+            with archive.extractfile(info) as member, \
+                    open(spoolPath, 'wb') as f:
+                shutil.copyfileobj(member, f, SPOOL_BLOCK)
+
+            yield memberPath, spoolPath
+
+
+def listArchiveTraceFiles(path, reTraceFile):
+    """
+    Lists the archive once and yields (path within the archive,
+    ArchiveMember) of the trace files. The host of a file is found from
+    its trace directory, so it doesn't matter how many directories the
+    archive has above the fsid.
+    Trace files of a compressed tar are spooled instead and yielded as
+    file names.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            infos = [info for info in archive.infolist()
+                     if not info.is_dir()]
+            names = [info.filename for info in infos]
+    elif isCompressedTar(path):
+        yield from spoolArchiveTraceFiles(path, reTraceFile)
+        return
+    else:
+        with tarfile.open(path) as archive:
+            infos = [info for info in archive.getmembers() if info.isfile()]
+            names = [info.name for info in infos]
+
+    for name, info in zip(names, infos):
+        memberPath = PurePosixPath(name)
+
+        if reTraceFile.search(memberPath.name) is not None:
+            yield memberPath, ArchiveMember(path, info)
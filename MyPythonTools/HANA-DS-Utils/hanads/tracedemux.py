@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import re
+from collections import OrderedDict
+
+# Fields the merged trace can be split by and their group in reMergedHeader.
+# Thread ids are only unique within a service, so the service is part of
+# the key for thread.
+DEMUX_FIELDS = {'thread': 2, 'connection': 3, 'transaction': 4}
+
+# Output files kept open at the same time, the least recently written one
+# is closed first
+DEMUX_OPEN_FILES = 256
+
+# Entries of one key are collected up to this many bytes before one write
+DEMUX_BUFFER = 64 * 1024
+
+# All buffers are written out when they hold this many bytes together
+DEMUX_MEMORY = 64 * 1024 * 1024
+
+# [host1_in03] [25279]{200123}[41/-1] 2018-02-24 19:23:53.952603 i ...
+reMergedHeader = re.compile(
+    r'\[([^\]\s]+)\] \[([0-9]+)\]{(-?[0-9]+)}\[(-?[0-9]+)/')
+
+
+class DemuxWriter():
+    """
+    Writes every merged trace entry into a file per connection, thread or
+    transaction in the directory, e.g.) connection_200123.trc or
+    hostA_in03_thread_25279.trc
+    Entries without a header, like the lines of --collapse, go to the file
+    of the previous entry of the same service.
+    """
+    def __init__(self, directory, field, maxOpen=DEMUX_OPEN_FILES,
+                 bufferSize=DEMUX_BUFFER, memory=DEMUX_MEMORY):
+        self.__directory = directory
+        self.__group = DEMUX_FIELDS[field]
+        self.__field = field
+        self.__maxOpen = max(1, maxOpen)
+        self.__bufferSize = bufferSize
+        self.__memory = memory
+
+        # key -> [chunks, size]
+        self.__buffers = {}
+        self.__buffered = 0
+        self.__handles = OrderedDict()
+        self.__created = set()
+        self.__lastKey = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    def __key(self, entry):
+        m = reMergedHeader.match(entry)
+
+        if m is None:
+            # continuation of the previous entry of the service
+            service = entry[1:entry.find('] ')]
+
+            return self.__lastKey.get(service, 'unknown')
+
+        service = m.group(1)
+
+        if self.__group == DEMUX_FIELDS['thread']:
+            key = "{0}_thread_{1}".format(service, m.group(2))
+        else:
+            key = "{0}_{1}".format(self.__field, m.group(self.__group))
+
+        self.__lastKey[service] = key
+
+        return key
+
+    def write(self, entry):
+        """
+        entry = merged entry as str from mergeTrace or mergeParallel
+        """
+        # line break mergeTrace adds after the last entry of a service,
+        # separately or appended to the entry by mergeParallel
+        if entry == os.linesep:
+            return
+
+        if entry.endswith('\n' + os.linesep):
+            entry = entry[:-len(os.linesep)]
+        elif not entry.endswith('\n'):
+            entry += os.linesep
+
+        key = self.__key(entry)
+        buf = self.__buffers.get(key)
+
+        if buf is None:
+            buf = self.__buffers[key] = [[], 0]
+
+        buf[0].append(entry)
+        buf[1] += len(entry)
+        self.__buffered += len(entry)
+
+        if buf[1] >= self.__bufferSize:
+            self.__flushKey(key)
+        elif self.__buffered >= self.__memory:
+            self.flush()
+
+    def __handle(self, key):
+        f = self.__handles.get(key)
+
+        if f is not None:
+            self.__handles.move_to_end(key)
+            return f
+
+        if len(self.__handles) >= self.__maxOpen:
+            self.__handles.popitem(last=False)[1].close()
+
+        path = os.path.join(self.__directory, key + '.trc')
+
+        # a file closed by the LRU is continued, an old one is replaced
+        if key in self.__created:
+            f = open(path, 'ab')
+        else:
+            f = open(path, 'wb')
+            self.__created.add(key)
+
+        self.__handles[key] = f
+
+        return f
+
+    def __flushKey(self, key):
+        chunks, size = self.__buffers.pop(key)
+        self.__handle(key).write(''.join(chunks).encode(errors='replace'))
+        self.__buffered -= size
+
+    def flush(self):
+        for key in list(self.__buffers):
+            self.__flushKey(key)
+
+        for f in self.__handles.values():
+            f.flush()
+
+    def close(self):
+        self.flush()
+
+        for f in self.__handles.values():
+            f.close()
+
+        self.__handles.clear()
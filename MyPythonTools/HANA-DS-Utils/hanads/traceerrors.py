@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import heapq
+import multiprocessing as mp
+from collections import deque
+from hanads.traceutils import MmapTraceTokenizer, RawEntry, formatEntry, \
+    servicePrefix
+from hanads.traceindex import seekOffsets
+
+# Levels reported by default
+ERROR_LEVELS = 'efw'
+
+# Entries shown before and after every reported entry by default
+CONTEXT_ENTRIES = 3
+
+
+def entryLevel(entry):
+    """
+    Returns the level of a trace entry from TraceTokenizer or
+    MmapTraceTokenizer
+    e.g.) [25279]{-1}[-1/-1] 2018-02-24 19:23:53.952603 e Basis ... -> 'e'
+    """
+    if isinstance(entry, RawEntry):
+        header = bytes(entry[0][0:96]).decode('ascii', 'replace')
+    else:
+        header = entry[0]
+
+    levelIndex = header.find(' ') + 28
+
+    return header[levelIndex:levelIndex+1]
+
+
+def errorBlocks(tokenizer, joinString, levels=ERROR_LEVELS,
+                before=CONTEXT_ENTRIES, after=CONTEXT_ENTRIES, until=None):
+    """
+    Yields the blocks of entries with one of the levels and up to
+    before/after entries around them, like grep -B/-A, as lists of
+    (timestamp, formatted entry).
+    The entries before are kept in a ring buffer, so the trace is read once.
+    Blocks which touch are joined.
+    """
+    def formatted(entry):
+        text = formatEntry(entry, joinString)
+
+        # last entry of the trace can be without line break
+        if not text.endswith('\n'):
+            text += os.linesep
+
+        return text
+
+    ring = deque(maxlen=before)
+    # entries of the block being collected
+    block = None
+    # finished block which is joined if the next one starts within before
+    pending = None
+    gap = 0
+    remaining = 0
+
+    for timestamp, entry in tokenizer:
+        if until is not None and timestamp >= until:
+            break
+
+        if entryLevel(entry) in levels:
+            if block is None:
+                if pending is not None and gap <= before:
+                    block = pending
+                else:
+                    if pending is not None:
+                        yield pending
+
+                    block = []
+
+                pending = None
+                block.extend((t, formatted(e)) for t, e in ring)
+                ring.clear()
+
+            block.append((timestamp, formatted(entry)))
+            remaining = after
+
+        elif remaining > 0:
+            block.append((timestamp, formatted(entry)))
+            remaining -= 1
+
+        else:
+            if block is not None:
+                pending = block
+                block = None
+                gap = 0
+
+            ring.append((timestamp, entry))
+            gap += 1
+
+            if pending is not None and gap > before:
+                yield pending
+                pending = None
+
+    for last in (pending, block):
+        if last is not None:
+            yield last
+
+
+def serviceErrors(key, files, levels, before, after, since=None, until=None):
+    """
+    Worker: returns the entries of the error blocks of one service as a
+    list of (timestamp, text). Every block after the first one starts with
+    a "--" line of the service, where entries of the service were left out.
+    """
+    joinString = servicePrefix(key)
+    tokenizer = MmapTraceTokenizer(files, seekOffsets(files, since),
+                                   since=since)
+    entries = []
+
+    for block in errorBlocks(tokenizer, joinString, levels, before, after,
+                             until):
+        if entries:
+            entries.append((block[0][0], joinString + '--' + os.linesep))
+
+        entries.extend(block)
+
+    return entries
+
+
+def serviceErrorsWorker(args):
+    return serviceErrors(*args)
+
+
+def findErrors(services, levels=ERROR_LEVELS, before=CONTEXT_ENTRIES,
+               after=CONTEXT_ENTRIES, since=None, until=None, processes=None):
+    """
+    services = list of (key, files) in the order used for equal timestamps
+    Collects the error blocks of every service in its own worker process.
+    Yields their entries merged in timestamp order.
+    """
+    tasks = [(key, files, levels, before, after, since, until)
+             for key, files in services]
+
+    if processes is None:
+        processes = min(len(tasks), os.cpu_count() or 1)
+
+    if processes <= 1:
+        results = [serviceErrorsWorker(task) for task in tasks]
+    else:
+        with mp.Pool(processes) as pool:
+            results = pool.map(serviceErrorsWorker, tasks, chunksize=1)
+
+    # count and seq keep the order of equal timestamps like mergeTrace
+    streams = [[(timestamp, count, seq, text)
+                for seq, (timestamp, text) in enumerate(entries)]
+               for count, entries in enumerate(results)]
+
+    for _, _, _, text in heapq.merge(*streams):
+        yield text
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import time
+import heapq
+from collections import deque
+from hanads.traceutils import reHeaderBytes, reTraceFile, headerTimestamp, \
+    isPlainFile, orderTraceFiles, servicePrefix
+from hanads.traceindex import seekOffsets
+
+# Seconds between two polls of the trace files
+FOLLOW_INTERVAL = 0.5
+
+# Seconds an entry is held back, so slower services can catch up
+FOLLOW_DELAY = 2.0
+
+# Trace directories are listed again when their mtime changes, and at least
+# every RESCAN_INTERVAL seconds in case the mtime is cached (e.g. on NFS)
+RESCAN_INTERVAL = 5.0
+
+# At most this many bytes are read from one file in a poll
+READ_CHUNK = 4 * 1024 * 1024
+
+
+class FollowedFile():
+    """
+    Trace file read from offset as it grows. It is kept open, so data
+    written before the file is deleted by the rotation is still read.
+    """
+    def __init__(self, path, offset=0):
+        self.path = path
+        self.f = open(path, 'rb')
+        self.f.seek(offset)
+        self.offset = offset
+        self.partial = b''
+
+    def readLines(self):
+        """
+        Returns the complete lines written since the last call
+        """
+        size = os.fstat(self.f.fileno()).st_size
+
+        if size < self.offset:
+            # truncated and written again from the beginning
+            self.f.seek(0)
+            self.offset = 0
+            self.partial = b''
+
+        if size == self.offset:
+            return []
+
+        data = self.f.read(min(size - self.offset, READ_CHUNK))
+        self.offset += len(data)
+
+        data = self.partial + data
+        end = data.rfind(b'\n') + 1
+        self.partial = data[end:]
+
+        if end == 0:
+            return []
+
+        return [line + b'\n' for line in data[0:end-1].split(b'\n')]
+
+    def close(self):
+        self.f.close()
+
+
+class ServiceFollower():
+    """
+    Follows the trace files of one service including rotations created
+    later and collects their complete entries as (timestamp, arrival, lines)
+    """
+    def __init__(self, key, files, since=None):
+        self.key = key
+        self.prefix = servicePrefix(key)
+        self.since = since
+        self.entries = deque()
+
+        # compressed rotations don't grow any more
+        plainFiles = [f for f in files if isPlainFile(f)]
+        fileName = os.path.basename(files[0])
+
+        # indexserver_host.30003.000.trc -> indexserver_, 30003
+        self.__namePrefix = fileName[0:fileName.index('_')+1]
+        self.__port = reTraceFile.search(fileName).group(1)
+        self.__directories = sorted(set(os.path.dirname(f) for f in files))
+
+        self.__files = []
+        self.__known = set(plainFiles)
+        self.__dirMtimes = {}
+
+        # entry being read: [timestamp, lines, arrival]
+        self.__current = None
+        self.__lastTimestamp = None
+
+        if since is None:
+            # like tail -f, only what is written from now on
+            for f in orderTraceFiles(plainFiles):
+                self.__files.append(FollowedFile(f, os.path.getsize(f)))
+        else:
+            ordered = orderTraceFiles(plainFiles, since)
+
+            for f, offset in zip(ordered, seekOffsets(ordered, since)):
+                self.__files.append(FollowedFile(f, offset))
+
+            for f in orderTraceFiles([f for f in plainFiles
+                                      if f not in ordered]):
+                self.__files.append(FollowedFile(f, os.path.getsize(f)))
+
+    def rescan(self, force=False):
+        """
+        Starts following new rotations and stops following deleted files.
+        Only changed directories are listed unless force is given.
+        """
+        newFiles = []
+
+        for directory in self.__directories:
+            try:
+                mtime = os.stat(directory).st_mtime
+
+                if not force and self.__dirMtimes.get(directory) == mtime:
+                    continue
+
+                self.__dirMtimes[directory] = mtime
+
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        m = reTraceFile.search(entry.name)
+
+                        if m is None or m.group(3) is not None \
+                                or m.group(1) != self.__port \
+                                or not entry.name.startswith(
+                                    self.__namePrefix) \
+                                or entry.path in self.__known:
+                            continue
+
+                        newFiles.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue
+
+        for _, path in sorted(newFiles):
+            try:
+                self.__files.append(FollowedFile(path))
+                self.__known.add(path)
+            except OSError:
+                pass
+
+        for followed in list(self.__files):
+            if not os.path.exists(followed.path) \
+                    and followed.offset == os.fstat(
+                        followed.f.fileno()).st_size:
+                followed.close()
+                self.__files.remove(followed)
+                self.__known.discard(followed.path)
+
+    def poll(self, now):
+        """
+        Reads what was written since the last poll
+        """
+        gotLines = False
+
+        for followed in self.__files:
+            lines = followed.readLines()
+
+            if lines:
+                gotLines = True
+                self.__addLines(lines, now)
+
+        # entry is complete when nothing more was written to it
+        if not gotLines:
+            self.__finishEntry()
+
+    def __addLines(self, lines, now):
+        for line in lines:
+            if reHeaderBytes.match(line):
+                self.__finishEntry()
+                self.__current = [headerTimestamp(line), [line], now]
+            elif self.__current is not None:
+                self.__current[1].append(line)
+            elif self.__lastTimestamp is not None:
+                # late continuation of an entry already finished
+                self.__current = [self.__lastTimestamp, [line], now]
+
+    def __finishEntry(self):
+        if self.__current is None:
+            return
+
+        timestamp, lines, arrival = self.__current
+        self.__current = None
+        self.__lastTimestamp = timestamp
+
+        if self.since is not None and timestamp < self.since:
+            return
+
+        self.entries.append((timestamp, arrival,
+                             [line.decode(errors='replace')
+                              for line in lines]))
+
+    def ripeTimestamp(self, arrivedBefore):
+        """
+        Returns the newest timestamp of the entries which arrived before
+        the given time, None if there is none
+        """
+        ripe = None
+
+        for timestamp, arrival, _ in self.entries:
+            if arrival > arrivedBefore:
+                break
+
+            if ripe is None or timestamp > ripe:
+                ripe = timestamp
+
+        return ripe
+
+    def close(self):
+        for followed in self.__files:
+            followed.close()
+
+
+def followTrace(services, since=None, delay=FOLLOW_DELAY,
+                interval=FOLLOW_INTERVAL, entryFilter=None):
+    """
+    services = list of (key, files) in the order used for equal timestamps
+    Follows the trace files of all services and yields a list of merged
+    entries after every poll, an empty list if nothing was written.
+    An entry is emitted once an entry of any service with a newer or equal
+    timestamp is older than delay seconds, so entries of services which are
+    up to delay seconds late are still put in timestamp order.
+    """
+    followers = [ServiceFollower(key, files, since)
+                 for key, files in services]
+    lastRescan = time.monotonic()
+
+    try:
+        while True:
+            now = time.monotonic()
+
+            force = now - lastRescan >= RESCAN_INTERVAL
+
+            if force:
+                lastRescan = now
+
+            for follower in followers:
+                follower.rescan(force)
+
+            for follower in followers:
+                follower.poll(now)
+
+            cutoff = None
+
+            for follower in followers:
+                ripe = follower.ripeTimestamp(now - delay)
+
+                if ripe is not None and (cutoff is None or ripe > cutoff):
+                    cutoff = ripe
+
+            merged = []
+
+            if cutoff is not None:
+                queue = [(follower.entries[0][0], count)
+                         for count, follower in enumerate(followers)
+                         if follower.entries
+                         and follower.entries[0][0] <= cutoff]
+                heapq.heapify(queue)
+
+                while queue:
+                    _, count = heapq.heappop(queue)
+                    follower = followers[count]
+                    _, _, lines = follower.entries.popleft()
+
+                    if entryFilter is None or entryFilter(lines):
+                        merged.append(follower.prefix
+                                      + follower.prefix.join(lines))
+
+                    if follower.entries \
+                            and follower.entries[0][0] <= cutoff:
+                        heapq.heappush(queue,
+                                       (follower.entries[0][0], count))
+
+            yield merged
+
+            time.sleep(interval)
+
+    finally:
+        for follower in followers:
+            follower.close()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import multiprocessing as mp
+from datetime import datetime, timedelta
+from hanads.traceutils import MmapTraceTokenizer, FilteredTokenizer, \
+    ReadAhead, reHeaderBytes, isPlainFile, mapTraceFile
+from hanads.traceindex import seekOffsets, PostingTraceTokenizer
+
+# Levels in the order of the table columns, others are appended
+LEVELS = ['f', 'e', 'w', 'i', 'd']
+
+
+class BucketLabel():
+    """
+    Returns the start of the bucket of a trace timestamp
+    e.g.) seconds = 10, 2018-02-24 19:23:53.952603 -> 2018-02-24 19:23:50
+    Buckets are aligned to midnight.
+    """
+    def __init__(self, seconds):
+        self.__seconds = seconds
+        self.__lastMinute = None
+        self.__minute = None
+
+    def __call__(self, timestamp):
+        second = timestamp[0:19]
+
+        if self.__seconds == 1:
+            return second
+
+        if 60 % self.__seconds == 0:
+            try:
+                seconds = int(timestamp[17:19])
+            except ValueError:
+                return second
+
+            return "{0}{1:02}".format(timestamp[0:17],
+                                      seconds - seconds % self.__seconds)
+
+        # only a new minute has to be parsed
+        if timestamp[0:16] != self.__lastMinute:
+            try:
+                self.__minute = datetime.strptime(timestamp[0:16],
+                                                  '%Y-%m-%d %H:%M')
+            except ValueError:
+                return second
+
+            self.__lastMinute = timestamp[0:16]
+
+        try:
+            seconds = int(timestamp[17:19])
+        except ValueError:
+            return second
+
+        minute = self.__minute
+        offset = ((minute.hour*60 + minute.minute)*60 + seconds) \
+            % self.__seconds
+
+        if offset <= seconds:
+            return "{0}:{1:02}".format(self.__lastMinute, seconds - offset)
+
+        return (minute + timedelta(seconds=seconds - offset))\
+            .strftime('%Y-%m-%d %H:%M:%S')
+
+
+def countEntries(files, since=None, until=None):
+    """
+    Counts entries and bytes per second and level straight from the
+    memory mapped trace files. Only the header lines are looked at.
+    Returns {(second, level): [entries, bytes]} with bytes keys
+    """
+    counts = {}
+    current = None
+    started = since is None
+    sinceBytes = since.encode() if since is not None else None
+    untilBytes = until.encode() if until is not None else None
+
+    offsets = seekOffsets(files, since)
+    readAhead = ReadAhead(files)
+
+    for idx, traceFile in enumerate(files):
+        if isPlainFile(traceFile):
+            readAhead.prefetch(idx + 1)
+            buf = mapTraceFile(traceFile)
+        else:
+            buf = readAhead.get(idx)
+
+        if not buf:
+            continue
+
+        pos = offsets[idx] if offsets is not None else 0
+        offset = pos
+        find = buf.find
+        match = reHeaderBytes.match
+
+        while offset >= 0:
+            m = match(buf, offset)
+
+            if m is not None:
+                # lines until this header belong to the previous entry,
+                # at the beginning of a file also the last one of the last
+                # file
+                if current is not None:
+                    current[1] += offset - pos
+
+                pos = offset
+
+                # 2018-02-24 19:23:53.952603 i
+                head = buf[m.end()+1:m.end()+29]
+
+                if untilBytes is not None and head[0:26] >= untilBytes:
+                    return counts
+
+                if started or head[0:26] >= sinceBytes:
+                    started = True
+                    key = (head[0:19], head[27:28])
+                    current = counts.get(key)
+
+                    if current is None:
+                        current = counts[key] = [0, 0]
+
+                    current[0] += 1
+                else:
+                    current = None
+
+            # only a line starting with '[' can be a header
+            offset = find(b'\n[', offset) + 1
+
+            if offset == 0:
+                break
+
+        if current is not None:
+            current[1] += len(buf) - pos
+
+    return counts
+
+
+def histogramService(key, files, seconds, since=None, until=None,
+                     criteria=None, entryFilter=None):
+    """
+    Counts entries and bytes of one service per bucket and level in one
+    pass. Entries are never decoded or formatted.
+    Returns key and {bucket: {level: [entries, bytes]}}
+    """
+    if criteria or entryFilter is not None:
+        counts = countFilteredEntries(files, since, until, criteria,
+                                      entryFilter)
+    else:
+        counts = countEntries(files, since, until)
+
+    bucketLabel = BucketLabel(seconds)
+    labels = {}
+    histogram = {}
+
+    for (second, level), (entries, size) in sorted(counts.items()):
+        label = labels.get(second)
+
+        if label is None:
+            label = labels[second] = \
+                bucketLabel(second.decode('ascii', 'replace'))
+
+        levels = histogram.setdefault(label, {})
+        counter = levels.setdefault(level.decode('ascii', 'replace'), [0, 0])
+        counter[0] += entries
+        counter[1] += size
+
+    return key, histogram
+
+
+def countFilteredEntries(files, since, until, criteria, entryFilter):
+    """
+    Same as countEntries for the entries selected by the field index
+    and entryFilter, the entries are read from the tokenizer
+    """
+    if criteria:
+        tokenizer = PostingTraceTokenizer(files, criteria, since=since)
+    else:
+        tokenizer = MmapTraceTokenizer(files, seekOffsets(files, since),
+                                       since=since)
+
+    if entryFilter is not None:
+        tokenizer = FilteredTokenizer(tokenizer, entryFilter)
+
+    counts = {}
+
+    for timestamp, entry in tokenizer:
+        if until is not None and timestamp >= until:
+            break
+
+        # [pid]{conn}[txn/upd] 2018-02-24 19:23:53.952603 i
+        header = bytes(entry[0][0:96])
+        levelIndex = header.find(b' ') + 28
+
+        key = (timestamp[0:19].encode(), header[levelIndex:levelIndex+1])
+        counter = counts.get(key)
+
+        if counter is None:
+            counter = counts[key] = [0, 0]
+
+        counter[0] += 1
+        counter[1] += sum(len(chunk) for chunk in tuple.__iter__(entry))
+
+    return counts
+
+
+def histogramWorker(args):
+    return histogramService(*args)
+
+
+def buildHistogram(services, seconds=1, since=None, until=None,
+                   criteria=None, entryFilter=None, processes=None):
+    """
+    services = list of (key, files)
+    Counts every service in its own worker process.
+    Returns list of (key, histogram) in the order of services
+    """
+    tasks = [(key, files, seconds, since, until, criteria, entryFilter)
+             for key, files in services]
+
+    if processes is None:
+        processes = min(len(tasks), os.cpu_count() or 1)
+
+    if processes <= 1:
+        return [histogramWorker(task) for task in tasks]
+
+    with mp.Pool(processes) as pool:
+        return pool.map(histogramWorker, tasks, chunksize=1)
+
+
+def histogramLevels(histograms):
+    seen = set()
+
+    for _, histogram in histograms:
+        for levels in histogram.values():
+            seen.update(levels)
+
+    return [level for level in LEVELS if level in seen] \
+        + sorted(seen.difference(LEVELS))
+
+
+def histogramRows(histograms):
+    """
+    Yields (bucket, key, levels) ordered by bucket and service
+    """
+    buckets = sorted(set(bucket for _, histogram in histograms
+                         for bucket in histogram))
+
+    for bucket in buckets:
+        for key, histogram in histograms:
+            if bucket in histogram:
+                yield bucket, key, histogram[bucket]
+
+
+def formatHistogramTable(histograms):
+    """
+    Yields lines of a table with the entries per level and the total
+    entries and bytes of each service and bucket
+    """
+    levels = histogramLevels(histograms)
+    columns = "{0:<19}  {1:<24}" + "".join(
+        "  {{{0}:>8}}".format(idx + 2) for idx in range(len(levels) + 2))
+
+    yield columns.format('time', 'service', *(levels + ['entries', 'bytes'])) \
+        + os.linesep
+
+    for bucket, key, counters in histogramRows(histograms):
+        counts = [counters.get(level, (0, 0))[0] for level in levels]
+        total = sum(counter[0] for counter in counters.values())
+        size = sum(counter[1] for counter in counters.values())
+
+        yield columns.format(bucket, "{0} {1}".format(*key),
+                             *(counts + [total, size])) + os.linesep
+
+
+def formatHistogramCsv(histograms):
+    """
+    Yields lines of CSV with one row per bucket, service and level
+    """
+    yield "time,host,service,level,entries,bytes" + os.linesep
+
+    levels = histogramLevels(histograms)
+
+    for bucket, key, counters in histogramRows(histograms):
+        for level in levels:
+            if level in counters:
+                yield "{0},{1},{2},{3},{4},{5}".format(
+                    bucket, key[0], key[1], level, *counters[level]) \
+                    + os.linesep
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import json
+import bisect
+from itertools import accumulate
+from hanads.traceutils import reHeaderBytes, reHeaderFieldsBytes, \
+    headerTimestamp, isPlainFile, mapTraceFile, scanHeaders, ReadAhead, \
+    RawEntry
+
+# Sparse index is stored next to the trace file
+# e.g.) indexserver_host.30003.000.trc -> indexserver_host.30003.000.trc.tzidx
+INDEX_SUFFIX = '.tzidx'
+INDEX_VERSION = 1
+
+# One checkpoint (timestamp, offset) is recorded every INDEX_STRIDE bytes
+INDEX_STRIDE = 1024 * 1024
+
+# Posting lists of the header fields are stored next to the trace file
+# e.g.) indexserver_host.30003.000.trc -> indexserver_host.30003.000.trc.tzfidx
+FIELD_INDEX_SUFFIX = '.tzfidx'
+FIELD_INDEX_VERSION = 1
+
+# Header fields with posting lists and their group in reHeaderFieldsBytes
+INDEX_FIELDS = {
+    'thread': 1,
+    'connection': 2,
+    'transaction': 3,
+    'level': 6,
+    'component': 7,
+}
+
+
+class TraceIndex():
+    """
+    Sparse timestamp -> byte offset index of the trace entry headers of one
+    trace file. The index is built on first use, saved as a sidecar file and
+    reused as long as size and mtime of the trace file don't change.
+    """
+    def __init__(self, traceFile, stride=INDEX_STRIDE):
+        self.traceFile = str(traceFile)
+        self.indexFile = self.traceFile + INDEX_SUFFIX
+        self.stride = stride
+
+        stat = os.stat(self.traceFile)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+
+        self.timestamps = []
+        self.offsets = []
+
+        if not self.__load():
+            self.__build()
+            self.__save()
+
+    def __load(self):
+        try:
+            with open(self.indexFile) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if index.get('version') != INDEX_VERSION \
+                or index.get('size') != self.size \
+                or index.get('mtime') != self.mtime \
+                or index.get('stride') != self.stride:
+            return False
+
+        self.timestamps = index['timestamps']
+        self.offsets = index['offsets']
+
+        return True
+
+    def __build(self):
+        nextCheckpoint = 0
+        offset = 0
+
+        with open(self.traceFile, 'rb') as f:
+            for line in f:
+                if offset >= nextCheckpoint and reHeaderBytes.match(line):
+                    self.timestamps.append(headerTimestamp(line))
+                    self.offsets.append(offset)
+
+                    nextCheckpoint = offset + self.stride
+
+                offset += len(line)
+
+    def __save(self):
+        index = {
+            'version': INDEX_VERSION,
+            'size': self.size,
+            'mtime': self.mtime,
+            'stride': self.stride,
+            'timestamps': self.timestamps,
+            'offsets': self.offsets,
+        }
+
+        # fsid can be on a read-only location. The index is still usable
+        # for this run, it just needs to be rebuilt next time.
+        try:
+            with open(self.indexFile, 'w') as f:
+                json.dump(index, f)
+        except OSError:
+            pass
+
+    def offsetFor(self, timestamp):
+        """
+        Returns the offset of a trace entry header at or before the first
+        entry whose timestamp is not older than the given timestamp
+        """
+        pos = bisect.bisect_left(self.timestamps, timestamp)
+
+        if pos == 0:
+            return 0
+
+        return self.offsets[pos - 1]
+
+
+def seekOffsets(files, since):
+    """
+    files = list of trace file names of one service
+    Returns the list of offsets to be passed to FileSeq
+    """
+    if since is None:
+        return None
+
+    # compressed files and archive members can't be seeked,
+    # they are read from the beginning
+    return [TraceIndex(f).offsetFor(since) if isPlainFile(f) else 0
+            for f in files]
+
+
+class FieldIndex():
+    """
+    Inverted index of one trace file: posting lists of entry offsets per
+    thread, connection, transaction, level and component.
+    The index of a plain trace file is saved as a sidecar file and reused as
+    long as size and mtime of the trace file don't change. Compressed files
+    and archive members are indexed from content on every use.
+    """
+    def __init__(self, traceFile, content=None):
+        self.traceFile = str(traceFile)
+        self.indexFile = self.traceFile + FIELD_INDEX_SUFFIX
+
+        # field -> value -> delta encoded offsets
+        self.postings = {}
+
+        if content is not None:
+            self.__build(content)
+            return
+
+        stat = os.stat(self.traceFile)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+
+        if not self.__load():
+            self.__build(mapTraceFile(self.traceFile) or b'')
+            self.__save()
+
+    def __load(self):
+        try:
+            with open(self.indexFile) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if index.get('version') != FIELD_INDEX_VERSION \
+                or index.get('size') != self.size \
+                or index.get('mtime') != self.mtime:
+            return False
+
+        self.postings = index['postings']
+
+        return True
+
+    def __build(self, buf):
+        postings = dict((field, {}) for field in INDEX_FIELDS)
+        fieldGroups = list(INDEX_FIELDS.items())
+        lastOffsets = dict((field, {}) for field in INDEX_FIELDS)
+
+        for offset, _ in scanHeaders(buf):
+            m = reHeaderFieldsBytes.match(buf, offset)
+
+            if m is None:
+                continue
+
+            for field, group in fieldGroups:
+                value = m.group(group)
+
+                if value is None:
+                    continue
+
+                value = value.decode('ascii', 'replace')
+                last = lastOffsets[field].get(value, 0)
+                lastOffsets[field][value] = offset
+
+                postings[field].setdefault(value, []).append(offset - last)
+
+        self.postings = postings
+
+    def __save(self):
+        index = {
+            'version': FIELD_INDEX_VERSION,
+            'size': self.size,
+            'mtime': self.mtime,
+            'postings': self.postings,
+        }
+
+        # fsid can be on a read-only location
+        try:
+            with open(self.indexFile, 'w') as f:
+                f.write(json.dumps(index))
+        except OSError:
+            pass
+
+    def hits(self, criteria):
+        """
+        criteria = dictionary of field -> collection of values
+        Returns sorted offsets of the entries matching any of the values
+        of every field
+        """
+        result = None
+
+        for field, values in criteria.items():
+            offsets = set()
+
+            for value in values:
+                offsets.update(accumulate(
+                    self.postings[field].get(value, ())))
+
+            result = offsets if result is None else result & offsets
+
+            if not result:
+                return []
+
+        return sorted(result)
+
+
+class PostingTraceTokenizer():
+    """
+    Same as MmapTraceTokenizer(files, since=since), but only returns the
+    entries found in the field index of every file for the criteria.
+    Entries between the hits are never read.
+    Entries older than since are left out.
+    """
+    def __init__(self, files, criteria, since=None):
+        self.__files = files
+        self.__criteria = criteria
+        self.__since = since
+        self.__readAhead = ReadAhead(files)
+        self.__entries = self.__readEntries()
+        self.__next = next(self.__entries, None)
+
+    def __readEntries(self):
+        # last entry of a file continues until the first header of the
+        # next file, so it is held until that file is opened
+        held = None
+
+        for idx, traceFile in enumerate(self.__files):
+            if isPlainFile(traceFile):
+                self.__readAhead.prefetch(idx + 1)
+                buf = mapTraceFile(traceFile)
+                index = FieldIndex(traceFile) if buf else None
+            else:
+                buf = self.__readAhead.get(idx)
+                index = FieldIndex(traceFile, buf) if buf else None
+
+            if not buf:
+                continue
+
+            view = memoryview(buf)
+
+            if held is not None:
+                firstHeader = next(scanHeaders(buf), (len(buf),))[0]
+
+                if firstHeader > 0:
+                    held[1].append(view[0:firstHeader])
+
+                if firstHeader == len(buf):
+                    continue
+
+                yield held[0], RawEntry(held[1])
+                held = None
+
+            for offset in index.hits(self.__criteria):
+                headers = scanHeaders(buf, offset)
+                timestamp = next(headers)[1]
+                end = next(headers, (len(buf),))[0]
+
+                if self.__since is not None and timestamp < self.__since:
+                    continue
+
+                if end == len(buf):
+                    held = (timestamp, [view[offset:end]])
+                else:
+                    yield timestamp, RawEntry((view[offset:end],))
+
+        if held is not None:
+            yield held[0], RawEntry(held[1])
+
+    def __iter__(self):
+        return self
+
+    def nextTimestamp(self):
+        if self.__next is None:
+            return None
+
+        return self.__next[0]
+
+    def __next__(self):
+        if self.__next is None:
+            raise StopIteration
+
+        current = self.__next
+        self.__next = next(self.__entries, None)
+
+        return current
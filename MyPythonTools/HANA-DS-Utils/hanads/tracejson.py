@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+from json.encoder import encode_basestring_ascii as jsonString
+from hanads.traceutils import RawEntry, reHeaderFields
+
+# One JSON object per entry, the fields of the header are parsed once here.
+# The numbers and the timestamp are checked by reHeaderFields and written
+# as they are, only the strings which can contain anything are escaped.
+JSON_ENTRY = '{0}"thread":{1},"connection":{2},"transaction":{3},' \
+    '"update":{4},"timestamp":"{5}","level":{6},"component":{7},' \
+    '"message":{8}}}' + os.linesep
+
+JSON_NO_HEADER = '{0}"thread":null,"connection":null,"transaction":null,' \
+    '"update":null,"timestamp":"{1}","level":null,"component":null,' \
+    '"message":{2}}}' + os.linesep
+
+# host and service are the same for all entries of a service
+servicePrefixes = {}
+
+
+def formatJsonEntry(key, timestamp, entry):
+    """
+    Formatter for mergeTrace and mergeParallel
+    Returns the entry as one line of JSON with the fields of the header,
+    the message is the rest of the entry including all continuation lines
+    e.g.) [25279]{-1}[-1/-1] 2018-02-24 19:23:53.952603 i Basis  x.cpp : y
+     -> {"host":"host1","service":"indexserver:30003","thread":25279,
+         "connection":-1,"transaction":-1,"update":-1,
+         "timestamp":"2018-02-24 19:23:53.952603","level":"i",
+         "component":"Basis","message":"x.cpp : y"}
+    """
+    prefix = servicePrefixes.get(key)
+
+    if prefix is None:
+        prefix = servicePrefixes[key] = '{{"host":{0},"service":{1},'.format(
+            jsonString(key[0]), jsonString(key[1]))
+
+    if isinstance(entry, RawEntry):
+        text = bytes(entry).decode(errors='replace')
+    else:
+        text = ''.join(entry)
+
+    m = reHeaderFields.match(text)
+
+    if m is None:
+        # e.g.) the line of --collapse
+        return JSON_NO_HEADER.format(prefix, timestamp.strip(),
+                                     jsonString(text.rstrip('\r\n')))
+
+    thread, connection, transaction, update, ts, level, component = \
+        m.groups()
+
+    return JSON_ENTRY.format(
+        prefix, thread, connection, transaction, update, ts,
+        jsonString(level),
+        'null' if component is None else jsonString(component),
+        jsonString(text[m.end():].lstrip(' ').rstrip('\r\n')))
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import json
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from hanads.traceutils import reTraceFile, SrvinfoFromTrcpath, \
+    buildTraceListPerService
+from hanads.tracearchive import isArchive
+
+# Manifest of all trace files is stored in the fsid directory
+MANIFEST_FILE = '.tzmanifest'
+MANIFEST_VERSION = 3
+
+# Number of host directories walked at the same time
+SCAN_WORKERS = 16
+
+
+def listDir(root, relDir):
+    """
+    Returns trace files as (relative path, size, mtime), sub directories
+    and mtime of a single directory
+    """
+    traceFiles = []
+    subDirs = []
+    dirPath = os.path.join(root, relDir)
+    mtime = os.stat(dirPath).st_mtime
+
+    with os.scandir(dirPath) as it:
+        for entry in it:
+            relPath = relDir + '/' + entry.name if relDir else entry.name
+
+            if entry.is_dir(follow_symlinks=False):
+                subDirs.append(relPath)
+            elif reTraceFile.search(entry.name) is not None:
+                stat = entry.stat()
+                traceFiles.append((relPath, stat.st_size, stat.st_mtime))
+
+    return traceFiles, subDirs, mtime
+
+
+def scanTree(root, relDir):
+    """
+    Walks root/relDir recursively
+    Returns trace files and the mtime of every walked directory
+    """
+    traceFiles = []
+    dirMtimes = {}
+    pending = [relDir]
+
+    while pending:
+        current = pending.pop()
+
+        try:
+            files, subDirs, dirMtimes[current] = listDir(root, current)
+        except OSError:
+            # directory vanished or is not readable
+            continue
+
+        traceFiles.extend(files)
+        pending.extend(subDirs)
+
+    return traceFiles, dirMtimes
+
+
+class TraceManifest():
+    """
+    List of all trace files of an fsid with host, service, rotation number,
+    size and mtime. It is saved as a sidecar file in the fsid and reused as
+    long as no directory of the fsid has changed.
+    """
+    def __init__(self, root, rescan=False):
+        self.root = str(root)
+        self.manifestFile = os.path.join(self.root, MANIFEST_FILE)
+
+        self.entries = []
+        self.dirMtimes = {}
+
+        if rescan or not self.__load():
+            self.__build()
+            self.__save()
+
+    def __load(self):
+        try:
+            with open(self.manifestFile) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if manifest.get('version') != MANIFEST_VERSION:
+            return False
+
+        self.entries = manifest['files']
+        self.dirMtimes = manifest['directories']
+
+        updated = self.__refresh()
+
+        if updated is None:
+            return False
+
+        if updated:
+            self.__write()
+
+        return True
+
+    def __refresh(self):
+        """
+        Adding or removing a file changes the mtime of its directory,
+        a stat per directory is enough to find out the manifest is stale.
+        A directory with another mtime is listed again, when only other
+        files than trace files changed (e.g. the manifest itself or index
+        sidecars) its new mtime is taken.
+        Returns the number of directories taken, None if the manifest is
+        stale.
+        """
+        childrenPerDir = None
+        updated = 0
+
+        for relDir, mtime in list(self.dirMtimes.items()):
+            try:
+                current = os.stat(os.path.join(self.root, relDir)).st_mtime
+            except OSError:
+                return None
+
+            if current == mtime:
+                continue
+
+            if childrenPerDir is None:
+                childrenPerDir = {}
+
+                for entry in self.entries:
+                    childrenPerDir.setdefault(
+                        posixpath.dirname(entry['file']), set()).add(
+                            entry['file'])
+
+                for child in self.dirMtimes:
+                    if child:
+                        childrenPerDir.setdefault(
+                            posixpath.dirname(child), set()).add(child)
+
+            try:
+                files, subDirs, _ = listDir(self.root, relDir)
+            except OSError:
+                return None
+
+            if set(relPath for relPath, _, _ in files).union(subDirs) \
+                    != childrenPerDir.get(relDir, set()):
+                return None
+
+            self.dirMtimes[relDir] = current
+            updated += 1
+
+        return updated
+
+    def __build(self):
+        # host directories are the second level, e.g.) trace/<host>
+        # The levels above them are listed here, each host in a worker.
+        self.dirMtimes = {}
+        traceFiles, topDirs, self.dirMtimes[''] = listDir(self.root, '')
+        hostDirs = []
+
+        for relDir in topDirs:
+            files, subDirs, self.dirMtimes[relDir] = \
+                listDir(self.root, relDir)
+            traceFiles.extend(files)
+            hostDirs.extend(subDirs)
+
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+            for files, dirMtimes in executor.map(
+                    lambda relDir: scanTree(self.root, relDir), hostDirs):
+                traceFiles.extend(files)
+                self.dirMtimes.update(dirMtimes)
+
+        self.entries = []
+
+        for relPath, size, mtime in sorted(traceFiles):
+            host, service = SrvinfoFromTrcpath(PurePosixPath(relPath))
+
+            self.entries.append({
+                'file': relPath,
+                'host': host,
+                'service': service,
+                'rotation': int(reTraceFile.search(relPath).group(2)),
+                'size': size,
+                'mtime': mtime,
+            })
+
+    def __save(self):
+        self.__write()
+
+        # creating the manifest changed the mtime of the fsid directory
+        if self.__refresh():
+            self.__write()
+
+    def __write(self):
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'directories': self.dirMtimes,
+            'files': self.entries,
+        }
+
+        # fsid can be on a read-only location.
+        # json.dumps uses the C encoder, json.dump doesn't.
+        try:
+            with open(self.manifestFile, 'w') as f:
+                f.write(json.dumps(manifest))
+        except OSError:
+            pass
+
+    def traceListPerService(self):
+        """
+        Returns the same dictionary as buildTraceListPerService
+        """
+        dictServiceTrace = {}
+        # same file names as Path.glob, without a Path object per file
+        root = str(Path(self.root))
+
+        for entry in self.entries:
+            srvInfo = (entry['host'], entry['service'])
+
+            if srvInfo not in dictServiceTrace:
+                dictServiceTrace[srvInfo] = []
+
+            dictServiceTrace[srvInfo].append(os.path.join(root, entry['file']))
+
+        return dictServiceTrace
+
+
+def loadTraceListPerService(fulldumproot, rescan=False):
+    """
+    Same as buildTraceListPerService, but fsid directories are listed from
+    their manifest
+    """
+    dictServiceTrace = {}
+
+    for p in fulldumproot:
+        if isArchive(p):
+            serviceTrace = buildTraceListPerService([p])
+        else:
+            serviceTrace = TraceManifest(p, rescan).traceListPerService()
+
+        for srvInfo, files in serviceTrace.items():
+            dictServiceTrace.setdefault(srvInfo, []).extend(files)
+
+    return dictServiceTrace
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import sys
+import bz2
+import lzma
+import zlib
+import queue
+import threading
+
+# Merged entries are collected up to this many bytes before one write
+WRITE_BUFFER = 1024 * 1024
+
+# Number of blocks the compression thread can be behind
+COMPRESS_QUEUE = 4
+
+
+def gzipCompressor():
+    # wbits 16+ writes the gzip header and trailer
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+COMPRESSORS = {
+    '.gz': gzipCompressor,
+    '.bz2': bz2.BZ2Compressor,
+    '.xz': lzma.LZMACompressor,
+}
+
+
+def parseSize(size):
+    """
+    Converts a size with an optional K, M or G suffix into bytes
+    e.g.) 512M -> 536870912
+    """
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    size = size.strip().upper()
+
+    if size[-1:] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+
+    return int(size)
+
+
+def splitFileName(path, count):
+    """
+    Name of the count-th file of a split output
+    e.g.) merged.trc.gz -> merged.003.trc.gz
+    """
+    root, compression = os.path.splitext(path)
+
+    if compression not in COMPRESSORS:
+        root, compression = path, ''
+
+    root, ext = os.path.splitext(root)
+
+    return "{0}.{1:03}{2}{3}".format(root, count, ext, compression)
+
+
+class CompressThread():
+    """
+    Compresses blocks and writes them into a file in a background thread.
+    zlib, bz2 and lzma release the GIL, so merging and compressing really
+    run at the same time.
+    """
+    def __init__(self, path, compressor):
+        self.__file = open(path, 'wb')
+        self.__compressor = compressor()
+        self.__queue = queue.Queue(COMPRESS_QUEUE)
+        self.__error = None
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        try:
+            while True:
+                block = self.__queue.get()
+
+                if block is None:
+                    break
+
+                self.__file.write(self.__compressor.compress(block))
+
+            self.__file.write(self.__compressor.flush())
+        except Exception as e:
+            self.__error = e
+        finally:
+            self.__file.close()
+
+    def write(self, block):
+        if self.__error is not None:
+            raise self.__error
+
+        self.__queue.put(block)
+
+    def close(self):
+        self.__queue.put(None)
+        self.__thread.join()
+
+        if self.__error is not None:
+            raise self.__error
+
+
+class TraceWriter():
+    """
+    Output of the merged trace. Entries are collected into large blocks, so
+    there are few write calls. Output files ending with .gz, .bz2 or .xz
+    are compressed in a background thread. With splitSize a new file is
+    started after the entry which makes the current file reach splitSize
+    bytes (uncompressed).
+    path = None writes to stdout.
+    """
+    def __init__(self, path=None, splitSize=None, bufferSize=WRITE_BUFFER):
+        self.__path = path
+        self.__splitSize = splitSize
+        self.__bufferSize = bufferSize
+
+        self.__chunks = []
+        self.__buffered = 0
+        self.__written = 0
+        self.__count = 0
+        self.__out = None
+
+        self.__open()
+
+    def __open(self):
+        if self.__path is None:
+            sys.stdout.flush()
+            self.__out = sys.stdout.buffer
+            return
+
+        if self.__splitSize is not None:
+            path = splitFileName(self.__path, self.__count)
+        else:
+            path = self.__path
+
+        compressor = COMPRESSORS.get(os.path.splitext(path)[1])
+
+        if compressor is not None:
+            self.__out = CompressThread(path, compressor)
+        else:
+            self.__out = open(path, 'wb')
+
+        self.__written = 0
+
+    def write(self, data):
+        """
+        data = merged entry as str, or bytes from the bulk engine
+        """
+        if isinstance(data, str):
+            self.__chunks.append(data)
+            self.__buffered += len(data)
+
+            if self.__buffered >= self.__bufferSize:
+                self.__flushChunks()
+        else:
+            self.__flushChunks()
+            self.__out.write(data)
+            self.__written += len(data)
+
+        if self.__splitSize is not None and self.__path is not None \
+                and self.__written + self.__buffered >= self.__splitSize:
+            self.flush()
+            self.__out.close()
+            self.__count += 1
+            self.__open()
+
+    def __flushChunks(self):
+        if self.__chunks:
+            block = ''.join(self.__chunks).encode(errors='replace')
+            self.__chunks = []
+            self.__out.write(block)
+            self.__written += len(block)
+
+        self.__buffered = 0
+
+    def flush(self):
+        self.__flushChunks()
+
+        if self.__out is not None and hasattr(self.__out, 'flush'):
+            self.__out.flush()
+
+    def close(self):
+        self.flush()
+
+        if self.__path is not None:
+            self.__out.close()
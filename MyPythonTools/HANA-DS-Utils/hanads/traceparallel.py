@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import queue
+import heapq
+from collections import deque
+import multiprocessing as mp
+from hanads.traceutils import MmapTraceTokenizer, FilteredTokenizer, \
+    CollapsedTokenizer, formatEntry, servicePrefix
+from hanads.traceindex import seekOffsets
+
+# Number of trace entries sent to the merging process at once
+BATCH_SIZE = 2000
+
+# Number of batches a worker can get ahead of the merge per service
+QUEUE_BATCHES = 8
+
+# Seconds waited for a batch before checking that the worker still runs
+WORKER_POLL = 1.0
+
+
+def serviceBatches(key, files, since, until, batchSize, entryFilter=None,
+                   collapse=False, sampler=None, formatter=None):
+    """
+    Tokenizes the trace files of one service and yields batches of
+    (timestamp, prefixed entry), or of the output of formatter.
+    Entries not selected by entryFilter are dropped, repeats are collapsed
+    and entries are sampled in the worker.
+    """
+    joinString = servicePrefix(key)
+    tokenizer = MmapTraceTokenizer(files, seekOffsets(files, since),
+                                   since=since)
+
+    if entryFilter is not None:
+        tokenizer = FilteredTokenizer(tokenizer, entryFilter)
+
+    if collapse:
+        tokenizer = CollapsedTokenizer(tokenizer, until)
+
+    if sampler is not None:
+        tokenizer = sampler(tokenizer, key, until)
+
+    batch = []
+
+    for timestamp, entry in tokenizer:
+        if until is not None and timestamp >= until:
+            break
+
+        if formatter is not None:
+            text = formatter(key, timestamp, entry)
+        else:
+            text = formatEntry(entry, joinString)
+
+            if tokenizer.nextTimestamp() is None:
+                # same as mergeTrace for the very last line of the trace
+                text += os.linesep
+
+        batch.append((timestamp, text))
+
+        if len(batch) >= batchSize:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def tokenizeServices(services, requests, responses, since, until, batchSize,
+                     entryFilter=None, collapse=False, sampler=None,
+                     formatter=None):
+    """
+    Worker process: tokenizes the services = list of (index, key, files)
+    given to it. For every index read from requests the next batch of
+    that service is put into responses as (index, batch), with None at the
+    end of the service or the exception if something went wrong.
+    Stops at a None request.
+    """
+    batches = dict((index, serviceBatches(key, files, since, until,
+                                          batchSize, entryFilter, collapse,
+                                          sampler, formatter))
+                   for index, key, files in services)
+
+    while True:
+        index = requests.get()
+
+        if index is None:
+            break
+
+        try:
+            batch = next(batches[index], None)
+        except Exception as e:
+            batch = e
+
+        responses.put((index, batch))
+
+
+class WorkerQueues():
+    """
+    Queues to one tokenizeServices worker. Batches of other services read
+    while waiting for one service are kept until those services ask.
+    A worker which exited without answering (e.g. killed when out of
+    memory) raises RuntimeError instead of waiting forever.
+    """
+    def __init__(self):
+        self.requests = mp.Queue()
+        self.responses = mp.Queue()
+        self.process = None
+        self.__pending = {}
+
+    def request(self, index):
+        self.requests.put(index)
+
+    def batch(self, index):
+        pending = self.__pending.get(index)
+
+        if pending:
+            return pending.popleft()
+
+        while True:
+            try:
+                got, batch = self.responses.get(timeout=WORKER_POLL)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(
+                        "tokenizer process {0} exited with code {1}".format(
+                            self.process.pid, self.process.exitcode))
+
+                continue
+
+            if got == index:
+                return batch
+
+            self.__pending.setdefault(got, deque()).append(batch)
+
+
+class QueueStream():
+    """
+    Reads the batches of one service from the worker tokenizing it.
+    Works like a TraceTokenizer returning already prefixed entries.
+    A new batch is requested for every batch read, so the worker stays
+    the same number of batches ahead.
+    """
+    def __init__(self, index, worker):
+        self.__index = index
+        self.__worker = worker
+        self.__batch = iter(())
+        self.__next = None
+
+        self.__advance()
+
+    def __advance(self):
+        for self.__next in self.__batch:
+            return
+
+        while True:
+            batch = self.__worker.batch(self.__index)
+
+            if batch is None:
+                self.__next = None
+                return
+
+            if isinstance(batch, BaseException):
+                raise batch
+
+            self.__worker.request(self.__index)
+            self.__batch = iter(batch)
+
+            for self.__next in self.__batch:
+                return
+
+    def nextTimestamp(self):
+        if self.__next is None:
+            return None
+
+        return self.__next[0]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.__next is None:
+            raise StopIteration
+
+        current = self.__next
+        self.__advance()
+
+        return current
+
+
+def mergeParallel(services, since=None, until=None,
+                  batchSize=BATCH_SIZE, queueSize=QUEUE_BATCHES,
+                  entryFilter=None, collapse=False, sampler=None,
+                  formatter=None, processes=None):
+    """
+    services = list of (key, files) in the order used for equal timestamps
+    Tokenizes the services in worker processes, at most processes of them
+    (default: number of CPUs) each with its share of the services, and
+    merges them.
+    Yields the same output as mergeTrace.
+    """
+    services = list(services)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    processes = max(min(processes, len(services)), 1)
+
+    workers = []
+    queues = [WorkerQueues() for _ in range(processes)]
+    queueStreams = []
+
+    try:
+        for count, worker in enumerate(queues):
+            shares = [(index, key, files)
+                      for index, (key, files) in enumerate(services)
+                      if index % processes == count]
+            process = mp.Process(target=tokenizeServices,
+                                 args=(shares, worker.requests,
+                                       worker.responses, since, until,
+                                       batchSize, entryFilter, collapse,
+                                       sampler, formatter),
+                                 daemon=True)
+            process.start()
+            worker.process = process
+            workers.append(process)
+
+        # the first batch of every service is asked for first
+        for _ in range(queueSize):
+            for index in range(len(services)):
+                queues[index % processes].request(index)
+
+        for index in range(len(services)):
+            stream = QueueStream(index, queues[index % processes])
+
+            if stream.nextTimestamp() is not None:
+                queueStreams.append((stream.nextTimestamp(), index, stream))
+
+        heapq.heapify(queueStreams)
+
+        while len(queueStreams) > 0:
+            timestamp, count, stream = heapq.heappop(queueStreams)
+
+            if queueStreams:
+                nexttimestamp = queueStreams[0][0]
+            else:
+                nexttimestamp = None
+
+            while True:
+                yield stream.__next__()[1]
+
+                if stream.nextTimestamp() is None:
+                    break
+
+                if nexttimestamp is not None \
+                        and stream.nextTimestamp() > nexttimestamp:
+                    heapq.heappush(queueStreams,
+                                   (stream.nextTimestamp(), count, stream))
+                    break
+
+    finally:
+        # workers wait for the next request until they are stopped, also
+        # when the merge is not consumed until the end
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+
+            process.join()
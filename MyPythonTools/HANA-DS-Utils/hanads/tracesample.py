@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import sys
+import random
+from math import exp, log
+from hanads.traceutils import RawEntry
+from hanads.tracehistogram import BucketLabel
+
+
+class Reservoir():
+    """
+    Uniform random sample of size items of a stream of unknown length
+    (Algorithm L). Between two picks the number of items to skip is drawn
+    at once, so most items cost only a counter decrement.
+    """
+    def __init__(self, size, rng):
+        self.size = size
+        self.items = []
+        self.__rng = rng
+        self.__w = 1.0
+        self.__skip = 0
+
+    def __random(self):
+        # in (0, 1], log(0) is undefined
+        return 1.0 - self.__rng.random()
+
+    def __nextSkip(self):
+        self.__w *= exp(log(self.__random()) / self.size)
+
+        try:
+            self.__skip = int(log(self.__random()) / log(1.0 - self.__w))
+        except (ValueError, ZeroDivisionError, OverflowError):
+            # w rounded to 1 or 0
+            self.__skip = 0 if self.__w >= 1.0 else sys.maxsize
+
+    def wants(self):
+        """
+        True if the next item goes into the sample, it has to be given
+        to add() then. Otherwise the item is counted as skipped.
+        """
+        if len(self.items) < self.size:
+            return True
+
+        if self.__skip > 0:
+            self.__skip -= 1
+            return False
+
+        return True
+
+    def add(self, item):
+        if len(self.items) < self.size:
+            self.items.append(item)
+
+            if len(self.items) == self.size:
+                self.__nextSkip()
+
+            return
+
+        self.items[self.__rng.randrange(self.size)] = item
+        self.__nextSkip()
+
+
+class SampledTokenizer():
+    """
+    Tokenizer returning a random sample of the entries of a tokenizer in
+    timestamp order.
+    Without seconds it is a uniform sample of size entries of the whole
+    trace, which is only known after reading up to until.
+    With seconds it is a uniform sample of size entries per time bucket of
+    that many seconds, returned as soon as the bucket is complete.
+    Only the sampled entries are kept.
+    """
+    def __init__(self, tokenizer, size, seconds=None, until=None, rng=None):
+        self.__tokenizer = tokenizer
+        self.__size = size
+        self.__until = until
+        self.__rng = rng if rng is not None else random.Random()
+        self.__bucketLabel = BucketLabel(seconds) if seconds else None
+        self.__bucket = None
+        self.__reservoir = Reservoir(size, self.__rng)
+        self.__seq = 0
+        self.__pending = iter(())
+        self.__next = None
+
+        self.__advance()
+
+    def __sample(self):
+        """
+        Reads entries into the reservoir until the bucket ends.
+        Returns the entries sorted, an empty list at the end of the trace.
+        The first entry of the next bucket is already in the new reservoir.
+        """
+        for timestamp, entry in self.__tokenizer:
+            if self.__until is not None and timestamp >= self.__until:
+                break
+
+            if self.__bucketLabel is not None:
+                bucket = self.__bucketLabel(timestamp)
+
+                if bucket != self.__bucket:
+                    first = self.__bucket is None
+                    self.__bucket = bucket
+
+                    if not first:
+                        # entry is the first one of the next bucket
+                        items = self.__nextReservoir()
+                        self.__take(timestamp, entry)
+
+                        return items
+
+            self.__take(timestamp, entry)
+
+        return self.__nextReservoir()
+
+    def __nextReservoir(self):
+        """
+        Returns the sorted entries of the reservoir and starts a new one
+        """
+        items = sorted(self.__reservoir.items)
+        self.__reservoir = Reservoir(self.__size, self.__rng)
+
+        return items
+
+    def __take(self, timestamp, entry):
+        self.__seq += 1
+
+        if self.__reservoir.wants():
+            if isinstance(entry, RawEntry):
+                # a copy, so the mapped trace file isn't held
+                entry = RawEntry((bytes(entry),))
+
+            self.__reservoir.add((timestamp, self.__seq, entry))
+
+    def __advance(self):
+        for self.__next in self.__pending:
+            return
+
+        while True:
+            items = self.__sample()
+
+            if not items:
+                self.__next = None
+                return
+
+            self.__pending = iter(items)
+
+            for self.__next in self.__pending:
+                return
+
+    def __iter__(self):
+        return self
+
+    def nextTimestamp(self):
+        if self.__next is None:
+            return None
+
+        return self.__next[0]
+
+    def __next__(self):
+        if self.__next is None:
+            raise StopIteration
+
+        timestamp, _, entry = self.__next
+        self.__advance()
+
+        return timestamp, entry
+
+
+class Sampler():
+    """
+    Wraps the tokenizer of every service into a SampledTokenizer.
+    With a seed, the sample of a service is the same in every run.
+    """
+    def __init__(self, size, seconds=None, seed=None):
+        self.size = size
+        self.seconds = seconds
+        self.seed = seed
+
+    def __call__(self, tokenizer, key, until=None):
+        if self.seed is not None:
+            rng = random.Random("{0} {1} {2}".format(self.seed, *key))
+        else:
+            rng = random.Random()
+
+        return SampledTokenizer(tokenizer, self.size, self.seconds, until,
+                                rng)
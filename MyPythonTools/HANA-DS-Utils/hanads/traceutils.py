@@ -3,31 +3,264 @@
 import re
 import sys
 import os
+import io
+import bz2
+import gzip
+import lzma
 import heapq
+import mmap
+import queue
+import bisect
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
+from hanads.tracearchive import isArchive, listArchiveTraceFiles
+
+try:
+    from re import _parser as sreParse
+except ImportError:
+    import sre_parse as sreParse
+
+
+# [25279]{-1}[-1/-1] 2018-02-24 19:23:53.952603 i Basis            |
+reHeader = re.compile(r'\[[0-9]+\]{-?[0-9]+}\[-?[0-9]+/-?[0-9]+\]')
+reHeaderBytes = re.compile(reHeader.pattern.encode())
+
+# Fields of the trace entry header.
+# thread, connection, transaction, update id, timestamp, level, component
+reHeaderFields = re.compile(
+    r'\[([0-9]+)\]{(-?[0-9]+)}\[(-?[0-9]+)/(-?[0-9]+)\] '
+    r'([0-9-]+ [0-9:.]+) (\S)(?: +([^\s|]+))?')
+reHeaderFieldsBytes = re.compile(reHeaderFields.pattern.encode())
+
+HEADER_FIELDS = ('thread', 'connection', 'transaction', 'update',
+                 'timestamp', 'level', 'component')
+
+# Size of the blocks read backwards from the end of a trace file
+PROBE_BLOCK = 64 * 1024
+
+# Size of the decompressed chunks handed from the read-ahead thread to
+# FileSeq, and number of chunks it can get ahead
+STREAM_CHUNK = 1024 * 1024
+STREAM_CHUNKS = 8
+
+# indexserver_host.30003.000.trc, archived rotations can be compressed
+# e.g.) indexserver_host.30003.000.trc.gz
+reTraceFile = re.compile(r'\.(3[0-9]{4})\.([0-9]{3})\.trc(\.gz|\.bz2|\.xz)?$')
+
+COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
 
 
 def findTraceFiles(path):
     p = Path(path)
 
-    reTraceFile = re.compile(r'\.(3[0-9]{4})\.([0-9]{3})\.trc$')
-
-    for i in p.glob('**/*trc'):
+    for i in p.glob('**/*trc*'):
         if reTraceFile.search(i.name) is not None:
             yield i
 
 
+def isCompressed(traceFile):
+    return os.path.splitext(str(traceFile))[1] in COMPRESSED_OPENERS
+
+
+def isPlainFile(traceFile):
+    """
+    True if the trace file can be seeked and mapped.
+    Compressed files and archive members are read into memory instead.
+    """
+    return isinstance(traceFile, (str, os.PathLike)) \
+        and not isCompressed(traceFile)
+
+
+@contextmanager
+def openTraceFile(traceFile):
+    """
+    Opens a trace file, a compressed trace file or an archive member
+    for reading in binary mode
+    """
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(str(traceFile))[1])
+
+    if isinstance(traceFile, (str, os.PathLike)):
+        with (opener or open)(traceFile, 'rb') as f:
+            yield f
+    else:
+        with traceFile.open() as member:
+            if opener is None:
+                yield member
+            else:
+                with opener(member, 'rb') as f:
+                    yield f
+
+
+def readTraceFile(traceFile):
+    """
+    Returns the whole content of a compressed trace file or an archive
+    member decompressed
+    """
+    with openTraceFile(traceFile) as f:
+        return f.read()
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    Binary file reading a compressed trace file or an archive member which
+    is decompressed in a background thread. The thread gets at most
+    STREAM_CHUNKS chunks ahead of the reader, so only those are in memory.
+    """
+    def __init__(self, traceFile):
+        super().__init__()
+        self.__chunks = queue.Queue(STREAM_CHUNKS)
+        self.__stopped = threading.Event()
+        self.__chunk = memoryview(b'')
+        self.__eof = False
+
+        # daemon thread, a reader stopping early doesn't keep the
+        # interpreter from exiting
+        threading.Thread(target=self.__decompress, args=(traceFile,),
+                         daemon=True).start()
+
+    def __put(self, item):
+        while not self.__stopped.is_set():
+            try:
+                self.__chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def __decompress(self, traceFile):
+        try:
+            with openTraceFile(traceFile) as f:
+                while True:
+                    chunk = f.read(STREAM_CHUNK)
+
+                    if not self.__put(chunk) or not chunk:
+                        return
+        except Exception as e:
+            self.__put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self.__chunk:
+            if self.__eof:
+                return 0
+
+            chunk = self.__chunks.get()
+
+            if isinstance(chunk, Exception):
+                raise chunk
+
+            if not chunk:
+                self.__eof = True
+                return 0
+
+            self.__chunk = memoryview(chunk)
+
+        size = min(len(b), len(self.__chunk))
+        b[:size] = self.__chunk[:size]
+        self.__chunk = self.__chunk[size:]
+
+        return size
+
+    def close(self):
+        self.__stopped.set()
+        super().close()
+
+
+class ReadAhead():
+    """
+    Decompresses the next compressed trace file (or reads the next archive
+    member) in a background thread
+    while the current one is being tokenized.
+    zlib, bz2 and lzma release the GIL, so both really run at the same time.
+    get returns the whole content for the tokenizers working on buffers,
+    with stream=True it returns a ChunkStream, so a large file is never
+    in memory at once.
+    """
+    def __init__(self, files, stream=False):
+        self.__files = files
+        self.__stream = stream
+        self.__executor = None
+        self.__pending = {}
+
+    def prefetch(self, idx):
+        if idx >= len(self.__files) or idx in self.__pending \
+                or isPlainFile(self.__files[idx]):
+            return
+
+        if self.__stream:
+            self.__pending[idx] = ChunkStream(self.__files[idx])
+            return
+
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=1)
+
+        self.__pending[idx] = self.__executor.submit(readTraceFile,
+                                                     self.__files[idx])
+
+    def get(self, idx):
+        """
+        Returns decompressed content of the compressed file or archive
+        member idx, or the ChunkStream reading it, and starts reading the
+        file after it
+        """
+        self.prefetch(idx)
+        pending = self.__pending.pop(idx)
+        self.prefetch(idx + 1)
+
+        if self.__stream:
+            return pending
+
+        return pending.result()
+
+
+def hostFromTrcpath(filePath):
+    """
+    Host directory of a trace file, found from the nearest trace directory
+    above it
+    e.g.) trace/<host>/x.trc or trace/<host>/DB_<SID>/x.trc of an fsid,
+    <host>/trace/x.trc or <host>/trace/DB_<SID>/x.trc of an installation.
+    Paths without a trace directory use the second level.
+    """
+    parts = filePath.parts[:-1]
+
+    for idx in range(len(parts) - 1, -1, -1):
+        if parts[idx] != 'trace':
+            continue
+
+        below = parts[idx+1:]
+
+        # tenant directories are below the trace directory of the host
+        if idx > 0 and (not below or below[0].startswith('DB_')):
+            return parts[idx-1]
+
+        if below:
+            return below[0]
+
+    return filePath.parts[1]
+
+
 def SrvinfoFromTrcpath(filePath, fqdn=False):
     fileName = filePath.name
     indexUnderscore = fileName.index('_')
 
     if fqdn:
-        hostname = filePath.parts[1]
+        hostname = hostFromTrcpath(filePath)
     else:
-        hostname = filePath.parts[1].split('.')[0]
+        hostname = hostFromTrcpath(filePath).split('.')[0]
 
     servicename = fileName[0:indexUnderscore]
-    serviceport = fileName[-13:-8]
+    serviceport = reTraceFile.search(fileName).group(1)
 
     return hostname, "{0}:{1}".format(servicename, serviceport)
 
@@ -37,6 +270,18 @@ def buildTraceListPerService(fulldumproot):
     # setServices = set()
 
     for p in fulldumproot:
+        if isArchive(p):
+            # trace files are read from the archive without extracting it
+            for memberPath, member in listArchiveTraceFiles(p, reTraceFile):
+                srvInfo = SrvinfoFromTrcpath(memberPath)
+
+                if srvInfo not in dictServiceTrace:
+                    dictServiceTrace[srvInfo] = []
+
+                dictServiceTrace[srvInfo].append(member)
+
+            continue
+
         for i in findTraceFiles(p):
             srvInfo = SrvinfoFromTrcpath(i.relative_to(p))
 
@@ -66,14 +311,172 @@ def applyFilter(dictServiceTrace, includeHosts=None, includeServices=None):
         del dictServiceTrace[key]
 
 
+def normalizeTimestamp(timestamp):
+    """
+    Converts a user given timestamp into the trace timestamp format
+    e.g.) 2018-02-24 19:23 -> 2018-02-24 19:23:00.000000
+    """
+    for fmt in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S',
+                '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(timestamp.strip(), fmt)\
+                .strftime('%Y-%m-%d %H:%M:%S.%f')
+        except ValueError:
+            pass
+
+    raise ValueError("Unknown timestamp format: {0}".format(timestamp))
+
+
+def headerTimestamp(headerLine):
+    """
+    Returns the timestamp of a trace entry header line read in binary mode
+    """
+    timestampIndex = headerLine.index(b' ')
+
+    return headerLine[timestampIndex+1:timestampIndex+27]\
+        .decode('ascii', errors='replace')
+
+
+def parseHeader(headerLine):
+    """
+    Returns the fields of a trace entry header line as a dictionary,
+    None if it is not a header
+    e.g.) [25279]{-1}[-1/-1] 2018-02-24 19:23:53.952603 i Basis |
+     -> {'thread': '25279', 'connection': '-1', 'transaction': '-1',
+         'update': '-1', 'timestamp': '2018-02-24 19:23:53.952603',
+         'level': 'i', 'component': 'Basis'}
+    """
+    m = reHeaderFields.match(headerLine)
+
+    if m is None:
+        return None
+
+    return dict(zip(HEADER_FIELDS, m.groups()))
+
+
+def probeTraceFile(traceFile, blockSize=PROBE_BLOCK):
+    """
+    Returns timestamps of the first and the last trace entry of a trace file
+    without reading the whole file. (None, None) if there is no entry header.
+    The last one is None for compressed files and archive members which
+    can't be read backwards.
+    """
+    with openTraceFile(traceFile) as f:
+        first = None
+
+        for line in f:
+            if reHeaderBytes.match(line):
+                first = headerTimestamp(line)
+                break
+
+        if first is None:
+            return None, None
+
+        if not isPlainFile(traceFile):
+            return first, None
+
+        pos = f.seek(0, os.SEEK_END)
+        tail = b''
+
+        while pos > 0:
+            readSize = min(blockSize, pos)
+            pos -= readSize
+
+            f.seek(pos)
+            lines = (f.read(readSize) + tail).split(b'\n')
+
+            # the first line of a block can be cut in the middle
+            tail = lines[0] if pos > 0 else b''
+
+            for line in reversed(lines if pos == 0 else lines[1:]):
+                if reHeaderBytes.match(line):
+                    return first, headerTimestamp(line)
+
+    return first, first
+
+
+def probeTraceFiles(files):
+    """
+    Returns (first, last, traceFile) of the files in timestamp order.
+    Files without an entry header come last with first = None.
+    """
+    probed = []
+
+    for traceFile in files:
+        first, last = probeTraceFile(traceFile)
+        probed.append((first, last, traceFile))
+
+    # last can be None and archive members don't compare,
+    # so files with the same first timestamp keep their order
+    probed.sort(key=lambda item: (item[0] is None, item[0] or ''))
+
+    return probed
+
+
+def orderTraceFiles(files, since=None, until=None):
+    """
+    files = list of trace file names of one service
+    Returns the files in timestamp order. Files whose entries are all out of
+    the range [since, until) are left out.
+    """
+    probed = probeTraceFiles(files)
+
+    if since is None and until is None:
+        return [traceFile for _, _, traceFile in probed]
+
+    ordered = []
+
+    for idx, (first, last, traceFile) in enumerate(probed):
+        if first is None:
+            continue
+
+        # last entry of a compressed file is unknown, but it is older than
+        # the first entry of the next rotation
+        if last is None and idx + 1 < len(probed) \
+                and probed[idx+1][0] is not None:
+            last = probed[idx+1][0]
+
+        if since is not None and last is not None and last < since:
+            continue
+
+        if until is not None and first >= until:
+            continue
+
+        ordered.append(traceFile)
+
+    return ordered
+
+
 class FileSeq():
-    def __init__(self, files):
+    def __init__(self, files, offsets=None):
+        """
+        files = list of trace file names read one after another
+        offsets = list of byte offsets to start reading each file from
+        """
         self.__files = files
+        self.__offsets = offsets
+        self.__readAhead = ReadAhead(files, stream=True)
 
         self.__curIdx = 0
-        self.__curFile = open(self.__files[self.__curIdx], errors='replace')
+        self.__curFile = self.__open(self.__curIdx)
         self.__curLine = 0
 
+    def __open(self, idx):
+        if not isPlainFile(self.__files[idx]):
+            return io.TextIOWrapper(
+                io.BufferedReader(self.__readAhead.get(idx)),
+                errors='replace')
+
+        # the next file can be decompressed while this one is read
+        self.__readAhead.prefetch(idx + 1)
+
+        f = open(self.__files[idx], errors='replace')
+
+        if self.__offsets is not None and self.__offsets[idx] > 0:
+            f.seek(self.__offsets[idx])
+
+        return f
+
     def __iter__(self):
         return self
 
@@ -93,8 +496,7 @@ class FileSeq():
             self.__curIdx += 1
 
             if self.__curIdx < len(self.__files):
-                self.__curFile = open(self.__files[self.__curIdx],
-                                      errors='replace')
+                self.__curFile = self.__open(self.__curIdx)
                 self.__curLine = 0
             else:
                 break
@@ -102,15 +504,12 @@ class FileSeq():
         raise StopIteration
 
 
-# [25279]{-1}[-1/-1] 2018-02-24 19:23:53.952603 i Basis            |
-reHeader = re.compile(r'\[[0-9]+\]{-?[0-9]+}\[-?[0-9]+/-?[0-9]+\]')
-
-
 class TraceTokenizer():
 
-    def __init__(self, trace):
+    def __init__(self, trace, since=None):
         """
-        inputFiles = list of Path objects
+        trace = iterator of trace lines (e.g. FileSeq)
+        since = skip trace entries older than this normalized timestamp
         """
         self.__traceInput = trace
         self.__nexttimestamp = None
@@ -120,6 +519,11 @@ class TraceTokenizer():
         # (continued from previous sequence)
         self.__skipGarbage()
 
+        if since is not None:
+            while self.__nexttimestamp is not None \
+                    and self.__nexttimestamp < since:
+                self.__next__()
+
     def __skipGarbage(self):
         for line in self.__traceInput:
             if reHeader.match(line):
@@ -160,26 +564,1008 @@ class TraceTokenizer():
         return timestamp, entry
 
 
-def mergeTrace(queueTokenizers):
+def mapTraceFile(traceFile):
+    """
+    Returns read only mmap of the trace file, None for an empty file
+    """
+    with open(traceFile, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file can't be mapped
+            return None
+
+
+class RawEntry(tuple):
+    """
+    Trace entry as a tuple of memoryview slices of the memory mapped trace
+    files. Iterating over it decodes the entry into lines, so it can be used
+    wherever a list of lines from TraceTokenizer is expected.
+    """
+    __slots__ = ()
+
+    def __bytes__(self):
+        return b''.join(tuple.__iter__(self))
+
+    def __iter__(self):
+        return iter(bytes(self).decode(errors='replace')
+                    .splitlines(keepends=True))
+
+    def prefixed(self, prefix):
+        """
+        Returns the decoded entry with prefix in front of every line.
+        Same as prefix + prefix.join(entry) without splitting into lines.
+        """
+        if len(self) == 1:
+            text = str(self[0], errors='replace')
+        else:
+            text = bytes(self).decode(errors='replace')
+
+        if text[-1:] == '\n':
+            return prefix + text[:-1].replace('\n', '\n' + prefix) + '\n'
+
+        return prefix + text.replace('\n', '\n' + prefix)
+
+    def write(self, f):
+        """
+        Writes the entry as it is into a binary file
+        """
+        for chunk in tuple.__iter__(self):
+            f.write(chunk)
+
+
+def scanHeaders(buf, offset=0):
+    """
+    buf = mmap or content of a trace file
+    offset = start of a line
+    Yields (offset, timestamp) of the entry headers from the given offset
+    """
+    find = buf.find
+    match = reHeaderBytes.match
+
+    while True:
+        if match(buf, offset):
+            timestampIndex = find(b' ', offset)
+
+            yield offset, buf[timestampIndex+1:timestampIndex+28]\
+                .decode('ascii', 'replace')
+
+        # only a line starting with '[' can be a header
+        offset = find(b'\n[', offset) + 1
+
+        if offset == 0:
+            return
+
+
+class MmapTraceTokenizer():
+    """
+    Same as TraceTokenizer(FileSeq(files, offsets), since) but memory maps
+    the trace files and looks for the entry headers in bytes.
+    Entries are returned as RawEntry and only decoded when they are used.
+    buffers = function(idx) returning the mapped or decompressed content of
+    files[idx] instead of reading the file again, e.g. from a MergedView
+    """
+    def __init__(self, files, offsets=None, since=None, buffers=None):
+        self.__files = files
+        self.__offsets = offsets
+        self.__buffers = buffers
+        self.__readAhead = ReadAhead(files)
+        self.__curIdx = -1
+        self.__curMap = None
+        self.__curView = None
+        self.__headers = iter(())
+
+        self.__nexttimestamp = None
+        self.__nextstart = None
+
+        # skip trace entry without trace header line
+        # (continued from previous sequence)
+        while self.__openNext():
+            for self.__nextstart, self.__nexttimestamp in self.__headers:
+                break
+
+            if self.__nexttimestamp is not None:
+                break
+
+        if since is not None:
+            while self.__nexttimestamp is not None \
+                    and self.__nexttimestamp < since:
+                self.__next__()
+
+    def __openNext(self):
+        """
+        Maps the next non-empty file. __nextstart is set to its start offset
+        """
+        while self.__curIdx + 1 < len(self.__files):
+            self.__curIdx += 1
+
+            if self.__buffers is not None:
+                self.__curMap = self.__buffers(self.__curIdx)
+            elif not isPlainFile(self.__files[self.__curIdx]):
+                # decompressed content works the same as a mapped file
+                self.__curMap = self.__readAhead.get(self.__curIdx)
+            else:
+                self.__readAhead.prefetch(self.__curIdx + 1)
+                self.__curMap = mapTraceFile(self.__files[self.__curIdx])
+
+            if not self.__curMap:
+                continue
+
+            self.__curView = memoryview(self.__curMap)
+
+            if self.__offsets is not None:
+                self.__nextstart = self.__offsets[self.__curIdx]
+            else:
+                self.__nextstart = 0
+
+            self.__headers = scanHeaders(self.__curMap, self.__nextstart)
+
+            return True
+
+        return False
+
+    def __iter__(self):
+        return self
+
+    def nextTimestamp(self):
+        return self.__nexttimestamp
+
+    def __next__(self):
+        timestamp = self.__nexttimestamp
+
+        if timestamp is None:
+            raise StopIteration
+
+        start = self.__nextstart
+
+        for self.__nextstart, self.__nexttimestamp in self.__headers:
+            return timestamp, \
+                RawEntry((self.__curView[start:self.__nextstart],))
+
+        # lines at the beginning of the next file until the first header
+        # still belong to this entry
+        chunks = [self.__curView[start:]]
+
+        while self.__openNext():
+            start = self.__nextstart
+
+            for self.__nextstart, self.__nexttimestamp in self.__headers:
+                if self.__nextstart > start:
+                    chunks.append(self.__curView[start:self.__nextstart])
+
+                return timestamp, RawEntry(chunks)
+
+            chunks.append(self.__curView[start:])
+
+        self.__nexttimestamp = None
+        self.__nextstart = None
+
+        return timestamp, RawEntry(chunks)
+
+
+def requiredLiteral(pattern):
+    """
+    Returns the longest literal string every match of the regular expression
+    has to contain, None if there is none
+    e.g.) 'out of (memory|disk) in [0-9]+' -> 'out of '
+    """
+    try:
+        parsed = sreParse.parse(pattern)
+    except re.error:
+        return None
+
+    if parsed.state.flags & (re.IGNORECASE | re.VERBOSE):
+        return None
+
+    candidates = []
+
+    def walk(items):
+        literal = []
+
+        for op, av in items:
+            if op is sreParse.LITERAL:
+                literal.append(chr(av))
+                continue
+
+            candidates.append(''.join(literal))
+            literal = []
+
+            if op is sreParse.SUBPATTERN and not av[1] & re.IGNORECASE:
+                walk(av[3])
+            elif op in (sreParse.MAX_REPEAT, sreParse.MIN_REPEAT) \
+                    and av[0] >= 1:
+                walk(av[2])
+
+        candidates.append(''.join(literal))
+
+    walk(parsed)
+
+    return max(candidates, key=len) or None
+
+
+def isCombinable(pattern):
+    """
+    True if the pattern can be joined with others into one alternation.
+    Back references are numbered by the position of their group and inline
+    flags like (?i) apply to the whole expression, so patterns with them
+    are searched on their own.
+    """
+    try:
+        parsed = sreParse.parse(pattern)
+    except re.error:
+        return False
+
+    if parsed.state.flags & ~re.UNICODE:
+        return False
+
+    def walk(items):
+        for op, av in items:
+            if op in (sreParse.GROUPREF, sreParse.GROUPREF_EXISTS):
+                return True
+
+            pending = [av]
+
+            while pending:
+                value = pending.pop()
+
+                if isinstance(value, sreParse.SubPattern):
+                    if walk(value):
+                        return True
+                elif isinstance(value, (tuple, list)):
+                    pending.extend(value)
+
+        return False
+
+    return not walk(parsed)
+
+
+def compileBytes(pattern, flags=0):
+    """
+    Returns the pattern compiled for bytes, None if it only works on str
+    e.g.) caf\\u00e9 is a bad escape in bytes, [é] would be two bytes
+    """
+    if not pattern.isascii():
+        return None
+
+    try:
+        return re.compile(pattern.encode(), flags)
+    except re.error:
+        return None
+
+
+class EntryFilter():
+    """
+    Selects trace entries by regular expressions searched in the whole
+    entry, ^ and $ match at every line like grep.
+    An entry is selected if any of the match patterns is found and none of
+    the exclude patterns. The patterns of a set are joined into one regular
+    expression where possible, so an entry is searched once per set. The
+    literals the patterns require are looked for first, most entries are
+    dropped by that substring search.
+    """
+    def __init__(self, match=None, exclude=None):
+        self.__match = self.__compile(match)
+        self.__exclude = self.__compile(exclude)
+
+    @staticmethod
+    def __compile(patterns):
+        if not patterns:
+            return None
+
+        literals = [requiredLiteral(pattern) for pattern in patterns]
+
+        if None in literals:
+            # one pattern without literal can match any entry
+            literals = None
+
+        # RawEntry is searched as bytes without decoding, patterns which
+        # only work on str search the decoded entry
+        sources = []
+
+        for isBytes in (True, False):
+            combined = [pattern for pattern in patterns
+                        if isCombinable(pattern)
+                        and (compileBytes(pattern) is not None) == isBytes]
+
+            if len(combined) > 1:
+                try:
+                    joined = '|'.join('(?:{0})'.format(pattern)
+                                      for pattern in combined)
+                    re.compile(joined)
+                    combined = [joined]
+                except re.error:
+                    # e.g.) the same group name in two patterns
+                    pass
+
+            sources.extend(combined)
+
+        sources.extend(pattern for pattern in patterns
+                       if not isCombinable(pattern))
+
+        regexes = []
+        regexesBytes = []
+
+        for source in sources:
+            regex = re.compile(source, re.MULTILINE)
+            regexBytes = compileBytes(source, re.MULTILINE)
+
+            regexes.append((regex, False))
+
+            if regexBytes is None:
+                regexesBytes.append((regex, True))
+            else:
+                regexesBytes.append((regexBytes, False))
+
+        if literals is None:
+            literalsBytes = None
+        else:
+            literalsBytes = [literal.encode() for literal in literals]
+
+        return (literals, regexes), (literalsBytes, regexesBytes)
+
+    @staticmethod
+    def __search(compiled, text):
+        literals, regexes = compiled
+
+        if literals is not None \
+                and not any(literal in text for literal in literals):
+            return False
+
+        for regex, decode in regexes:
+            if decode:
+                found = regex.search(text.decode(errors='replace'))
+            else:
+                found = regex.search(text)
+
+            if found is not None:
+                return True
+
+        return False
+
+    def __call__(self, entry):
+        if isinstance(entry, RawEntry):
+            text = bytes(entry)
+            kind = 1
+        else:
+            text = ''.join(entry)
+            kind = 0
+
+        if self.__match is not None \
+                and not self.__search(self.__match[kind], text):
+            return False
+
+        if self.__exclude is not None \
+                and self.__search(self.__exclude[kind], text):
+            return False
+
+        return True
+
+
+class FilteredTokenizer():
+    """
+    Tokenizer returning only the entries selected by entryFilter, so the
+    others are never formatted or written. Works with any tokenizer.
+    """
+    def __init__(self, tokenizer, entryFilter):
+        self.__tokenizer = tokenizer
+        self.__entryFilter = entryFilter
+        self.__next = None
+
+        self.__advance()
+
+    def __advance(self):
+        for self.__next in self.__tokenizer:
+            if self.__entryFilter(self.__next[1]):
+                return
+
+        self.__next = None
+
+    def __iter__(self):
+        return self
+
+    def nextTimestamp(self):
+        if self.__next is None:
+            return None
+
+        return self.__next[0]
+
+    def __next__(self):
+        if self.__next is None:
+            raise StopIteration
+
+        current = self.__next
+        self.__advance()
+
+        return current
+
+
+def repeatKey(entry):
+    """
+    Hash of the entry without thread id and timestamp, the same for
+    repeats of a message
+    e.g.) [25279]{-1}[-1/-1] 2018-02-24 19:23:53.952603 i Basis | x
+     -> {-1}[-1/-1] i Basis | x
+    """
+    if isinstance(entry, RawEntry):
+        text = bytes(entry)
+        space = text.find(b' ')
+        return hash(text[text.find(b']')+1:space] + text[space+27:])
+
+    text = ''.join(entry)
+    space = text.find(' ')
+
+    return hash(text[text.find(']')+1:space] + text[space+27:])
+
+
+class CollapsedTokenizer():
+    """
+    Tokenizer replacing consecutive repeats of an entry by one line
+    'last message repeated N times between t1 and t2'.
+    Only the hash of the last distinct entry is kept, however long the
+    repeats go on. A single repeat is returned as it is.
+    Repeats at or after until are not counted.
+    """
+    def __init__(self, tokenizer, until=None):
+        self.__tokenizer = tokenizer
+        self.__until = until
+        self.__pending = deque()
+        self.__lookahead = next(tokenizer, None)
+
+        self.__fill()
+
+    def __fill(self):
+        if self.__pending or self.__lookahead is None:
+            return
+
+        first = self.__lookahead
+        key = repeatKey(first[1])
+        self.__pending.append(first)
+        self.__lookahead = None
+
+        count = 0
+        since = None
+        last = None
+
+        for current in self.__tokenizer:
+            if repeatKey(current[1]) != key or (self.__until is not None
+                                                and current[0] >= self.__until):
+                self.__lookahead = current
+                break
+
+            count += 1
+            last = current
+
+            if since is None:
+                since = current[0]
+
+        if count == 1:
+            self.__pending.append(last)
+        elif count > 1:
+            self.__pending.append((last[0], [
+                "last message repeated {0} times between {1} and {2}{3}"
+                .format(count, since.strip(), last[0].strip(), os.linesep)]))
+
+    def __iter__(self):
+        return self
+
+    def nextTimestamp(self):
+        if not self.__pending:
+            return None
+
+        return self.__pending[0][0]
+
+    def __next__(self):
+        if not self.__pending:
+            raise StopIteration
+
+        current = self.__pending.popleft()
+        self.__fill()
+
+        return current
+
+
+def formatEntry(entry, joinString):
+    """
+    Returns the trace entry with joinString in front of every line
+    """
+    if isinstance(entry, RawEntry):
+        return entry.prefixed(joinString)
+
+    return "{0}{1}".format(joinString, joinString.join(entry))
+
+
+def servicePrefix(key):
+    """
+    Prefix put in front of every merged trace line
+    e.g.) ('host1', 'indexserver:30003') -> '[host1_in03] '
+    """
+    return "[{0}_{1}] ".format(key[0], key[1][0:2]+key[1][-2:])
+
+
+def collapseRepeats(queueTokenizers, until=None):
+    """
+    Wraps every tokenizer in the queue into a CollapsedTokenizer.
+    The first entry stays the same, so the heap stays valid.
+    """
+    for idx, (timestamp, key, tokenizer) in enumerate(queueTokenizers):
+        queueTokenizers[idx] = (timestamp, key,
+                                CollapsedTokenizer(tokenizer, until))
+
+
+def mergeTrace(queueTokenizers, until=None, collapse=False, formatter=None):
+    """
+    queueTokenizers = heap of (nextTimestamp, key, TraceTokenizer)
+    until = stop before the first trace entry at or after this timestamp
+    collapse = replace consecutive repeats of a message in a service by
+    one line
+    formatter = function(key, timestamp, entry) returning the output of an
+    entry instead of the prefixed lines
+    """
+    if collapse:
+        collapseRepeats(queueTokenizers, until)
+
     while len(queueTokenizers) > 0:
         timestamp, key, tokenizer = heapq.heappop(queueTokenizers)
 
-        joinString = "[{0}_{1}] ".format(key[0], key[1][0:2]+key[1][-2:])
+        if until is not None and timestamp >= until:
+            break
+
+        joinString = servicePrefix(key)
 
         if queueTokenizers:
             nexttimestamp = queueTokenizers[0][0]
+        else:
+            nexttimestamp = None
 
         while True:
-            yield "{0}{1}".format(joinString,
-                                  joinString.join(tokenizer.__next__()[1]))
+            if formatter is None:
+                yield formatEntry(tokenizer.__next__()[1], joinString)
+            else:
+                yield formatter(key, *tokenizer.__next__())
 
             if tokenizer.nextTimestamp() is None:
                 # The very last line of the trace doesn't have the line break.
                 # Explicitely adding a line break to keep the formatting
-                yield os.linesep
+                if formatter is None:
+                    yield os.linesep
                 break
 
-            if tokenizer.nextTimestamp() > nexttimestamp:
+            if until is not None and tokenizer.nextTimestamp() >= until:
+                break
+
+            if nexttimestamp is not None \
+                    and tokenizer.nextTimestamp() > nexttimestamp:
                 heapq.heappush(queueTokenizers,
                                (tokenizer.nextTimestamp(), key, tokenizer))
                 break
+
+
+# Key of a stream that has no more trace entries
+EXHAUSTED = 1 << 100
+
+
+def timestampKey(timestamp):
+    """
+    Converts a trace timestamp into an integer with the same order
+    e.g.) 2018-02-24 19:23:53.952603 -> 20180224192353952603
+    """
+    return int(timestamp[0:4] + timestamp[5:7] + timestamp[8:10]
+               + timestamp[11:13] + timestamp[14:16] + timestamp[17:19]
+               + timestamp[20:26])
+
+
+def mergeTraceLoserTree(queueTokenizers, until=None, collapse=False,
+                        formatter=None):
+    """
+    Drop-in replacement of mergeTrace for many streams, with the same
+    output also for equal timestamps. heapq is written in C and stays
+    faster up to 512 streams, so this one is only compared in benchmerge.py.
+    Timestamps are converted into integer keys when a stream enters the
+    loser tree, equal timestamps are ordered by the service key.
+    Consecutive entries of the winning stream are emitted without touching
+    the tree as long as they are not newer than the runner-up, so like in
+    mergeTrace the winner goes first at the timestamp of the runner-up.
+    """
+    if collapse:
+        collapseRepeats(queueTokenizers, until)
+
+    streams = sorted(queueTokenizers, key=lambda item: item[1])
+    count = len(streams)
+
+    size = 1
+    while size < count:
+        size *= 2
+
+    tokenizers = [tokenizer for _, _, tokenizer in streams]
+    serviceKeys = [key for _, key, _ in streams]
+    prefixes = [servicePrefix(key) for key in serviceKeys]
+    keys = [EXHAUSTED] * size
+
+    def streamKey(idx, timestamp):
+        if until is not None and timestamp >= until:
+            return EXHAUSTED
+
+        try:
+            return timestampKey(timestamp) * size + idx
+        except ValueError:
+            # broken timestamp, keep the stream where it is
+            if keys[idx] == EXHAUSTED:
+                return idx
+
+            return keys[idx]
+
+    for idx, (timestamp, _, _) in enumerate(streams):
+        keys[idx] = streamKey(idx, timestamp)
+
+    # tree[0] is the winner, tree[1:] are the losers of each match
+    tree = [0] * size
+    winners = [0] * size + list(range(size))
+
+    for node in range(size - 1, 0, -1):
+        left, right = winners[2*node], winners[2*node + 1]
+
+        if keys[left] <= keys[right]:
+            winners[node], tree[node] = left, right
+        else:
+            winners[node], tree[node] = right, left
+
+    tree[0] = winners[1] if size > 1 else 0
+
+    while True:
+        winner = tree[0]
+
+        if keys[winner] == EXHAUSTED:
+            break
+
+        # runner-up is the best of the streams the winner has beaten
+        runnerUp = EXHAUSTED
+        node = (winner + size) >> 1
+
+        while node > 0:
+            if keys[tree[node]] < runnerUp:
+                runnerUp = keys[tree[node]]
+
+            node >>= 1
+
+        if runnerUp == EXHAUSTED:
+            # the last stream runs until the end of the window
+            limit = until
+            limitIdx = -1
+        else:
+            limitIdx = runnerUp % size
+            limit = tokenizers[limitIdx].nextTimestamp()
+
+        tokenizer = tokenizers[winner]
+        joinString = prefixes[winner]
+
+        # timestamps within a run are only compared as strings with the
+        # runner-up, the integer key is needed when the winner changes
+        while True:
+            if formatter is None:
+                yield formatEntry(tokenizer.__next__()[1], joinString)
+            else:
+                yield formatter(serviceKeys[winner], *tokenizer.__next__())
+
+            timestamp = tokenizer.nextTimestamp()
+
+            if timestamp is None:
+                # The very last line of the trace doesn't have the line break.
+                # Explicitely adding a line break to keep the formatting
+                if formatter is None:
+                    yield os.linesep
+                key = EXHAUSTED
+                break
+
+            # like mergeTrace the winner keeps going at the timestamp of
+            # the runner-up, but stops at until
+            if limit is not None and (timestamp > limit or (
+                    timestamp == limit and limitIdx < 0)):
+                key = streamKey(winner, timestamp)
+                break
+
+        # replay the matches on the path of the winner
+        keys[winner] = key
+        node = (winner + size) >> 1
+
+        while node > 0:
+            if keys[tree[node]] < keys[winner]:
+                tree[node], winner = winner, tree[node]
+
+            node >>= 1
+
+        tree[0] = winner
+
+
+# Ranges of a trace file smaller than this are scanned, larger ones bisected
+SEEK_SPAN = 64 * 1024
+
+
+class SeekableTraceFile():
+    """
+    Trace file of a MergedView. It is mapped (or decompressed) on first use.
+    The entry headers found while looking up a timestamp are kept as
+    checkpoints, so later lookups only bisect between the nearest ones.
+    """
+    def __init__(self, traceFile, first=None):
+        self.traceFile = traceFile
+        self.first = first
+        self.__buf = None
+        self.__loaded = False
+
+        # header offsets in file order and their timestamps
+        self.__offsets = []
+        self.__timestamps = []
+
+    def buffer(self):
+        if not self.__loaded:
+            if isPlainFile(self.traceFile):
+                self.__buf = mapTraceFile(self.traceFile)
+            else:
+                self.__buf = readTraceFile(self.traceFile)
+
+            self.__loaded = True
+
+        return self.__buf
+
+    def size(self):
+        buf = self.buffer()
+
+        return len(buf) if buf else 0
+
+    def __checkpoint(self, offset, timestamp):
+        pos = bisect.bisect_left(self.__offsets, offset)
+
+        if pos < len(self.__offsets) and self.__offsets[pos] == offset:
+            return
+
+        self.__offsets.insert(pos, offset)
+        self.__timestamps.insert(pos, timestamp)
+
+    def __headerAfter(self, offset, limit):
+        """
+        Returns (offset, timestamp) of the first entry header at or after
+        offset and before limit, (None, None) if there is none
+        """
+        buf = self.buffer()
+
+        # start of the first line at or after offset
+        lineBreak = buf.find(b'\n', offset - 1, limit)
+
+        if lineBreak < 0:
+            return None, None
+
+        for header, timestamp in scanHeaders(buf, lineBreak + 1):
+            if header >= limit:
+                break
+
+            return header, timestamp
+
+        return None, None
+
+    def offsetFor(self, timestamp):
+        """
+        Returns the offset of the first entry header at or after timestamp,
+        the size of the file if there is none
+        """
+        buf = self.buffer()
+
+        if not buf:
+            return 0
+
+        pos = bisect.bisect_left(self.__timestamps, timestamp)
+        low = self.__offsets[pos-1] if pos > 0 else 0
+        high = self.__offsets[pos] if pos < len(self.__offsets) else len(buf)
+
+        while high - low > SEEK_SPAN:
+            offset, current = self.__headerAfter((low + high) // 2, high)
+
+            if offset is None:
+                # one huge entry, the rest is scanned
+                break
+
+            self.__checkpoint(offset, current)
+
+            if current < timestamp:
+                low = offset
+            else:
+                high = offset
+
+        for offset, current in scanHeaders(buf, low):
+            if offset >= high:
+                break
+
+            if current >= timestamp:
+                self.__checkpoint(offset, current)
+                return offset
+
+        return high
+
+    def headersBefore(self, offset, count):
+        """
+        Returns (offset, timestamp) of up to count entry headers before
+        offset, the nearest one first
+        """
+        buf = self.buffer()
+        headers = []
+
+        while len(headers) < count and offset > 0:
+            offset = buf.rfind(b'\n[', 0, offset) + 1
+
+            if reHeaderBytes.match(buf, offset):
+                timestampIndex = buf.find(b' ', offset)
+                headers.append((offset, buf[timestampIndex+1:timestampIndex+28]
+                                .decode('ascii', 'replace')))
+
+        return headers
+
+
+class ServiceView():
+    """
+    Trace files of one service in a MergedView
+    """
+    def __init__(self, key, files):
+        self.key = key
+        self.files = [SeekableTraceFile(traceFile, first)
+                      for first, _, traceFile in probeTraceFiles(files)
+                      if first is not None]
+        self.__firsts = [f.first for f in self.files]
+
+    def position(self, timestamp):
+        """
+        Returns (file index, offset) of the first entry at or after
+        timestamp, None if there is none
+        """
+        idx = max(bisect.bisect_left(self.__firsts, timestamp) - 1, 0)
+
+        while idx < len(self.files):
+            offset = self.files[idx].offsetFor(timestamp)
+
+            if offset < self.files[idx].size():
+                return idx, offset
+
+            idx += 1
+
+        return None
+
+    def headersBefore(self, timestamp, count):
+        """
+        Returns (timestamp, file index, offset) of up to count entries
+        before timestamp, the nearest one first
+        """
+        position = self.position(timestamp)
+
+        if position is None:
+            idx = len(self.files) - 1
+            offset = self.files[idx].size() if self.files else 0
+        else:
+            idx, offset = position
+
+        headers = []
+
+        while idx >= 0 and len(headers) < count:
+            for header, current in self.files[idx].headersBefore(
+                    offset, count - len(headers)):
+                headers.append((current, idx, header))
+
+            idx -= 1
+
+            if idx >= 0:
+                offset = self.files[idx].size()
+
+        return headers
+
+    def tokenizer(self, idx, offset):
+        """
+        Returns a tokenizer starting at the entry at offset of file idx
+        """
+        files = self.files[idx:]
+
+        return MmapTraceTokenizer([f.traceFile for f in files],
+                                  [offset] + [0] * (len(files) - 1),
+                                  buffers=lambda i: files[i].buffer())
+
+
+def entryTuple(key, timestamp, entry):
+    """
+    Formatter for mergeTrace returning (timestamp, key, entry)
+    """
+    return timestamp, key, entry
+
+
+class MergedView():
+    """
+    Lazy merged view of the traces of all services.
+    dictServiceTrace = dictionary from buildTraceListPerService
+    Entries are returned as (timestamp, key, entry) in merged order, only
+    the parts of the trace files around the requested timestamps are read.
+    Offsets found by a lookup are kept for the later ones.
+    formatEntry(entry, servicePrefix(key)) returns an entry like tracezipper.
+    """
+    def __init__(self, dictServiceTrace):
+        self.services = [ServiceView(key, dictServiceTrace[key])
+                         for key in sorted(dictServiceTrace)]
+
+    def __merge(self, starts, until=None):
+        queue = []
+
+        for service, (idx, offset) in starts:
+            tokenizer = service.tokenizer(idx, offset)
+
+            if tokenizer.nextTimestamp() is not None:
+                queue.append((tokenizer.nextTimestamp(), service.key,
+                              tokenizer))
+
+        heapq.heapify(queue)
+
+        return mergeTrace(queue, until=until, formatter=entryTuple)
+
+    def __starts(self, timestamp):
+        starts = []
+
+        for service in self.services:
+            if timestamp is None:
+                position = (0, 0) if service.files else None
+            else:
+                position = service.position(timestamp)
+
+            if position is not None:
+                starts.append((service, position))
+
+        return starts
+
+    def entriesFrom(self, timestamp=None):
+        """
+        Iterates over the entries from timestamp (or the beginning) to the
+        end of the trace
+        """
+        return self.__merge(self.__starts(timestamp))
+
+    def entriesBetween(self, since, until):
+        """
+        Iterates over the entries in [since, until)
+        """
+        return self.__merge(self.__starts(since), until)
+
+    def entriesBefore(self, timestamp, count):
+        """
+        Returns the list of the count entries before timestamp
+        """
+        newest = heapq.nlargest(count, (
+            (current, idx, fileIdx, offset)
+            for idx, service in enumerate(self.services)
+            for current, fileIdx, offset
+            in service.headersBefore(timestamp, count)))
+
+        # the oldest selected entry of each service is where it starts
+        starts = {}
+
+        for _, idx, fileIdx, offset in newest:
+            if idx not in starts or (fileIdx, offset) < starts[idx]:
+                starts[idx] = (fileIdx, offset)
+
+        return list(self.__merge([(self.services[idx], position)
+                                  for idx, position in starts.items()],
+                                 timestamp))
+
+    def entriesAround(self, timestamp, count):
+        """
+        Returns the list of count entries before timestamp and count entries
+        from timestamp on
+        """
+        entries = self.entriesBefore(timestamp, count)
+
+        if count > 0:
+            for n, entry in enumerate(self.entriesFrom(timestamp), 1):
+                entries.append(entry)
+
+                if n >= count:
+                    break
+
+        return entries
+
+
+def openMergedView(fulldumproot):
+    """
+    fulldumproot = list of fsid directories or archives
+    """
+    return MergedView(buildTraceListPerService(fulldumproot))
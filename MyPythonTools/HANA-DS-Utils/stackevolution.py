@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import sys
+import argparse
+from hanads.stackshortutils import stackShortTimestamp
+from hanads.stackevolution import followStacks, CHANGED
+
+class __Conf:
+    def __init__(self):
+        parser = argparse.ArgumentParser(description="Follow the stacks of the threads over RTE dumps taken one after another and show the threads stuck in the same stack")
+
+        parser.add_argument('rte', nargs='+', help='Input RTE dump files to analyze, ordered by the timestamp of their [STACK_SHORT] section')
+        parser.add_argument('-o','--output', required=False, type=str, help='Output to file. If not given ouput will be written to stdout')
+        parser.add_argument('-s','--span', type=int, default=2, help='Threads with the same stack in this many consecutive files or more will be shown (default: 2)')
+        parser.add_argument('--show-inactive', action="store_true", help='Show Inactive threads in output')
+        parser.add_argument('--simple-match', action="store_true", help="Stacks are consisdered same if all frames' names are same")
+        parser.add_argument('--changes', action="store_true", help='Also show every thread whose stack changed from the previous file')
+        parser.add_argument('--keep-order', action="store_true", help='Use the files in the given order')
+        parser.add_argument('-p','--processes', type=int, help='Number of worker processes parsing the RTE dumps ahead (default: number of CPUs)')
+
+        args = parser.parse_args()
+
+        self.inputFiles = args.rte
+
+        if args.output is None:
+            self.output = sys.stdout
+        else:
+            self.output = open(args.output, mode='w')
+
+        self.span = args.span
+        self.showInactive = args.show_inactive
+        self.simpleMatch = args.simple_match
+        self.changes = args.changes
+        self.processes = args.processes
+
+        if not args.keep_order:
+            timestamps = [stackShortTimestamp(filename) for filename in self.inputFiles]
+
+            if None in timestamps:
+                print("Not all files have a [STACK_SHORT] timestamp, the given order is used", file=sys.stderr)
+            else:
+                self.inputFiles = [filename for timestamp, count, filename in sorted(zip(timestamps, range(len(timestamps)), self.inputFiles))]
+
+
+def main():
+    conf = __Conf()
+    files = conf.inputFiles
+
+    for count, (kind, thread, run) in followStacks(files, conf.span, conf.simpleMatch, conf.showInactive, conf.processes):
+        if kind == CHANGED:
+            if conf.changes:
+                print("[{0}]{1} {2} changed after {3} files".format(count, files[count], thread, run.count), file=conf.output)
+
+            continue
+
+        print("Stuck in {0} files: [{1}]{2} .. [{3}]{4}".format(run.count, run.first, files[run.first], run.last(), files[run.last()]), file=conf.output)
+        print(thread, file=conf.output)
+
+        if conf.simpleMatch:
+            for frameNumber, frame in enumerate(run.stack, start=1):
+                print(" {0}: {1}".format(frameNumber, frame), file=conf.output)
+            print(file=conf.output)
+        else:
+            print(run.stack, file=conf.output)
+
+
+if __name__ == "__main__":
+	main()
@@ -2,7 +2,7 @@
 # vim: tabstop=4 shiftwidth=4
 import sys
 import argparse
-from hanads.stackshortutils import dedupStackShort,findSameThread
+from hanads.stackshortutils import findSameThreadInFiles
 
 class __Conf:
     def __init__(self):
@@ -13,6 +13,7 @@ class __Conf:
         parser.add_argument('-s','--span', required=False, type=int, help='Threads that appears in more than or equals to value of this option will be shown(default: number of all input files)')
         parser.add_argument('--show-inactive', action="store_true", help='Show Inactive threads in output')
         parser.add_argument('--simple-match', action="store_true", help="Stacks are consisdered same if all frames' names are same")
+        parser.add_argument('-p','--processes', type=int, help='Number of worker processes parsing the RTE dumps (default: number of CPUs)')
 
         args = parser.parse_args()
 
@@ -30,23 +31,17 @@ class __Conf:
 
         self.showInactive = args.show_inactive
         self.simpleMatch = args.simple_match
+        self.processes = args.processes
 
 
 def main():
     conf = __Conf()
 
-    lstlstThreads = []
-    
     """
-    Create a list of threads list from rte files
-    Position within the list is important because later on the index position is used to find out the filename
+    The rte files are parsed in parallel, the file numbers are the index
+    position within conf.inputFiles
     """
-    for filename in conf.inputFiles:
-        with open(filename) as rte:
-            threads, dedup = dedupStackShort(rte)
-            lstlstThreads.append(threads)
-
-    dictThreadToFiles = findSameThread(lstlstThreads, simpleMatch = conf.simpleMatch);
+    dictThreadToFiles = findSameThreadInFiles(conf.inputFiles, simpleMatch = conf.simpleMatch, span = conf.span, processes = conf.processes)
 
     for thread, inputNums in dictThreadToFiles.items():
 
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import sys
+import argparse
+from hanads.traceutils import normalizeTimestamp
+from hanads.stackstore import StackStore, addDumps, framesFromText, \
+    fingerprintOf
+
+
+class __Conf:
+    def __init__(self):
+        parser = argparse.ArgumentParser(description="Keep the stacks of RTE dumps in a SQLite store and find in which dumps a stack was seen")
+
+        parser.add_argument('store', help='SQLite file of the store, created if it does not exist')
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('-a','--add', nargs='+', metavar='RTE', help='Add the [STACK_SHORT] section of RTE dump files, files already in the store are skipped')
+        group.add_argument('-f','--find', metavar='STACK', help='Show the dumps with a stack, given as fingerprint (or its beginning) or as a file with the frame lines of the stack copied from an RTE dump')
+        group.add_argument('-t','--top', type=int, metavar='N', help='Show the N stacks seen in most dumps')
+        parser.add_argument('--system', type=str, help='With --add the system the dumps are from, with --top only dumps of this system')
+        parser.add_argument('--from', dest='since', type=normalizeTimestamp, help='Only dumps taken at or after this timestamp (e.g. "2018-02-24 19:20:00")')
+        parser.add_argument('--to', dest='until', type=normalizeTimestamp, help='Only dumps taken before this timestamp')
+        parser.add_argument('--threads', action='store_true', help='With --find show the threads with the stack of every dump')
+        parser.add_argument('-p','--processes', type=int, help='Number of worker processes parsing the RTE dumps (default: number of CPUs)')
+
+        args = parser.parse_args()
+
+        self.store = args.store
+        self.add = args.add
+        self.find = args.find
+        self.top = args.top
+        self.system = args.system
+        self.since = args.since
+        self.until = args.until
+        self.threads = args.threads
+        self.processes = args.processes
+
+
+def printFrames(frames):
+    for frameNumber, frame in enumerate(frames, start=1):
+        print(" {0}: {1}".format(frameNumber, frame))
+
+
+def find(store, conf):
+    if os.path.isfile(conf.find):
+        with open(conf.find) as stack:
+            frames = framesFromText(stack)
+
+        if not frames:
+            print("No frames in {0}".format(conf.find), file=sys.stderr)
+            sys.exit(1)
+
+        fingerprints = [fingerprintOf(frames)]
+    else:
+        fingerprints = store.fingerprints(conf.find)
+
+    if len(fingerprints) > 1:
+        print("Fingerprint {0} is ambiguous:".format(conf.find), file=sys.stderr)
+
+        for fingerprint in fingerprints:
+            print(fingerprint, file=sys.stderr)
+
+        sys.exit(1)
+
+    fingerprint = fingerprints[0] if fingerprints else None
+    dumps = [] if fingerprint is None else \
+        store.dumpsWithStack(fingerprint, conf.since, conf.until)
+
+    if not dumps:
+        print("Stack not seen", file=sys.stderr)
+        sys.exit(1)
+
+    print("Fingerprint: {0}".format(fingerprint))
+    printFrames(store.frames(fingerprint))
+    print("Number of Dumps: {0}".format(len(dumps)))
+
+    for dumpId, path, system, taken, threads in dumps:
+        print("{0} {1} {2} Threads: {3}".format(taken, system or '-', path, threads))
+
+        if conf.threads:
+            for context, tid, name in store.threadsWithStack(fingerprint, dumpId):
+                print("  {0}[thr={1}]: {2} at".format(context, tid, name))
+
+
+def top(store, conf):
+    for fingerprint, dumps, threads in store.topStacks(conf.top, conf.since, conf.until, conf.system):
+        print("Fingerprint: {0}".format(fingerprint))
+        print("Number of Dumps: {0} Threads: {1}".format(dumps, threads))
+        printFrames(store.frames(fingerprint))
+        print('--')
+
+
+def main():
+    conf = __Conf()
+    store = StackStore(conf.store)
+
+    try:
+        if conf.add is not None:
+            for path, threads in addDumps(store, conf.add, conf.system, conf.processes):
+                print("{0}: {1} threads".format(path, threads), file=sys.stderr)
+        elif conf.find is not None:
+            find(store, conf)
+        else:
+            top(store, conf)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
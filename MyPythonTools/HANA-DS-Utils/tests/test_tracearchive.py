@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import tarfile
+import zipfile
+import tempfile
+import unittest
+from hanads.traceutils import buildTraceListPerService, openTraceFile
+from hanads.tracearchive import ArchiveMember
+
+ENTRY = "[1000]{{-1}}[-1/-1] 2018-02-24 19:23:53.952603 i Basis  x.cpp : {0}\n"
+
+TRACE_FILES = [
+    'fsid/trace/hostA/indexserver_hostA.30003.000.trc',
+    'fsid/trace/hostA/indexserver_hostA.30003.001.trc',
+    'fsid/trace/hostA/DB_HDB/indexserver_hostA.30040.000.trc',
+    'fsid/trace/hostB/nameserver_hostB.30001.000.trc',
+]
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, 'dump')
+
+        for name in TRACE_FILES + ['fsid/trace/hostA/other.txt']:
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            with open(path, 'w') as f:
+                f.write(ENTRY.format(name))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def archive(self, name, mode):
+        path = os.path.join(self.tmp.name, name)
+
+        if mode == 'zip':
+            with zipfile.ZipFile(path, 'w') as archive:
+                archive.write(os.path.join(self.root, 'fsid'), 'fsid')
+
+                for name in TRACE_FILES:
+                    archive.write(os.path.join(self.root, name), name)
+        else:
+            with tarfile.open(path, mode) as archive:
+                archive.add(os.path.join(self.root, 'fsid'), 'fsid')
+
+        return path
+
+    def contents(self, path):
+        contents = {}
+
+        for srvInfo, files in buildTraceListPerService([path]).items():
+            for traceFile in files:
+                with openTraceFile(traceFile) as f:
+                    contents.setdefault(srvInfo, []).append(
+                        f.read().decode())
+
+        return dict((srvInfo, sorted(texts))
+                    for srvInfo, texts in contents.items())
+
+    def test_same_services_as_directory(self):
+        expected = self.contents(os.path.join(self.root, 'fsid'))
+
+        self.assertEqual(sorted(expected), [
+            ('hostA', 'indexserver:30003'), ('hostA', 'indexserver:30040'),
+            ('hostB', 'nameserver:30001')])
+
+        for name, mode in [('fsid.tar', 'w'), ('fsid.tgz', 'w:gz'),
+                           ('fsid.tar.bz2', 'w:bz2'),
+                           ('fsid.tar.xz', 'w:xz'), ('fsid.zip', 'zip')]:
+            self.assertEqual(self.contents(self.archive(name, mode)),
+                             expected, name)
+
+    def test_compressed_tar_spooled(self):
+        path = self.archive('fsid.tgz', 'w:gz')
+        files = [traceFile for files in
+                 buildTraceListPerService([path]).values()
+                 for traceFile in files]
+
+        # read in one pass into plain files, which can be mapped and
+        # seeked instead of decompressing the archive up to each member
+        self.assertEqual(len(files), len(TRACE_FILES))
+
+        for traceFile in files:
+            self.assertNotIsInstance(traceFile, ArchiveMember)
+            self.assertTrue(os.path.isfile(traceFile))
+
+
+if __name__ == "__main__":
+    unittest.main()
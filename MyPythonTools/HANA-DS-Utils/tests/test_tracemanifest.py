@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+from hanads import tracemanifest
+from hanads.tracemanifest import TraceManifest
+
+ENTRY = "[1000]{-1}[-1/-1] 2018-02-24 19:23:53.952603 i Basis  x.cpp : y\n"
+
+
+class TraceManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.hostDir = os.path.join(self.root, 'trace', 'hostA')
+        os.makedirs(self.hostDir)
+        self.addTrace('indexserver_hostA.30003.000.trc')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def addTrace(self, name):
+        with open(os.path.join(self.hostDir, name), 'w') as f:
+            f.write(ENTRY)
+
+        self.touch(self.hostDir)
+
+    def touch(self, path):
+        # a later mtime even on file systems with coarse timestamps
+        later = time.time() + 10
+        os.utime(path, (later, later))
+
+    def open(self):
+        """
+        Returns the manifest of the fsid and whether it was built again
+        """
+        with mock.patch.object(tracemanifest, 'scanTree',
+                               wraps=tracemanifest.scanTree) as scanTree:
+            manifest = TraceManifest(self.root)
+
+        return manifest, scanTree.called
+
+    def files(self, manifest):
+        return sorted(entry['file'] for entry in manifest.entries)
+
+    def test_second_run_loads_manifest(self):
+        manifest, built = self.open()
+        self.assertTrue(built)
+
+        manifest, built = self.open()
+        self.assertFalse(built)
+        self.assertEqual(self.files(manifest),
+                         ['trace/hostA/indexserver_hostA.30003.000.trc'])
+
+    def test_sidecar_files_keep_manifest(self):
+        self.open()
+
+        with open(os.path.join(self.hostDir,
+                               'indexserver_hostA.30003.000.trc.tzidx'),
+                  'w') as f:
+            f.write('{}')
+
+        self.touch(self.hostDir)
+
+        manifest, built = self.open()
+        self.assertFalse(built)
+
+        # the new mtime was taken, the third run doesn't list it again
+        with mock.patch.object(tracemanifest, 'listDir',
+                               wraps=tracemanifest.listDir) as listDir:
+            TraceManifest(self.root)
+
+        self.assertFalse(listDir.called)
+
+    def test_new_trace_file_rebuilds(self):
+        self.open()
+        self.addTrace('indexserver_hostA.30003.001.trc')
+
+        manifest, built = self.open()
+        self.assertTrue(built)
+        self.assertEqual(self.files(manifest),
+                         ['trace/hostA/indexserver_hostA.30003.000.trc',
+                          'trace/hostA/indexserver_hostA.30003.001.trc'])
+
+    def test_new_host_directory_rebuilds(self):
+        self.open()
+        os.makedirs(os.path.join(self.root, 'trace', 'hostB'))
+        self.touch(os.path.join(self.root, 'trace'))
+
+        manifest, built = self.open()
+        self.assertTrue(built)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import heapq
+import tempfile
+import unittest
+from hanads.traceutils import TraceTokenizer, FileSeq, mergeTrace
+from hanads.traceparallel import mergeParallel
+
+ENTRY = "[1000]{{-1}}[-1/-1] 2018-02-24 19:23:{0:02}.000000 i Basis  x.cpp : {1}\n"
+
+
+def crash(key, timestamp, entry):
+    # worker process dies without an exception, e.g. killed when out of
+    # memory
+    os._exit(3)
+
+
+class MergeParallelTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.services = []
+
+        for count, host in enumerate(['hostA', 'hostB', 'hostC']):
+            traceFile = os.path.join(
+                self.tmp.name, 'indexserver_{0}.30003.000.trc'.format(host))
+
+            with open(traceFile, 'w') as f:
+                for second in range(count, 60, 3):
+                    f.write(ENTRY.format(second, host))
+
+            self.services.append(((host, 'indexserver:30003'), [traceFile]))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_output_as_merge_trace(self):
+        queue = [(tokenizer.nextTimestamp(), key, tokenizer)
+                 for key, tokenizer in
+                 ((key, TraceTokenizer(FileSeq(files)))
+                  for key, files in self.services)]
+        heapq.heapify(queue)
+
+        self.assertEqual(''.join(mergeParallel(self.services, batchSize=4,
+                                               processes=2)),
+                         ''.join(mergeTrace(queue)))
+
+    def test_dead_worker_raises(self):
+        with self.assertRaises(RuntimeError):
+            list(mergeParallel(self.services, formatter=crash, processes=2))
+
+
+if __name__ == "__main__":
+    unittest.main()
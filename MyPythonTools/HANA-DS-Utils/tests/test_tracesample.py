@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import random
+import unittest
+from hanads.tracesample import SampledTokenizer, Reservoir
+
+
+def trace(seconds):
+    """
+    (timestamp, entry) of one entry at each of the seconds after 19:23:00
+    """
+    return [("2018-02-24 19:23:{0:02}.{1:06} ".format(second, count),
+             ["entry {0}\n".format(count)])
+            for count, second in enumerate(seconds)]
+
+
+class SampledTokenizerTest(unittest.TestCase):
+    def sample(self, entries, size, seconds=None, until=None):
+        return list(SampledTokenizer(iter(entries), size, seconds, until,
+                                     random.Random(1)))
+
+    def test_large_sample_returns_every_entry(self):
+        entries = trace([0, 1, 1, 5, 12, 13, 13, 13, 29, 40, 41, 59])
+
+        self.assertEqual(self.sample(entries, len(entries)), entries)
+        self.assertEqual(self.sample(entries, 100000), entries)
+
+        for seconds in (1, 10, 15, 60):
+            self.assertEqual(self.sample(entries, 100000, seconds), entries)
+
+    def test_bucket_with_single_entry(self):
+        entries = trace([0, 10, 20, 21, 30])
+
+        sampled = self.sample(entries, 1, 10)
+
+        self.assertEqual(len(sampled), 4)
+        self.assertEqual(sampled[:2], entries[:2])
+        self.assertIn(sampled[2], entries[2:4])
+        self.assertEqual(sampled[3], entries[4])
+
+    def test_sample_size_per_bucket(self):
+        entries = trace([second for second in range(30) for _ in range(5)])
+        sampled = self.sample(entries, 2, 10)
+
+        self.assertEqual(len(sampled), 6)
+        self.assertEqual(sampled, sorted(sampled))
+
+        for bucket in ('0', '1', '2'):
+            self.assertEqual(len([timestamp for timestamp, _ in sampled
+                                  if timestamp[17] == bucket]), 2)
+
+    def test_until(self):
+        entries = trace([0, 1, 12, 13, 25])
+
+        self.assertEqual(self.sample(entries, 100, 10,
+                                     "2018-02-24 19:23:13.000000"),
+                         entries[:3])
+
+
+class ReservoirTest(unittest.TestCase):
+    def test_uniform(self):
+        rng = random.Random(7)
+        counts = [0] * 10
+
+        for _ in range(2000):
+            reservoir = Reservoir(3, rng)
+
+            for item in range(10):
+                if reservoir.wants():
+                    reservoir.add(item)
+
+            for item in reservoir.items:
+                counts[item] += 1
+
+        # every item is picked with probability 3/10
+        for count in counts:
+            self.assertTrue(450 < count < 750, counts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import os
+import gzip
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from pathlib import PurePosixPath
+from hanads import traceutils
+from hanads.traceutils import hostFromTrcpath, SrvinfoFromTrcpath, \
+    EntryFilter, RawEntry, FileSeq, ChunkStream
+
+
+class HostFromTrcpathTest(unittest.TestCase):
+    def host(self, path):
+        return hostFromTrcpath(PurePosixPath(path))
+
+    def test_fsid(self):
+        self.assertEqual(self.host('trace/hostA/x.trc'), 'hostA')
+        self.assertEqual(self.host('fsid/trace/hostA/x.trc'), 'hostA')
+        self.assertEqual(self.host('dumps/fsid/trace/hostA/x.trc'), 'hostA')
+
+    def test_fsid_tenant(self):
+        self.assertEqual(self.host('trace/hostA/DB_HDB/x.trc'), 'hostA')
+        self.assertEqual(self.host('fsid/trace/hostA/DB_HDB/x.trc'), 'hostA')
+
+    def test_installation(self):
+        self.assertEqual(self.host('HDB00/hostA/trace/x.trc'), 'hostA')
+        self.assertEqual(self.host('HDB00/hostA/trace/DB_HDB/x.trc'),
+                         'hostA')
+
+    def test_without_trace_directory(self):
+        self.assertEqual(self.host('fsid/hostA/x.trc'), 'hostA')
+
+    def test_srvinfo(self):
+        self.assertEqual(
+            SrvinfoFromTrcpath(PurePosixPath(
+                'fsid/trace/hostA.example.com/DB_HDB/'
+                'indexserver_hostA.30040.001.trc')),
+            ('hostA', 'indexserver:30040'))
+
+
+class EntryFilterTest(unittest.TestCase):
+    def selects(self, entryFilter, text):
+        """
+        Result of the filter for the lines of TraceTokenizer and for the
+        RawEntry of MmapTraceTokenizer, which have to be the same
+        """
+        lines = entryFilter(text.splitlines(keepends=True))
+        raw = entryFilter(RawEntry((memoryview(text.encode()),)))
+        self.assertEqual(lines, raw)
+
+        return lines
+
+    def test_back_references(self):
+        entryFilter = EntryFilter([r'(a)\1', r'(b)\1'])
+
+        self.assertTrue(self.selects(entryFilter, 'x aa y\n'))
+        self.assertTrue(self.selects(entryFilter, 'x bb y\n'))
+        self.assertFalse(self.selects(entryFilter, 'x ab y\n'))
+
+    def test_inline_flags(self):
+        entryFilter = EntryFilter(['(?i)error', 'warning'])
+
+        self.assertTrue(self.selects(entryFilter, 'ERROR\n'))
+        self.assertTrue(self.selects(entryFilter, 'warning\n'))
+        self.assertFalse(self.selects(entryFilter, 'WARNING\n'))
+
+    def test_str_only_patterns(self):
+        entryFilter = EntryFilter([r'caf\u00e9', 'na[iï]ve'], ['x'])
+
+        self.assertTrue(self.selects(entryFilter, 'un caf\u00e9\n'))
+        self.assertTrue(self.selects(entryFilter, 'na\u00efve\n'))
+        self.assertFalse(self.selects(entryFilter, 'cafe\n'))
+        self.assertFalse(self.selects(entryFilter, 'x caf\u00e9\n'))
+
+    def test_multiline_entry(self):
+        entryFilter = EntryFilter(['^second'], ['^third'])
+
+        self.assertTrue(self.selects(entryFilter, 'first\nsecond\n'))
+        self.assertFalse(self.selects(entryFilter, 'first second\n'))
+        self.assertFalse(self.selects(entryFilter,
+                                      'first\nsecond\nthird\n'))
+
+
+class CompressedFileSeqTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.lines = ["[1000]{{-1}}[-1/-1] 2018-02-24 19:23:53.{0:06} i "
+                      "Basis  x.cpp : message {0}\n".format(count)
+                      for count in range(5000)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, lines):
+        traceFile = os.path.join(self.tmp.name, name)
+
+        with gzip.open(traceFile, 'wt') as f:
+            f.writelines(lines)
+
+        return traceFile
+
+    def test_lines_of_rotations(self):
+        files = [self.write('indexserver_hostA.30003.000.trc.gz',
+                            self.lines[:3000]),
+                 self.write('indexserver_hostA.30003.001.trc.gz',
+                            self.lines[3000:])]
+
+        # small chunks, so lines are split between chunks
+        with mock.patch.object(traceutils, 'STREAM_CHUNK', 1000):
+            self.assertEqual(list(FileSeq(files)), self.lines)
+
+    def test_close_stops_thread(self):
+        traceFile = self.write('indexserver_hostA.30003.000.trc.gz',
+                               self.lines)
+        threads = threading.active_count()
+
+        with mock.patch.object(traceutils, 'STREAM_CHUNK', 1000):
+            stream = ChunkStream(traceFile)
+            stream.read(10)
+
+        # hundreds of chunks, the thread waits for the reader when
+        # STREAM_CHUNKS of them are in the queue
+        threading.Event().wait(0.5)
+        self.assertEqual(threading.active_count(), threads + 1)
+
+        stream.close()
+
+        for _ in range(50):
+            if threading.active_count() == threads:
+                break
+
+            threading.Event().wait(0.1)
+
+        self.assertEqual(threading.active_count(), threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
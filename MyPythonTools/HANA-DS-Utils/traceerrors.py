@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import sys
+import argparse
+from hanads.traceutils import normalizeTimestamp, orderTraceFiles
+from hanads.tracemanifest import loadTraceListPerService
+from hanads.traceoutput import TraceWriter
+from hanads.traceerrors import findErrors, ERROR_LEVELS, CONTEXT_ENTRIES
+
+
+class __Conf:
+    def __init__(self):
+        parser = argparse.ArgumentParser(description="Show the error, fatal and warning entries of all services with the entries around them in timestamp order")
+        parser.add_argument('-s','--show-services', action='store_true',  help='Show all available services in the fsid')
+        parser.add_argument('--rescan', action='store_true', help='Rebuild the cached list of trace files of the fsid')
+        parser.add_argument('-o','--output', required=False, type=str, help='Output to file. If not given ouput will be written to stdout. Files ending with .gz, .bz2 or .xz are compressed.')
+        parser.add_argument('-i','--include-services', type=str, help='Comma seperated list of service index')
+        parser.add_argument('-l','--levels', type=str, default=','.join(ERROR_LEVELS), help='Comma seperated list of levels to report (default: {0})'.format(','.join(ERROR_LEVELS)))
+        parser.add_argument('-B','--before', type=int, help='Entries of the same service shown before every reported entry (default: {0})'.format(CONTEXT_ENTRIES))
+        parser.add_argument('-A','--after', type=int, help='Entries of the same service shown after every reported entry (default: {0})'.format(CONTEXT_ENTRIES))
+        parser.add_argument('-C','--context', type=int, default=CONTEXT_ENTRIES, help='Same as -B and -A together')
+        parser.add_argument('-p','--processes', type=int, help='Number of worker processes (default: number of CPUs)')
+        parser.add_argument('--from', dest='since', type=normalizeTimestamp, help='Only trace entries at or after this timestamp (e.g. "2018-02-24 19:20:00")')
+        parser.add_argument('--to', dest='until', type=normalizeTimestamp, help='Only trace entries before this timestamp')
+        parser.add_argument('fsidpath', nargs='+', help='Path to full system info dump directory or tar/tar.gz/zip archive of it. The trace files of a tar.gz/.bz2/.xz are unpacked into a temporary directory in one pass')
+
+        args = parser.parse_args()
+
+        self.fsidpath = args.fsidpath
+
+        if args.include_services is not None:
+            self.include_services = \
+                set([int(x.strip()) for x in args.include_services.split(",")])
+        else:
+            self.include_services = None
+
+        self.show_services = args.show_services
+        self.rescan = args.rescan
+        self.output = args.output
+        self.levels = ''.join(x.strip() for x in args.levels.split(","))
+        self.before = args.before if args.before is not None else args.context
+        self.after = args.after if args.after is not None else args.context
+        self.processes = args.processes
+        self.since = args.since
+        self.until = args.until
+
+        if self.before < 0 or self.after < 0:
+            parser.error('number of context entries can\'t be negative')
+
+
+conf = __Conf()
+
+
+def main():
+    tracedictionary = loadTraceListPerService(conf.fsidpath, conf.rescan)
+    services = tracedictionary.keys()
+
+    if (conf.show_services):
+        for count, service in enumerate(sorted(list(services))):
+            print("{0}: {1}".format(count, service))
+
+        sys.exit(0)
+
+    selected = []
+
+    for count, key in enumerate(sorted(list(services))):
+        if conf.include_services is None or count in conf.include_services:
+            files = orderTraceFiles(tracedictionary[key],
+                                    conf.since, conf.until)
+
+            if files:
+                selected.append((key, files))
+
+    writer = TraceWriter(conf.output)
+
+    try:
+        for entry in findErrors(selected, conf.levels, conf.before,
+                                conf.after, conf.since, conf.until,
+                                conf.processes):
+            writer.write(entry)
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
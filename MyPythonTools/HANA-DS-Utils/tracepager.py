@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 shiftwidth=4
+import sys
+import shutil
+import argparse
+from datetime import datetime, timedelta
+from hanads.traceutils import MergedView, normalizeTimestamp, formatEntry, \
+    servicePrefix
+from hanads.tracemanifest import loadTraceListPerService
+
+HELP = """\
+  Enter, n      next page
+  b             previous page
+  g TIMESTAMP   go to the first entry at or after TIMESTAMP
+  a TIMESTAMP   show the entries around TIMESTAMP
+  +SECONDS      go forward from the top of the page, e.g. +60
+  -SECONDS      go back from the top of the page, e.g. -3600
+  q             quit
+"""
+
+
+class __Conf:
+    def __init__(self):
+        parser = argparse.ArgumentParser(description="Page through the merged traces of all services without writing the merged trace first")
+        parser.add_argument('-s','--show-services', action='store_true',  help='Show all available services in the fsid')
+        parser.add_argument('--rescan', action='store_true', help='Rebuild the cached list of trace files of the fsid')
+        parser.add_argument('-i','--include-services', type=str, help='Comma seperated list of service index')
+        parser.add_argument('--from', dest='since', type=normalizeTimestamp, help='Start at this timestamp (e.g. "2018-02-24 19:20:00")')
+        parser.add_argument('fsidpath', nargs='+', help='Path to full system info dump directory or tar/tar.gz/zip archive of it. The trace files of a tar.gz/.bz2/.xz are unpacked into a temporary directory in one pass')
+
+        args = parser.parse_args()
+
+        self.fsidpath = args.fsidpath
+
+        if args.include_services is not None:
+            self.include_services = \
+                set([int(x.strip()) for x in args.include_services.split(",")])
+        else:
+            self.include_services = None
+
+        self.show_services = args.show_services
+        self.rescan = args.rescan
+        self.since = args.since
+
+
+conf = __Conf()
+
+
+def pageLines():
+    # one line is left for the prompt
+    return max(shutil.get_terminal_size().lines - 1, 1)
+
+
+def formatted(entry):
+    timestamp, key, lines = entry
+    text = formatEntry(lines, servicePrefix(key))
+
+    if not text.endswith('\n'):
+        text += '\n'
+
+    return text
+
+
+def showPage(entries):
+    """
+    Writes the entries until the page is full.
+    Returns the timestamp of the first entry written and the number of
+    entries, the first entry not written is left in entries.
+    """
+    lines = pageLines()
+    first = None
+    count = 0
+
+    for entry in entries:
+        text = formatted(entry)
+        sys.stdout.write(text)
+        count += 1
+
+        if first is None:
+            first = entry[0]
+
+        lines -= text.count('\n')
+
+        if lines <= 0:
+            break
+
+    return first, count
+
+
+def skipShown(entries, count):
+    """
+    Skips the entries already shown, so the next page continues after them
+    """
+    for _ in range(count):
+        next(entries, None)
+
+    return entries
+
+
+def shiftTimestamp(timestamp, seconds):
+    current = datetime.strptime(timestamp.strip(), '%Y-%m-%d %H:%M:%S.%f')
+
+    return (current + timedelta(seconds=seconds))\
+        .strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def main():
+    tracedictionary = loadTraceListPerService(conf.fsidpath, conf.rescan)
+    services = tracedictionary.keys()
+
+    if (conf.show_services):
+        for count, service in enumerate(sorted(list(services))):
+            print("{0}: {1}".format(count, service))
+
+        sys.exit(0)
+
+    selected = dict((key, tracedictionary[key])
+                    for count, key in enumerate(sorted(list(services)))
+                    if conf.include_services is None
+                    or count in conf.include_services)
+
+    view = MergedView(selected)
+    entries = view.entriesFrom(conf.since)
+    top, _ = showPage(entries)
+
+    while True:
+        try:
+            command = input("{0}: ".format(top.strip() if top else 'end'))\
+                .strip()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        try:
+            if command in ('', 'n'):
+                first, _ = showPage(entries)
+                top = first or top
+            elif command == 'q':
+                break
+            elif command == 'b':
+                if top is None:
+                    continue
+
+                before = view.entriesBefore(top, pageLines())
+
+                # as many of the entries before the top as fit the page
+                lines = 0
+                start = len(before)
+
+                while start > 0:
+                    lines += formatted(before[start-1]).count('\n')
+
+                    if lines > pageLines():
+                        break
+
+                    start -= 1
+
+                if start < len(before):
+                    top, count = showPage(iter(before[start:]))
+                    entries = skipShown(view.entriesFrom(top), count)
+            elif command[0] == 'g':
+                entries = view.entriesFrom(normalizeTimestamp(command[1:]))
+                top, _ = showPage(entries)
+            elif command[0] == 'a':
+                timestamp = normalizeTimestamp(command[1:])
+                around = view.entriesAround(timestamp, pageLines() // 2)
+                top, count = showPage(iter(around))
+                entries = skipShown(view.entriesFrom(timestamp), len(
+                    [entry for entry in around[:count]
+                     if entry[0] >= timestamp]))
+            elif command[0] in '+-' and top is not None:
+                entries = view.entriesFrom(
+                    shiftTimestamp(top, float(command)))
+                top, _ = showPage(entries)
+            else:
+                sys.stdout.write(HELP)
+        except ValueError as e:
+            sys.stdout.write("{0}\n".format(e))
+
+
+if __name__ == "__main__":
+    main()
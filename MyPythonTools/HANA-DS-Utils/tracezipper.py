@@ -1,10 +1,24 @@
 #!/usr/bin/env python3
 # vim: tabstop=4 shiftwidth=4
+import re
 import sys
 import argparse
 import heapq
-from hanads.traceutils import buildTraceListPerService, \
-    TraceTokenizer, FileSeq, mergeTrace
+from hanads.traceutils import TraceTokenizer, MmapTraceTokenizer, \
+    FileSeq, mergeTrace, normalizeTimestamp, \
+    orderTraceFiles, EntryFilter, FilteredTokenizer
+from hanads.traceindex import seekOffsets, PostingTraceTokenizer, \
+    INDEX_FIELDS
+from hanads.tracemanifest import loadTraceListPerService
+from hanads.traceparallel import mergeParallel
+from hanads.tracefollow import followTrace, FOLLOW_DELAY, FOLLOW_INTERVAL
+from hanads.tracearchive import isArchive
+from hanads.traceoutput import TraceWriter, parseSize
+from hanads.tracehistogram import buildHistogram, formatHistogramTable, \
+    formatHistogramCsv
+from hanads.tracedemux import DemuxWriter, DEMUX_FIELDS, DEMUX_OPEN_FILES
+from hanads.tracesample import Sampler
+from hanads.tracejson import formatJsonEntry
 
 
 class __Conf:
@@ -12,11 +26,49 @@ class __Conf:
         parser = argparse.ArgumentParser(description="Merge traces of multiple services in timestamp order")
         group1 = parser.add_argument_group("Show Services")
         group1.add_argument('-s','--show-services', action='store_true',  help='Show all available services in the fsid')
+        group1.add_argument('--rescan', action='store_true', help='Rebuild the cached list of trace files of the fsid')
 
         group2 = parser.add_argument_group("Zipping")
-        group2.add_argument('-o','--output', required=False, type=str, help='Output to file. If not given ouput will be written to stdout')
+        group2.add_argument('-o','--output', required=False, type=str, help='Output to file. If not given ouput will be written to stdout. Files ending with .gz, .bz2 or .xz are compressed.')
+        group2.add_argument('--split', type=parseSize, help='Start a new output file after this many bytes (e.g. 512M). Files are numbered like merged.000.trc.gz')
         group2.add_argument('-i','--include-services', type=str, help='Comma seperated list of service index')
-        parser.add_argument('fsidpath', nargs='+', help='Path to full system info dump directory')
+        group2.add_argument('--engine', choices=['line', 'mmap', 'bulk'], default='line', help='Tokenizer engine. mmap reads the trace files as memory mapped bytes, bulk merges complete files with numpy (default: line)')
+        group2.add_argument('-p','--parallel', action='store_true', help='Tokenize the services in worker processes, one per CPU (uses the mmap engine)')
+        group2.add_argument('--collapse', action='store_true', help='Replace consecutive repeats of a message within a service by one "last message repeated N times" line')
+        group2.add_argument('--json', action='store_true', help='Write every entry as one line of JSON with the fields of its header (host, service, thread, connection, transaction, update, timestamp, level, component, message)')
+        group2.add_argument('--from', dest='since', type=normalizeTimestamp, help='Only trace entries at or after this timestamp (e.g. "2018-02-24 19:20:00")')
+        group2.add_argument('--to', dest='until', type=normalizeTimestamp, help='Only trace entries before this timestamp')
+
+        group5 = parser.add_argument_group("Follow", "Merge the traces of a running system as they are written, like tail -f")
+        group5.add_argument('-f','--follow', action='store_true', help='Keep reading the growing trace files and new rotations. Starts at the end of the traces, or at --from if given.')
+        group5.add_argument('--delay', type=float, default=FOLLOW_DELAY, help='Seconds entries are held back so late services are still merged in order (default: {0})'.format(FOLLOW_DELAY))
+        group5.add_argument('--interval', type=float, default=FOLLOW_INTERVAL, help='Seconds between two polls of the trace files (default: {0})'.format(FOLLOW_INTERVAL))
+
+        group6 = parser.add_argument_group("Histogram", "Instead of the merged trace, count the entries and bytes per service, time bucket and level")
+        group6.add_argument('--histogram', action='store_true', help='Write the counts as a table')
+        group6.add_argument('--csv', action='store_true', help='Write the counts as CSV with one row per level')
+        group6.add_argument('--bucket', type=int, default=1, help='Seconds per time bucket (default: 1)')
+
+        group7 = parser.add_argument_group("Demux", "Instead of one merged trace, write every entry into a file per connection, thread or transaction in the -o directory. All files are written in one pass.")
+        group7.add_argument('--demux', choices=sorted(DEMUX_FIELDS), help='Field the entries are split by. Thread files are per service, e.g. hostA_in03_thread_25279.trc')
+        group7.add_argument('--max-open', type=int, default=DEMUX_OPEN_FILES, help='Maximum number of output files kept open (default: {0})'.format(DEMUX_OPEN_FILES))
+
+        group8 = parser.add_argument_group("Sample", "Only merge a random sample of the entries of every service, read in one pass")
+        group8.add_argument('--sample', type=int, help='Number of entries sampled per service, or per service and time bucket with --sample-bucket')
+        group8.add_argument('--sample-bucket', type=int, help='Seconds per time bucket for a stratified sample (e.g. 3600 for SAMPLE entries per hour)')
+        group8.add_argument('--seed', type=int, help='Seed of the random sample, the same seed gives the same sample')
+
+        group3 = parser.add_argument_group("Field filter", "Only merge the entries matching all given fields. The entries are looked up in a field index built per trace file on first use.")
+        group3.add_argument('--level', type=str, help='Comma seperated list of levels (e.g. "e,f")')
+        group3.add_argument('--component', type=str, help='Comma seperated list of components')
+        group3.add_argument('--thread', type=str, help='Comma seperated list of thread ids')
+        group3.add_argument('--connection', type=str, help='Comma seperated list of connection ids')
+        group3.add_argument('--transaction', type=str, help='Comma seperated list of transaction ids')
+
+        group4 = parser.add_argument_group("Pattern filter", "Regular expressions searched in the whole trace entry before it is formatted, ^ and $ match at every line. Matching entries are written with all their lines.")
+        group4.add_argument('--match', action='append', help='Only entries matching this pattern. Can be given multiple times, an entry has to match one of them.')
+        group4.add_argument('--exclude', action='append', help='Leave out entries matching this pattern. Can be given multiple times.')
+        parser.add_argument('fsidpath', nargs='+', help='Path to full system info dump directory or tar/tar.gz/zip archive of it. The trace files of a tar.gz/.bz2/.xz are unpacked into a temporary directory in one pass')
 
         args = parser.parse_args()
 
@@ -28,19 +80,112 @@ class __Conf:
         else:
             self.include_services = None
 
-        if args.output is None:
-            self.output = sys.stdout
-        else:
-            self.output = open(args.output, mode='w')
+        if args.split is not None and args.output is None:
+            parser.error('--split needs -o')
+
+        self.output = args.output
+        self.split = args.split
 
         self.show_services = args.show_services
+        self.rescan = args.rescan
+        self.since = args.since
+        self.until = args.until
+        self.engine = args.engine
+        self.parallel = args.parallel
+        self.collapse = args.collapse
+
+        if self.collapse and (self.engine == 'bulk' or args.follow
+                              or args.histogram or args.csv):
+            parser.error('--collapse can\'t be used with --engine bulk, --follow or --histogram')
+
+        self.criteria = {}
+
+        for field in INDEX_FIELDS:
+            values = getattr(args, field)
+
+            if values is not None:
+                self.criteria[field] = \
+                    set([x.strip() for x in values.split(",")])
+
+        if self.criteria and (self.engine == 'bulk' or self.parallel):
+            parser.error('field filter can\'t be used with --engine bulk or --parallel')
+
+        if args.match or args.exclude:
+            try:
+                self.entryFilter = EntryFilter(args.match, args.exclude)
+            except re.error as e:
+                parser.error('invalid pattern: {0}'.format(e))
+        else:
+            self.entryFilter = None
+
+        if self.entryFilter is not None and self.engine == 'bulk':
+            parser.error('--match/--exclude can\'t be used with --engine bulk')
+
+        self.histogram = args.histogram or args.csv
+        self.csv = args.csv
+        self.bucket = args.bucket
+
+        if self.histogram and (self.engine == 'bulk' or args.follow):
+            parser.error('--histogram can\'t be used with --engine bulk or --follow')
+
+        if self.bucket < 1:
+            parser.error('--bucket must be at least 1 second')
+
+        self.demux = args.demux
+        self.max_open = args.max_open
+
+        if self.demux is not None:
+            if self.output is None:
+                parser.error('--demux needs -o with the output directory')
+
+            if self.engine == 'bulk' or args.follow or self.histogram \
+                    or self.split is not None:
+                parser.error('--demux can\'t be used with --engine bulk, --follow, --histogram or --split')
+
+        if args.sample is not None:
+            if args.sample < 1:
+                parser.error('--sample must be at least 1')
+
+            if args.sample_bucket is not None and args.sample_bucket < 1:
+                parser.error('--sample-bucket must be at least 1 second')
+
+            if self.engine == 'bulk' or args.follow or self.histogram \
+                    or self.collapse:
+                parser.error('--sample can\'t be used with --engine bulk, --follow, --histogram or --collapse')
+
+            self.sampler = Sampler(args.sample, args.sample_bucket, args.seed)
+        elif args.sample_bucket is not None or args.seed is not None:
+            parser.error('--sample-bucket and --seed need --sample')
+        else:
+            self.sampler = None
+
+        if args.json:
+            if self.engine == 'bulk' or args.follow or self.histogram \
+                    or self.demux is not None:
+                parser.error('--json can\'t be used with --engine bulk, --follow, --histogram or --demux')
+
+            self.formatter = formatJsonEntry
+        else:
+            self.formatter = None
+
+        self.follow = args.follow
+        self.delay = args.delay
+        self.interval = args.interval
+
+        if self.follow:
+            if self.engine == 'bulk' or self.parallel or self.criteria \
+                    or self.until is not None:
+                parser.error('--follow can\'t be used with --engine bulk, --parallel, --to or a field filter')
+
+            if any(isArchive(p) for p in self.fsidpath):
+                parser.error('--follow needs fsid directories, not archives')
 
 
 conf = __Conf()
 
 
 def main():
-    tracedictionary = buildTraceListPerService(conf.fsidpath)
+    tracedictionary = loadTraceListPerService(conf.fsidpath, conf.rescan)
     services = tracedictionary.keys()
 
     if (conf.show_services):
@@ -49,16 +194,113 @@ def main():
 
         sys.exit(0)
 
-    queue = []
+    if conf.demux is not None:
+        writer = DemuxWriter(conf.output, conf.demux, conf.max_open)
+    else:
+        writer = TraceWriter(conf.output, conf.split)
+
+    try:
+        zipTrace(tracedictionary, writer)
+    finally:
+        writer.close()
+
+
+def zipTrace(tracedictionary, writer):
+    services = tracedictionary.keys()
+
+    if conf.follow:
+        followed = [(key, tracedictionary[key])
+                    for count, key in enumerate(sorted(list(services)))
+                    if conf.include_services is None
+                    or count in conf.include_services]
+
+        try:
+            for merged in followTrace(followed, conf.since, conf.delay,
+                                      conf.interval, conf.entryFilter):
+                if merged:
+                    writer.write(''.join(merged))
+                    writer.flush()
+        except KeyboardInterrupt:
+            pass
+
+        return
+
+    selected = []
 
     for count, key in enumerate(sorted(list(services))):
         if conf.include_services is None or count in conf.include_services:
-            tracetokenizer = TraceTokenizer(FileSeq(tracedictionary[key]))
-            heapq.heappush(
-                queue, (tracetokenizer.nextTimestamp(), key, tracetokenizer))
+            files = orderTraceFiles(tracedictionary[key],
+                                    conf.since, conf.until)
+
+            if files:
+                selected.append((key, files))
+
+    if conf.histogram:
+        histograms = buildHistogram(selected, conf.bucket, conf.since,
+                                    conf.until, conf.criteria,
+                                    conf.entryFilter)
+
+        if conf.csv:
+            lines = formatHistogramCsv(histograms)
+        else:
+            lines = formatHistogramTable(histograms)
+
+        for line in lines:
+            writer.write(line)
+
+        return
+
+    if conf.engine == 'bulk':
+        from hanads.bulkmerge import bulkMerge
+
+        bulkMerge(selected, writer, conf.since, conf.until)
+
+        return
+
+    if conf.parallel:
+        for entry in mergeParallel(selected, conf.since, conf.until,
+                                   entryFilter=conf.entryFilter,
+                                   collapse=conf.collapse,
+                                   sampler=conf.sampler,
+                                   formatter=conf.formatter):
+            writer.write(entry)
+
+        return
+
+    queue = []
+
+    for key, files in selected:
+        if conf.criteria:
+            tracetokenizer = PostingTraceTokenizer(
+                files, conf.criteria, since=conf.since)
+        elif conf.engine == 'mmap':
+            tracetokenizer = MmapTraceTokenizer(
+                files, seekOffsets(files, conf.since), since=conf.since)
+        else:
+            tracetokenizer = TraceTokenizer(
+                FileSeq(files, seekOffsets(files, conf.since)),
+                since=conf.since)
+
+        if conf.entryFilter is not None:
+            tracetokenizer = FilteredTokenizer(tracetokenizer,
+                                               conf.entryFilter)
+
+        if conf.sampler is not None:
+            tracetokenizer = conf.sampler(tracetokenizer, key, conf.until)
+
+        if tracetokenizer.nextTimestamp() is None:
+            continue
+
+        heapq.heappush(
+            queue, (tracetokenizer.nextTimestamp(), key, tracetokenizer))
+
+    merged = mergeTrace(queue, until=conf.until, collapse=conf.collapse,
+                        formatter=conf.formatter)
+
+    write = writer.write
 
-    for entry in mergeTrace(queue):
-        print(entry, end='')
+    for entry in merged:
+        write(entry)
 
 
 if __name__ == "__main__":